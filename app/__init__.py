@@ -1,67 +1,90 @@
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask
 import os
 import logging
-from logging.handlers import RotatingFileHandler
 import sys
 
+_import_seconds = time.perf_counter() - _import_started
+
 def create_app():
     try:
-        app = Flask(__name__)
+        from .utils.startup import StartupReport, set_startup_report
+        # Отсчёт ведётся с начала импорта пакета, без паузы до вызова create_app
+        report = StartupReport(time.perf_counter() - _import_seconds)
+        report.add('import', _import_seconds)
+        with report.phase('logging'):
+            app = Flask(__name__)
+            # orjson, если установлен: ответы кодируются в разы быстрее
+            from .utils.fast_json import FastJSONProvider
+            app.json = FastJSONProvider(app)
         
-        app.config['JSON_AS_ASCII'] = False
-        app.debug = False # False для логирования в файлы
+            app.config['JSON_AS_ASCII'] = False
+            app.config['UPSTREAM_PASSTHROUGH'] = os.environ.get('UPSTREAM_PASSTHROUGH', '1') == '1'
+            app.config['ASYNC_UPSTREAM'] = os.environ.get('ASYNC_UPSTREAM', '0') == '1'
+            app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+            app.config['MAX_REQUEST_TIMEOUT'] = float(os.environ.get('MAX_REQUEST_TIMEOUT', 120))
+            app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+            app.config['JOBS_MAX_TIMEOUT'] = float(os.environ.get('JOBS_MAX_TIMEOUT', 600))
+            app.config['JOBS_MAX_WAIT'] = float(os.environ.get('JOBS_MAX_WAIT', 30))
+            app.debug = False # False для логирования в файлы
 
-        root_logger = logging.getLogger()
-        root_logger.setLevel(logging.INFO)
+            root_logger = logging.getLogger()
+            root_logger.setLevel(logging.INFO)
         
-        if not root_logger.handlers:
-            console_handler = logging.StreamHandler(sys.stdout)
-            console_handler.setLevel(logging.INFO)
-            console_handler.setFormatter(logging.Formatter(
-                '%(asctime)s %(levelname)s: %(message)s'
-            ))
-            root_logger.addHandler(console_handler)
+            if not root_logger.handlers:
+                console_handler = logging.StreamHandler(sys.stdout)
+                console_handler.setLevel(logging.INFO)
+                console_handler.setFormatter(logging.Formatter(
+                    '%(asctime)s %(levelname)s: %(message)s'
+                ))
+                root_logger.addHandler(console_handler)
         
-        app.logger.setLevel(logging.INFO)
+            app.logger.setLevel(logging.INFO)
         
-        services_logger = logging.getLogger('neiro.services')
-        services_logger.setLevel(logging.DEBUG)
-        services_logger.propagate = True
+            services_logger = logging.getLogger('neiro.services')
+            services_logger.setLevel(logging.DEBUG)
+            services_logger.propagate = True
         
-        if not app.debug:
+            # Файлы логов пишет фоновый поток: потоки запросов только кладут записи в очередь
+            from .utils.log_pipeline import init_log_pipeline
             try:
-                if not os.path.exists('logs'):
-                    os.mkdir('logs')
-                
-                app_file_handler = RotatingFileHandler('logs/neuro_flask.log', maxBytes=10240, backupCount=20, encoding='utf-8')
-                app_file_handler.setFormatter(logging.Formatter(
-                    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-                ))
-                app_file_handler.setLevel(logging.INFO)
-                app.logger.addHandler(app_file_handler)
-                
-                trace_file_handler = RotatingFileHandler('logs/message_trace.log', maxBytes=10240, backupCount=10, encoding='utf-8')
-                trace_file_handler.setFormatter(logging.Formatter(
-                    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-                ))
-                trace_file_handler.setLevel(logging.DEBUG)
-                services_logger.addHandler(trace_file_handler)
-                
+                init_log_pipeline(app.logger.name, None if app.debug else 'logs')
                 app.logger.info('Запуск Flask-сервера нейросетей')
             except Exception as e:
                 app.logger.error(f'Ошибка при настройке файлового логирования: {str(e)}')
         
         try:
-            from .utils.yaml_loader import init_prompt_loader
-            prompt_loader = init_prompt_loader()
-            app.logger.info(f'Загружено промптов: {sum(len(prompts) for prompts in prompt_loader.prompts.values())}')
+            with report.phase('templates'):
+                from .utils.yaml_loader import init_prompt_loader
+                prompt_loader = init_prompt_loader()
+            report.add('templates.parse', prompt_loader.load_stats['parse_ms'] / 1000)
+            report.add('templates.compile', prompt_loader.load_stats['compile_ms'] / 1000)
+            if prompt_loader.lazy:
+                app.logger.info('Промпты загружаются по первому обращению к модели')
+            else:
+                app.logger.info(f'Загружено промптов: {sum(len(prompts) for prompts in prompt_loader.prompts.values())}')
         except Exception as e:
             app.logger.error(f'Ошибка при загрузке промптов: {str(e)}')
             raise
         
-        from .api.routes import main_routes
-        app.register_blueprint(main_routes)
+        with report.phase('registry'):
+            from .factories.ai_service_factory import AIServiceFactory
+            # По умолчанию модули провайдеров импортируются при первом запросе к модели
+            if os.environ.get('PROVIDERS_PRELOAD', '0') == '1':
+                AIServiceFactory.preload()
+        
+        with report.phase('routes'):
+            from .api.routes import main_routes
+            app.register_blueprint(main_routes)
+            # Сжатие ответов и распаковка тел запросов в gzip
+            from .utils.compression import init_compression
+            app.wsgi_app = init_compression(app.wsgi_app)
         
+        report.finish()
+        set_startup_report(report)
+        report.log(float(os.environ.get('STARTUP_TARGET_MS', 0)))
         return app
     except Exception as e:
         print(f"Критическая ошибка при создании приложения: {str(e)}")
@@ -1,8 +1,330 @@
-from flask import Blueprint, request, jsonify, current_app
+import logging
+import math
+import os
+import re
+import signal
+import time
+import uuid
+from contextlib import ExitStack
+from functools import partial
+from flask import Blueprint, Response, g, request, jsonify, current_app, stream_with_context
 from ..factories.ai_service_factory import AIServiceFactory
+from ..factories.failover_router import get_failover_router
+from ..services.context import RequestContext
 from ..utils.yaml_loader import get_prompt_loader
+from ..utils.http_pool import get_session_pool
+from ..utils.async_engine import get_async_engine
+from ..utils.response_cache import get_response_cache
+from ..utils.batch import get_batch_runner
+from ..utils.single_flight import get_single_flight
+from ..utils.rate_limiter import rate_limiters
+from ..utils.key_pool import key_pools
+from ..utils.circuit_breaker import circuit_breakers
+from ..utils.retry import retry_stats
+from ..utils.metrics import observe_request, render_metrics, request_labels, track_in_flight
+from ..utils.log_pipeline import get_log_pipeline, get_request_id, set_request_id
+from ..utils.exceptions import AdmissionRejected, ClientDisconnected, JobQueueFull, UpstreamError
+from ..utils.fast_json import RawResponse, dumps
+from ..utils.startup import get_startup_report
+from ..utils.timing import get_request_timer, span, start_request_timer
+from ..utils.profiler import get_profiler
+from ..utils.capture import get_traffic_capture
+from ..utils.compression import get_compression
+from ..utils.admission import get_admission_controller, socket_disconnected
+from ..utils.sessions import get_session_store
+from ..utils.jobs import CANCELLED, DEFAULT_PRIORITY, MAX_PRIORITY, MIN_PRIORITY, get_job_queue, get_job_queue_stats
 
 main_routes = Blueprint('main', __name__)
+timing_logger = logging.getLogger('neiro.services.timing')
+
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+# Имена аргументов generate_response: параметрами шаблона их передать нельзя
+RESERVED_PARAMETERS = frozenset({'message', 'prompt_template', 'request_context'})
+
+
+@main_routes.before_app_request
+def assign_request_id():
+    """Присваивает запросу идентификатор из X-Request-ID или новый, он попадает во все записи лога"""
+    request_id = request.headers.get('X-Request-ID', '')
+    if not _REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    set_request_id(request_id)
+    start_request_timer()
+    g.profile = get_profiler().begin()
+
+
+@main_routes.after_app_request
+def add_request_id_header(response):
+    request_id = get_request_id()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+@main_routes.after_app_request
+def add_server_timing(response):
+    """
+    Отдаёт длительности этапов запроса в заголовке Server-Timing и пишет
+    их в трассировку сервисов вместе с идентификатором запроса
+    """
+    timer = get_request_timer()
+    if timer is None:
+        return response
+    total = timer.elapsed()
+    g.status_code = response.status_code
+    if current_app.config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = timer.header(total)
+    timings = timer.as_dict()
+    if timings:
+        timing_logger.debug(
+            "Этапы запроса %s %s: %.1f мс", request.method, request.path, total * 1000,
+            extra={"timings": timings, "total_ms": round(total * 1000, 2), "status": response.status_code}
+        )
+    return response
+
+
+@main_routes.teardown_app_request
+def finish_request_profile(error=None):
+    """Сохраняет профиль запроса, если он попал в выборку или оказался медленным"""
+    profile = g.pop('profile', None)
+    timer = get_request_timer()
+    if profile is None or timer is None:
+        return
+    get_profiler().end(profile, timer.elapsed(), {
+        "request_id": get_request_id(),
+        "method": request.method,
+        "path": request.path,
+        "status": g.get('status_code', 500),
+        "timings": timer.as_dict()
+    })
+
+def _validate_process_data(data):
+    """Проверяет тело запроса на обработку, возвращает текст ошибки или None"""
+    if not data:
+        return "Отсутствуют данные запроса"
+    if 'model' not in data:
+        return "Не указана модель"
+    if 'message' not in data:
+        return "Отсутствует сообщение"
+    fallback = data.get('fallback', [])
+    if not isinstance(fallback, list) or not all(isinstance(name, str) for name in fallback):
+        return "Поле fallback должно быть списком имён моделей"
+    if 'timeout' in data and _parse_timeout(data['timeout']) is None:
+        return "Поле timeout должно быть положительным числом секунд"
+    parameters = data.get('parameters', {})
+    if not isinstance(parameters, dict):
+        return "Поле parameters должно быть объектом"
+    reserved = sorted(RESERVED_PARAMETERS.intersection(parameters))
+    if reserved:
+        return f"Имена параметров зарезервированы: {', '.join(reserved)}"
+    return None
+
+
+def _parse_timeout(value):
+    """Разбирает таймаут запроса в секундах, возвращает None, если значение некорректно"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if 0 < timeout < math.inf else None
+
+
+def _header_timeout():
+    """Возвращает заголовок X-Request-Timeout и текст ошибки, если он некорректен"""
+    header_timeout = request.headers.get('X-Request-Timeout')
+    if header_timeout is not None and _parse_timeout(header_timeout) is None:
+        return header_timeout, "Заголовок X-Request-Timeout должен быть положительным числом секунд"
+    return header_timeout, None
+
+
+def _request_timeout(data, max_timeout=None, header_timeout=None):
+    """
+    Время ожидания запроса: из поля timeout или заголовка X-Request-Timeout,
+    не больше max_timeout
+    """
+    timeout = _parse_timeout(data.get('timeout', header_timeout))
+    if max_timeout:
+        timeout = min(timeout, max_timeout) if timeout else max_timeout
+    return timeout
+
+
+def _request_context(data, max_timeout=None, header_timeout=None, started=None):
+    """
+    Создаёт контекст запроса с дедлайном, отсчитанным от started
+    (по умолчанию от текущего момента)
+    """
+    timeout = _request_timeout(data, max_timeout, header_timeout)
+    deadline = (started or time.monotonic()) + timeout if timeout else None
+    return RequestContext(cache=data.get('cache'), deadline=deadline)
+
+
+def _admit(data):
+    """
+    Ждёт места для обработки запроса в очереди его класса приоритета
+    (заголовок X-Priority или клиент X-Client-ID). Время в очереди
+    засчитывается в дедлайн запроса
+
+    Returns:
+        tuple: (место обработки или None, ответ с ошибкой или None)
+    """
+    admission = get_admission_controller()
+    if not admission.enabled:
+        return None, None
+    try:
+        priority_class = admission.classify(request.headers.get('X-Priority'), request.headers.get('X-Client-ID'))
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    
+    g.admission_started = time.monotonic()
+    timeout = _request_timeout(
+        data if isinstance(data, dict) else {},
+        current_app.config.get('MAX_REQUEST_TIMEOUT'),
+        request.headers.get('X-Request-Timeout')
+    )
+    sock = request.environ.get('werkzeug.socket')
+    try:
+        with span('admission'):
+            ticket = admission.admit(
+                priority_class,
+                deadline=g.admission_started + timeout if timeout else None,
+                disconnected=partial(socket_disconnected, sock) if sock is not None else None
+            )
+    except AdmissionRejected as e:
+        current_app.logger.warning(str(e))
+        response = jsonify({"error": str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(math.ceil(e.retry_after or 0), 1))
+        return None, response
+    except ClientDisconnected as e:
+        current_app.logger.info(str(e))
+        # 499 - клиент закрыл соединение (как в nginx); ответ никто не прочитает
+        return None, (jsonify({"error": str(e)}), 499)
+    return ticket, None
+
+
+def _release_on_close(response, ticket):
+    """Освобождает место обработки, когда ответ отдан (для потока - после последнего события)"""
+    if ticket is not None:
+        response.call_on_close(partial(get_admission_controller().release, ticket))
+    return response
+
+
+def _upstream_error_response(error):
+    """Формирует ответ на ошибку провайдера с его кодом и Retry-After"""
+    current_app.logger.error(f"Ошибка запроса к нейросети: {str(error)}")
+    response = jsonify({"error": str(error)})
+    response.status_code = error.status_code
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(max(math.ceil(error.retry_after), 1))
+    return response
+
+
+def _sse_event(payload, event=None):
+    """Кодирует одно событие Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {dumps(payload)}\n\n"
+
+
+def _stream_response(service, data, session=None, context=None):
+    """Проксирует потоковый ответ модели клиенту в формате SSE, не дольше дедлайна context"""
+    try:
+        chunks = service.generate_stream(
+            message=data['message'],
+            prompt_template=data.get('prompt_template'),
+            request_context=context,
+            **_generation_kwargs(data, session)
+        )
+    except ValueError as e:
+        current_app.logger.error(f"Ошибка подготовки потокового запроса: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except UpstreamError as e:
+        return _upstream_error_response(e)
+    
+    # Итог потока для метрик: известен, только когда поток закрыт
+    outcome = g.stream_outcome = {"status": 200, "usage": None}
+    
+    def generate():
+        parts = []
+        try:
+            for chunk in chunks:
+                if session is not None:
+                    parts.append(_delta_text(chunk))
+                if isinstance(chunk, dict) and isinstance(chunk.get('usage'), dict):
+                    outcome["usage"] = chunk['usage']
+                yield _sse_event(chunk)
+            yield "data: [DONE]\n\n"
+            if session is not None:
+                _record_turn(session, data['message'], "".join(parts))
+        except GeneratorExit:
+            outcome["status"] = 499  # клиент закрыл соединение, не дочитав поток
+            raise
+        except Exception as e:
+            current_app.logger.error(f"Ошибка при чтении потока: {str(e)}")
+            outcome["status"] = e.status_code if isinstance(e, UpstreamError) else 500
+            yield _sse_event({"error": str(e)}, event="error")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _generation_kwargs(data, session=None):
+    """Параметры генерации запроса; для сессии - вместе с историей диалога"""
+    kwargs = dict(data.get('parameters', {}))
+    if session is not None:
+        kwargs['history'] = session.messages
+    return kwargs
+
+
+def _apply_session(data):
+    """
+    Дополняет запрос моделью, шаблоном и параметрами сессии из поля session_id
+
+    Returns:
+        tuple: (данные запроса, сессия или None, текст ошибки или None)
+    """
+    if not isinstance(data, dict) or data.get('session_id') is None:
+        return data, None, None
+    session = get_session_store().get(str(data['session_id']))
+    if session is None:
+        return data, None, f"Сессия {data['session_id']} не найдена"
+    merged = dict(data)
+    merged.setdefault('model', session.model)
+    if session.prompt_template and 'prompt_template' not in data:
+        merged['prompt_template'] = session.prompt_template
+    parameters = data.get('parameters') or {}
+    if isinstance(parameters, dict):
+        merged['parameters'] = {**session.parameters, **parameters}
+    return merged, session, None
+
+
+def _reply_text(response):
+    """Текст ответа модели из ответа провайдера"""
+    try:
+        return response['choices'][0]['message']['content'] or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
+
+
+def _delta_text(chunk):
+    """Текст из чанка потокового ответа"""
+    try:
+        return chunk['choices'][0]['delta'].get('content') or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def _record_turn(session, message, reply):
+    """Дописывает в историю сессии сообщение пользователя и ответ модели"""
+    get_session_store().append(session.id, (
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": reply}
+    ))
+
 
 @main_routes.route('/api/process', methods=['POST'])
 def process_message():
@@ -14,49 +336,540 @@ def process_message():
         "model": "chatgpt",      // Имя модели (chatgpt, deepseek, etc)
         "message": "Привет!",    // Текст сообщения пользователя
         "prompt_template": "base", // (опционально) Имя шаблона промпта
-        "parameters": {}         // (опционально) Дополнительные параметры
+        "parameters": {},        // (опционально) Дополнительные параметры
+        "stream": false,         // (опционально) Потоковый ответ в формате SSE
+        "cache": null,           // (опционально) true/false - принудительно включить/выключить кэш
+        "fallback": [],          // (опционально) Резервные модели на случай сбоя основной
+        "hedge": false,          // (опционально) Дублировать запрос резервной модели, если основная медлит
+        "timeout": 30,           // (опционально) Сколько секунд клиент готов ждать ответа, включая повторы
+        "session_id": null       // (опционально) Сессия: модель и шаблон берутся из неё, ответ дописывается в историю
     }
+    
+    Время ожидания можно передать и заголовком X-Request-Timeout,
+    класс приоритета (при ADMISSION_CONCURRENCY) - заголовком X-Priority
     """
+    with span('parse'):
+        data = request.get_json(silent=True)
+    return _observed_process(data)
+
 
+def _observed_process(data):
+    """Обрабатывает запрос /api/process с учётом сессии и записывает метрики"""
+    data, session, error = _apply_session(data)
+    if error:
+        current_app.logger.warning(error)
+        return jsonify({"error": error}), 404
+    
+    capture = get_traffic_capture()
+    if capture is not None and not capture.sampled():
+        capture = None
+    arrived = time.time()
+    model, prompt_template = _metric_labels(data)
+    with ExitStack() as in_flight:
+        in_flight.enter_context(track_in_flight(model))
+        started = time.perf_counter()
+        ticket, rejected = _admit(data)
+        try:
+            response = current_app.make_response(rejected or _process_message(data, session))
+        except BaseException:
+            if ticket is not None:
+                get_admission_controller().release(ticket)
+            raise
+        _release_on_close(response, ticket)
+        duration = time.perf_counter() - started
+        context = g.get('request_context')
+        if response.is_streamed:
+            _observe_on_close(response, in_flight.pop_all(), model, prompt_template, started, context,
+                              g.get('stream_outcome'))
+        else:
+            observe_request(
+                model,
+                prompt_template,
+                response.status_code,
+                duration,
+                context.upstream_time if context is not None else 0.0,
+                g.get('upstream_usage')
+            )
+    if capture is not None:
+        capture.record(data, request.content_length, arrived, duration, response, context,
+                       g.get('upstream_usage'), get_request_id())
+    return response
+
+
+def _observe_on_close(response, in_flight, model, prompt_template, started, context, outcome):
+    """
+    Записывает метрики потокового ответа, когда поток закрыт (дочитан или
+    прерван клиентом); до этого запрос считается в обработке
+    """
+    outcome = outcome or {}
+    # Замыкание не ссылается на сам ответ: иначе ответ, который так и не закрыли,
+    # освобождается сборщиком циклов посреди другого запроса
+    status = response.status_code
+    
+    def observe():
+        with in_flight:
+            observe_request(
+                model,
+                prompt_template,
+                outcome.get("status", status),
+                time.perf_counter() - started,
+                context.upstream_time if context is not None else 0.0,
+                outcome.get("usage")
+            )
+    
+    response.call_on_close(observe)
+
+
+def _metric_labels(data):
+    """Метки метрик для тела запроса"""
+    return request_labels(data, AIServiceFactory.get_available_models(), _has_template)
+
+
+def _has_template(model, template):
+    """Есть ли шаблон у модели. В ленивом режиме загружает шаблоны модели"""
+    return get_prompt_loader().get_compiled_prompt(model, template) is not None
+
+
+def _process_message(data, session=None):
+    """Обработка запроса /api/process"""
     try:
-        data = request.json
         
-        if not data:
-            current_app.logger.warning("Отсутствуют данные запроса")
-            return jsonify({"error": "Отсутствуют данные запроса"}), 400
-            
-        if 'model' not in data:
-            current_app.logger.warning("Не указана модель")
-            return jsonify({"error": "Не указана модель"}), 400
-            
-        if 'message' not in data:
-            current_app.logger.warning("Отсутствует сообщение")
-            return jsonify({"error": "Отсутствует сообщение"}), 400
+        error = _validate_process_data(data)
+        if error:
+            current_app.logger.warning(error)
+            return jsonify({"error": error}), 400
+        
+        header_timeout, error = _header_timeout()
+        if error:
+            return jsonify({"error": error}), 400
         
         try:
-            service = AIServiceFactory.get_service(data['model'])
+            with span('service'):
+                service = AIServiceFactory.get_service(data['model'])
         except ValueError as e:
             current_app.logger.error(f"Ошибка создания сервиса: {str(e)}")
             return jsonify({"error": str(e)}), 400
         
-        response = service.generate_response(
-            message=data['message'],
-            prompt_template=data.get('prompt_template'),
-            **(data.get('parameters', {}))
-        )
+        if data.get('stream'):
+            g.request_context = _request_context(
+                data, current_app.config.get('MAX_REQUEST_TIMEOUT'), header_timeout, g.get('admission_started')
+            )
+            return _stream_response(service, data, session, g.request_context)
         
+        kwargs = _generation_kwargs(data, session)
         
-        if "error" in response:
-            current_app.logger.error(f"Ошибка в ответе нейросети: {response['error']}")
-            return jsonify(response), 400
+        def invoke(service, context):
+            return service.generate_response(
+                message=data['message'],
+                prompt_template=data.get('prompt_template'),
+                request_context=context,
+                **kwargs
+            )
+        
+        async def ainvoke(service, context):
+            return await service.agenerate_response(
+                message=data['message'],
+                prompt_template=data.get('prompt_template'),
+                request_context=context,
+                **kwargs
+            )
+        
+        chain = [data['model']] + [name for name in data.get('fallback', []) if name != data['model']]
+        g.request_context = _request_context(
+            data, current_app.config.get('MAX_REQUEST_TIMEOUT'), header_timeout, g.get('admission_started')
+        )
+        # Ответ провайдера отдаётся клиенту без разбора, если его не нужно дописывать в историю сессии
+        g.request_context.raw = session is None and current_app.config.get('UPSTREAM_PASSTHROUGH', False)
+        try:
+            if current_app.config.get('ASYNC_UPSTREAM'):
+                # Поток сервера ждёт ответа и здесь; в event loop уходят попытки и дублирующие запросы
+                model_used, response, context = get_async_engine().run(
+                    get_failover_router().agenerate(chain, ainvoke, g.request_context, hedge=bool(data.get('hedge'))),
+                    timeout=g.request_context.remaining()
+                )
+            else:
+                model_used, response, context = get_failover_router().generate(
+                    chain,
+                    invoke,
+                    g.request_context,
+                    hedge=bool(data.get('hedge'))
+                )
+        except ValueError as e:
+            current_app.logger.error(f"Ошибка создания сервиса: {str(e)}")
+            return jsonify({"error": str(e)}), 400
+        
+        g.request_context = context
         
-        return jsonify(response)
+        if isinstance(response, RawResponse):
+            g.upstream_usage = response.usage()
+            with span('render'):
+                result = current_app.response_class(response.body, content_type=response.content_type)
+        else:
+            g.upstream_usage = response.get('usage')
+            if "error" in response:
+                current_app.logger.error(f"Ошибка в ответе нейросети: {response['error']}")
+                return jsonify(response), 400
+            
+            if session is not None:
+                _record_turn(session, data['message'], _reply_text(response))
+            
+            with span('render'):
+                result = jsonify(response)
+        result.headers['X-Model-Used'] = model_used
+        if context.cache_status:
+            result.headers['X-Cache'] = context.cache_status.upper()
+        if context.retries:
+            result.headers['X-Retry-Count'] = str(context.retries)
+        return result
         
+    except UpstreamError as e:
+        return _upstream_error_response(e)
+    except TimeoutError as e:
+        current_app.logger.error(f"Истекло время ожидания ответа: {str(e)}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         current_app.logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=True)
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
 
+@main_routes.route('/api/process/stream', methods=['POST'])
+def process_message_stream():
+    """
+    Обрабатывает сообщение и возвращает ответ нейросети потоком SSE.
+    Принимает тот же JSON, что и /api/process, и обрабатывается так же:
+    с допуском, дедлайном и метриками, записываемыми при закрытии потока
+    """
+    with span('parse'):
+        data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = dict(data, stream=True)
+    return _observed_process(data)
+
+
+def _process_batch_item(logger, max_timeout, labels_of, item):
+    """Обрабатывает один элемент пакета, возвращает (статус, тело ответа)"""
+    model, prompt_template = labels_of(item)
+    with track_in_flight(model):
+        started = time.perf_counter()
+        status, body, context = _run_batch_item(logger, max_timeout, item)
+        observe_request(
+            model,
+            prompt_template,
+            status,
+            time.perf_counter() - started,
+            context.upstream_time if context is not None else 0.0,
+            body.get('usage')
+        )
+    return status, body
+
+
+async def _aprocess_batch_item(logger, max_timeout, labels_of, item):
+    """Асинхронный аналог _process_batch_item, выполняется в AsyncEngine"""
+    model, prompt_template = labels_of(item)
+    with track_in_flight(model):
+        started = time.perf_counter()
+        status, body, context = await _arun_batch_item(logger, max_timeout, item)
+        observe_request(
+            model,
+            prompt_template,
+            status,
+            time.perf_counter() - started,
+            context.upstream_time if context is not None else 0.0,
+            body.get('usage')
+        )
+    return status, body
+
+
+def _run_batch_item(logger, max_timeout, item):
+    """Выполняет элемент пакета, возвращает (статус, тело ответа, контекст запроса или None)"""
+    context = None
+    try:
+        error = _validate_process_data(item if isinstance(item, dict) else None)
+        if error:
+            return 400, {"error": error}, context
+        
+        def invoke(service, attempt_context):
+            return service.generate_response(
+                message=item['message'],
+                prompt_template=item.get('prompt_template'),
+                request_context=attempt_context,
+                **(item.get('parameters', {}))
+            )
+        
+        chain = [item['model']] + [name for name in item.get('fallback', []) if name != item['model']]
+        context = _request_context(item, max_timeout)
+        try:
+            _, response, context = get_failover_router().generate(chain, invoke, context, hedge=bool(item.get('hedge')))
+        except ValueError as e:
+            return 400, {"error": str(e)}, context
+        if "error" in response:
+            return 400, response, context
+        return 200, response, context
+        
+    except UpstreamError as e:
+        logger.error(f"Ошибка запроса к нейросети в пакете: {str(e)}")
+        return e.status_code, {"error": str(e)}, context
+    except TimeoutError as e:
+        return 504, {"error": str(e)}, context
+    except Exception as e:
+        logger.error(f"Ошибка при обработке элемента пакета: {str(e)}", exc_info=True)
+        return 500, {"error": "Внутренняя ошибка сервера"}, context
+
+
+async def _arun_batch_item(logger, max_timeout, item):
+    """Асинхронный аналог _run_batch_item: попытки выполняются в event loop без отдельного потока"""
+    context = None
+    try:
+        error = _validate_process_data(item if isinstance(item, dict) else None)
+        if error:
+            return 400, {"error": error}, context
+        
+        async def invoke(service, attempt_context):
+            return await service.agenerate_response(
+                message=item['message'],
+                prompt_template=item.get('prompt_template'),
+                request_context=attempt_context,
+                **(item.get('parameters', {}))
+            )
+        
+        chain = [item['model']] + [name for name in item.get('fallback', []) if name != item['model']]
+        context = _request_context(item, max_timeout)
+        try:
+            _, response, context = await get_failover_router().agenerate(
+                chain, invoke, context, hedge=bool(item.get('hedge'))
+            )
+        except ValueError as e:
+            return 400, {"error": str(e)}, context
+        if "error" in response:
+            return 400, response, context
+        return 200, response, context
+        
+    except UpstreamError as e:
+        logger.error(f"Ошибка запроса к нейросети в пакете: {str(e)}")
+        return e.status_code, {"error": str(e)}, context
+    except TimeoutError as e:
+        return 504, {"error": str(e)}, context
+    except Exception as e:
+        logger.error(f"Ошибка при обработке элемента пакета: {str(e)}", exc_info=True)
+        return 500, {"error": "Внутренняя ошибка сервера"}, context
+
+
+def _batch_processor(max_timeout):
+    """
+    Обработчик элемента пакета или задания: корутина для AsyncEngine
+    при ASYNC_UPSTREAM, иначе функция для пула потоков
+    """
+    process = _aprocess_batch_item if current_app.config.get('ASYNC_UPSTREAM') else _process_batch_item
+    return partial(
+        process,
+        current_app.logger,
+        max_timeout,
+        partial(request_labels, known_models=AIServiceFactory.get_available_models(), has_template=_has_template)
+    )
+
+
+@main_routes.route('/api/process/batch', methods=['POST'])
+def process_batch():
+    """
+    Обрабатывает пакет сообщений параллельно
+    
+    Ожидаемый JSON:
+    {
+        "items": [ {...}, ... ], // Элементы в формате /api/process
+        "stream": false          // (опционально) Отдавать результаты в NDJSON по мере готовности
+    }
+    
+    Результаты возвращаются в порядке входных элементов, ошибки - для каждого элемента отдельно
+    """
+    data = request.json
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        current_app.logger.warning("Отсутствуют элементы пакета")
+        return jsonify({"error": "Отсутствуют элементы пакета"}), 400
+    
+    max_items = current_app.config.get('BATCH_MAX_ITEMS', 1000)
+    if len(items) > max_items:
+        return jsonify({"error": f"Слишком много элементов в пакете (максимум {max_items})"}), 400
+    
+    def batch_result(index, status, body):
+        if status == 200:
+            return {"index": index, "status": status, "response": body}
+        return {"index": index, "status": status, "error": body.get("error")}
+    
+    runner = get_batch_runner()
+    process_item = _batch_processor(current_app.config.get('MAX_REQUEST_TIMEOUT'))
+    provider_of = lambda item: item.get('model', '') if isinstance(item, dict) else ''
+    results = runner.run(items, process_item, provider_of, asynchronous=current_app.config.get('ASYNC_UPSTREAM', False))
+    
+    stream = data.get('stream') or request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        def generate():
+            for index, (status, body) in results:
+                yield dumps(batch_result(index, status, body)) + "\n"
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={"X-Accel-Buffering": "no"}
+        )
+    
+    ordered = [None] * len(items)
+    # Этапы элементов не суммируются в замер запроса: пакет - один этап по времени ожидания
+    with span('batch'):
+        for index, (status, body) in results:
+            ordered[index] = batch_result(index, status, body)
+    return jsonify({"results": ordered})
+
+
+def _job_queue():
+    """Очередь заданий; задание выполняется так же, как элемент пакета"""
+    return get_job_queue(
+        _batch_processor(current_app.config.get('JOBS_MAX_TIMEOUT')),
+        asynchronous=current_app.config.get('ASYNC_UPSTREAM', False)
+    )
+
+
+@main_routes.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Ставит запрос в очередь заданий и сразу возвращает идентификатор задания
+    
+    Ожидаемый JSON - как у /api/process (без stream и session_id), а также:
+    {
+        "priority": 5,                              // (опционально) 0-9, больше - раньше
+        "webhook": "https://example.com/callback"   // (опционально) Куда отправить результат POST-запросом
+    }
+    """
+    data = request.get_json(silent=True)
+    error = _validate_process_data(data)
+    if not error and data['model'] not in AIServiceFactory.get_available_models():
+        error = f"Модель '{data['model']}' не найдена"
+    if not error and (data.get('stream') or data.get('session_id') is not None):
+        error = "Задания не поддерживают потоковый ответ и сессии"
+    priority = data.get('priority', DEFAULT_PRIORITY) if isinstance(data, dict) else DEFAULT_PRIORITY
+    if not error and (isinstance(priority, bool) or not isinstance(priority, int) or not MIN_PRIORITY <= priority <= MAX_PRIORITY):
+        error = f"Поле priority должно быть целым числом от {MIN_PRIORITY} до {MAX_PRIORITY}"
+    queue = _job_queue()
+    webhook = data.get('webhook') if isinstance(data, dict) else None
+    if not error and webhook is not None:
+        error = queue.webhooks.validate(webhook)
+    if error:
+        current_app.logger.warning(error)
+        return jsonify({"error": error}), 400
+    
+    payload = {key: value for key, value in data.items() if key not in ('priority', 'webhook')}
+    try:
+        job = queue.submit(payload, priority, webhook)
+    except JobQueueFull as e:
+        current_app.logger.warning(str(e))
+        response = jsonify({"error": str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+
+@main_routes.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Возвращает состояние задания. С параметром ?wait=N ждёт завершения
+    задания до N секунд (не больше JOBS_MAX_WAIT)
+    """
+    wait = request.args.get('wait')
+    if wait is not None:
+        wait = _parse_timeout(wait)
+        if wait is None:
+            return jsonify({"error": "Параметр wait должен быть положительным числом секунд"}), 400
+        wait = min(wait, current_app.config.get('JOBS_MAX_WAIT', 30))
+    
+    queue = _job_queue()
+    job = queue.wait(job_id, wait) if wait else queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Задание {job_id} не найдено"}), 404
+    return jsonify(job)
+
+
+@main_routes.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Отменяет задание, ещё не взятое в работу"""
+    job = _job_queue().cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Задание {job_id} не найдено"}), 404
+    if job["status"] != CANCELLED:
+        return jsonify(dict(job, error="Задание уже выполняется или завершено")), 409
+    return jsonify(job)
+
+
+@main_routes.route('/api/sessions', methods=['POST'])
+def create_session():
+    """
+    Создаёт сессию диалога
+    
+    Ожидаемый JSON:
+    {
+        "model": "chatgpt",        // Имя модели
+        "prompt_template": "base", // (опционально) Шаблон: его системные сообщения идут перед историей
+        "parameters": {}           // (опционально) Параметры по умолчанию для сообщений сессии
+    }
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'model' not in data:
+        return jsonify({"error": "Не указана модель"}), 400
+    if data['model'] not in AIServiceFactory.get_available_models():
+        return jsonify({"error": f"Модель '{data['model']}' не найдена"}), 400
+    prompt_template = data.get('prompt_template')
+    if prompt_template is not None and not (isinstance(prompt_template, str) and _has_template(data['model'], prompt_template)):
+        return jsonify({"error": f"Шаблон промпта '{prompt_template}' не найден"}), 400
+    parameters = data.get('parameters', {})
+    if not isinstance(parameters, dict):
+        return jsonify({"error": "Поле parameters должно быть объектом"}), 400
+    reserved = sorted(RESERVED_PARAMETERS.intersection(parameters))
+    if reserved:
+        return jsonify({"error": f"Имена параметров зарезервированы: {', '.join(reserved)}"}), 400
+    
+    session = get_session_store().create(data['model'], prompt_template, parameters)
+    return jsonify(session.to_dict()), 201
+
+
+@main_routes.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Возвращает сессию с историей сообщений"""
+    session = get_session_store().get(session_id)
+    if session is None:
+        return jsonify({"error": f"Сессия {session_id} не найдена"}), 404
+    return jsonify(session.to_dict())
+
+
+@main_routes.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Удаляет сессию"""
+    if not get_session_store().delete(session_id):
+        return jsonify({"error": f"Сессия {session_id} не найдена"}), 404
+    return jsonify({"status": "success"})
+
+
+@main_routes.route('/api/sessions/<session_id>/messages', methods=['POST'])
+def post_session_message(session_id):
+    """
+    Отправляет сообщение в сессию. Принимает тот же JSON, что и /api/process,
+    но достаточно поля message: модель, шаблон и история берутся из сессии
+    """
+    data = request.get_json(silent=True)
+    data = dict(data, session_id=session_id) if isinstance(data, dict) else {"session_id": session_id}
+    return _observed_process(data)
+
+
+@main_routes.route('/metrics', methods=['GET'])
+def metrics():
+    """Возвращает метрики в формате Prometheus"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @main_routes.route('/api/models', methods=['GET'])
 def list_models():
     """Возвращает список доступных моделей"""
@@ -65,25 +878,89 @@ def list_models():
     })
 
 
+@main_routes.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Возвращает статистику работы сервера"""
+    return jsonify({
+        "pool": get_session_pool().stats(),
+        "async": get_async_engine().stats(),
+        "cache": get_response_cache().stats(),
+        "batch": get_batch_runner().stats(),
+        "single_flight": get_single_flight().stats(),
+        "rate_limits": rate_limiters.stats(),
+        "api_keys": key_pools.stats(),
+        "circuit_breakers": circuit_breakers.stats(),
+        "failover": get_failover_router().stats(),
+        "retries": retry_stats.stats(),
+        "sessions": get_session_store().stats(),
+        "jobs": get_job_queue_stats(),
+        "logging": get_log_pipeline().stats() if get_log_pipeline() else None,
+        "prompts": {
+            "version": get_prompt_loader().version,
+            "count": get_prompt_loader().snapshot.count(),
+            "lazy": get_prompt_loader().lazy,
+            "bundle": get_prompt_loader().bundle_path
+        },
+        "startup": get_startup_report().as_dict() if get_startup_report() else None,
+        "profiler": get_profiler().stats(),
+        "capture": get_traffic_capture().stats() if get_traffic_capture() else None,
+        "compression": get_compression().stats() if get_compression() else None,
+        "admission": get_admission_controller().stats()
+    })
+
+
+def _prompts_response(snapshot, model_name=None):
+    """
+    Ответ со списком промптов и ETag по содержимому реестра. Если у клиента
+    та же версия (If-None-Match), отдаётся 304 без кодирования шаблонов
+    """
+    etag = snapshot.fingerprint(model_name)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(snapshot.prompts if model_name is None else snapshot.prompts[model_name])
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @main_routes.route('/api/prompts', methods=['GET'])
 def list_prompts():
     """Возвращает список доступных промптов для всех моделей"""
     prompt_loader = get_prompt_loader()
-    return jsonify(prompt_loader.prompts)
+    prompt_loader.ensure_loaded()
+    return _prompts_response(prompt_loader.snapshot)
 
 
 @main_routes.route('/api/prompts/<model_name>', methods=['GET'])
 def list_model_prompts(model_name):
     """Возвращает список доступных промптов для указанной модели"""
     prompt_loader = get_prompt_loader()
-    if model_name in prompt_loader.prompts:
-        return jsonify(prompt_loader.prompts[model_name])
+    prompt_loader.ensure_loaded(model_name)
+    snapshot = prompt_loader.snapshot
+    if model_name in snapshot.prompts:
+        return _prompts_response(snapshot, model_name)
     return jsonify({"error": f"Модель {model_name} не найдена"}), 404
 
 
 @main_routes.route('/api/reload', methods=['POST'])
 def reload_prompts():
     """Перезагружает все промпты"""
+    master_pid = current_app.config.get('MASTER_PID')
+    if master_pid and master_pid != os.getpid():
+        # В многопроцессном режиме промпты перечитывает главный процесс и заменяет воркеры
+        os.kill(master_pid, signal.SIGHUP)
+        return jsonify({
+            "status": "success",
+            "message": "Перезагрузка промптов запущена"
+        }), 202
+    
     prompt_loader = get_prompt_loader()
-    prompt_loader.load_all_prompts()
-    return jsonify({"status": "success", "message": "Промпты перезагружены"}) 
\ No newline at end of file
+    snapshot = prompt_loader.load_all_prompts()
+    key_pools.reload()
+    return jsonify({
+        "status": "success",
+        "message": "Промпты перезагружены",
+        "version": snapshot.version,
+        "count": snapshot.count()
+    }) 
\ No newline at end of file
@@ -1,24 +1,30 @@
-from typing import Dict, List, Type
-from ..services import (
-    AIModelService,
-    ChatGPTService,
-    DeepSeekService,
-    OpenRouterDeepSeekService
-)
+import importlib
+import os
+import threading
+from typing import Dict, List, Type, Union
+from ..services.base import AIModelService
+from ..utils.rate_limiter import ProviderRateLimiter, get_rate_limiter
 
 class AIServiceFactory:
-    """Фабрика для создания сервисов нейросетей"""
+    """
+    Фабрика для создания сервисов нейросетей. Провайдеры регистрируются
+    по пути импорта и импортируются только при первом обращении
+    """
     
-    _services: Dict[str, Type[AIModelService]] = {
-        "chatgpt": ChatGPTService,
-        "deepseek": DeepSeekService,
-        "openrouter-deepseek": OpenRouterDeepSeekService
+    _services: Dict[str, Union[str, Type[AIModelService]]] = {
+        "chatgpt": "app.services.chatgpt_service:ChatGPTService",
+        "deepseek": "app.services.deepseek_service:DeepSeekService",
+        "openrouter-deepseek": "app.services.openrouter_deepseek_service:OpenRouterDeepSeekService"
     }
     
+    _instances: Dict[str, AIModelService] = {}
+    _lock = threading.Lock()
+    
     @classmethod
     def get_service(cls, model_name: str) -> AIModelService:
         """
-        Возвращает экземпляр сервиса для указанной модели
+        Возвращает экземпляр сервиса для указанной модели.
+        Экземпляр создаётся один раз на процесс и переиспользуется
         
         Args:
             model_name: Имя модели
@@ -33,9 +39,78 @@ class AIServiceFactory:
             available_models = ", ".join(cls._services.keys())
             raise ValueError(f"Модель '{model_name}' не найдена. Доступные модели: {available_models}")
         
-        return cls._services[model_name]()
+        service = cls._instances.get(model_name)
+        if service is None:
+            with cls._lock:
+                service = cls._instances.get(model_name)
+                if service is None:
+                    service = cls._load_class(model_name)()
+                    cls._instances[model_name] = service
+        return service
+    
+    @classmethod
+    def _load_class(cls, model_name: str) -> Type[AIModelService]:
+        """Импортирует класс сервиса по пути вида 'package.module:ClassName'"""
+        service_class = cls._services[model_name]
+        if isinstance(service_class, str):
+            module_name, _, class_name = service_class.partition(':')
+            try:
+                service_class = getattr(importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError) as e:
+                raise ValueError(f"Не удалось загрузить сервис модели '{model_name}' ({cls._services[model_name]}): {str(e)}") from e
+            cls._services[model_name] = service_class
+        return service_class
+    
+    @classmethod
+    def register(cls, model_name: str, service: Union[str, Type[AIModelService]]):
+        """
+        Регистрирует сервис модели
+        
+        Args:
+            model_name: Имя модели в API
+            service: Класс сервиса или путь импорта 'package.module:ClassName'
+        """
+        with cls._lock:
+            cls._services[model_name] = service
+            cls._instances.pop(model_name, None)
+    
+    @classmethod
+    def register_from_env(cls, value: str):
+        """Регистрирует сервисы из строки вида 'name=package.module:Class,...'"""
+        for item in filter(None, (part.strip() for part in value.split(','))):
+            model_name, _, path = item.partition('=')
+            if not path or ':' not in path:
+                raise ValueError(f"Некорректное описание провайдера: '{item}', ожидается name=package.module:Class")
+            cls.register(model_name.strip(), path.strip())
+    
+    @classmethod
+    def preload(cls):
+        """Импортирует все зарегистрированные сервисы заранее"""
+        for model_name in cls.get_available_models():
+            cls._load_class(model_name)
+    
+    @classmethod
+    def get_rate_limiter(cls, model_name: str) -> ProviderRateLimiter:
+        """
+        Возвращает ограничитель запросов провайдера
+        
+        Raises:
+            ValueError: Если модель не найдена
+        """
+        service = cls.get_service(model_name)
+        return get_rate_limiter(service.model_name, service.config)
+    
+    @classmethod
+    def reset(cls):
+        """Сбрасывает кэш экземпляров сервисов"""
+        with cls._lock:
+            cls._instances.clear()
     
     @classmethod
     def get_available_models(cls) -> List[str]:
         """Возвращает список доступных моделей"""
-        return list(cls._services.keys())
\ No newline at end of file
+        return list(cls._services.keys())
+
+
+if os.environ.get('AI_SERVICE_PROVIDERS'):
+    AIServiceFactory.register_from_env(os.environ['AI_SERVICE_PROVIDERS'])
@@ -0,0 +1,301 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .ai_service_factory import AIServiceFactory
+from ..services import AIModelService, RequestContext
+from ..utils.circuit_breaker import OPEN, get_circuit_breaker
+from ..utils.exceptions import RequestCancelled, UpstreamError
+
+Invoke = Callable[[AIModelService, RequestContext], Dict[str, Any]]
+AsyncInvoke = Callable[[AIModelService, RequestContext], Awaitable[Dict[str, Any]]]
+Attempt = Tuple[str, Dict[str, Any], RequestContext]
+
+
+class FailoverRouter:
+    """
+    Выполняет запрос по цепочке провайдеров: при сбое основного переходит
+    к следующему, пропуская провайдеры с разомкнутым предохранителем.
+    В режиме хеджирования, если основной не ответил за p95 своей задержки,
+    такой же запрос уходит следующему провайдеру и берётся первый успешный ответ
+    """
+
+    def __init__(self, max_workers: int = 32):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self._counters = {"failovers": 0, "hedged": 0, "hedge_wins": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def generate(
+        self,
+        chain: List[str],
+        invoke: Invoke,
+        context: RequestContext,
+        hedge: bool = False
+    ) -> Attempt:
+        """
+        Выполняет запрос с переключением между провайдерами
+
+        Args:
+            chain: Имена моделей из AIServiceFactory, основная первой
+            invoke: Выполняет запрос к сервису с указанным контекстом
+            context: Параметры запроса, для каждой попытки создаётся копия
+            hedge: Включить хеджирование
+
+        Returns:
+            tuple: (имя модели, ответ, контекст успешной попытки)
+
+        Raises:
+            ValueError: Если модель из цепочки не найдена
+            UpstreamError: Если запрос не удался у всех провайдеров
+        """
+        services = [AIServiceFactory.get_service(name) for name in chain]
+        candidates = list(zip(chain, services))
+        if len(candidates) == 1:
+            try:
+                return chain[0], invoke(services[0], context), context
+            except RequestCancelled as e:
+                return self._fail(e)
+
+        available = [
+            candidate for candidate in candidates
+            if get_circuit_breaker(candidate[1].model_name, candidate[1].config).state != OPEN
+        ] or candidates[-1:]
+
+        if hedge and len(available) >= 2:
+            return self._hedged(available, invoke, context)
+        return self._sequential(available, invoke, context)
+
+    async def agenerate(
+        self,
+        chain: List[str],
+        invoke: AsyncInvoke,
+        context: RequestContext,
+        hedge: bool = False
+    ) -> Attempt:
+        """
+        Асинхронный аналог generate для AsyncEngine: попытки и дублирующие
+        запросы выполняются задачами event loop, а не потоками пула
+
+        Raises:
+            ValueError: Если модель из цепочки не найдена
+            UpstreamError: Если запрос не удался у всех провайдеров
+        """
+        services = [AIServiceFactory.get_service(name) for name in chain]
+        candidates = list(zip(chain, services))
+        if len(candidates) == 1:
+            try:
+                return chain[0], await invoke(services[0], context), context
+            except RequestCancelled as e:
+                return self._fail(e)
+
+        available = [
+            candidate for candidate in candidates
+            if get_circuit_breaker(candidate[1].model_name, candidate[1].config).state != OPEN
+        ] or candidates[-1:]
+
+        if hedge and len(available) >= 2:
+            return await self._ahedged(available, invoke, context)
+        return await self._asequential(available, invoke, context)
+
+    def _attempt(self, name: str, service: AIModelService, invoke: Invoke, context: RequestContext) -> Attempt:
+        """Одна попытка; ответ с ключом error считается неудачей"""
+        response = invoke(service, context)
+        if isinstance(response, dict) and "error" in response:
+            raise _ErrorResponse(name, response, context)
+        return name, response, context
+
+    def _sequential(
+        self,
+        candidates: List[Tuple[str, AIModelService]],
+        invoke: Invoke,
+        context: RequestContext,
+        last_error: Optional[Exception] = None
+    ) -> Attempt:
+        for index, (name, service) in enumerate(candidates):
+            if index > 0 or last_error is not None:
+                self._count("failovers")
+            if context.remaining() == 0 or context.cancelled:
+                break
+            try:
+                return self._attempt(name, service, invoke, replace(context))
+            except (UpstreamError, TimeoutError, RequestCancelled, _ErrorResponse) as e:
+                last_error = e
+        return self._fail(last_error)
+
+    def _hedged(
+        self,
+        candidates: List[Tuple[str, AIModelService]],
+        invoke: Invoke,
+        context: RequestContext
+    ) -> Attempt:
+        (primary_name, primary), (secondary_name, secondary) = candidates[:2]
+        breaker = get_circuit_breaker(primary.model_name, primary.config)
+        delay = context.remaining(breaker.latency_percentile(0.95) or primary.config.hedge_delay)
+
+        running: Dict[Future, RequestContext] = {}
+        launched = {primary_name}
+        primary_context = replace(context)
+        running[self._executor.submit(
+            contextvars.copy_context().run, self._attempt, primary_name, primary, invoke, primary_context
+        )] = primary_context
+
+        done, _ = wait(list(running), timeout=delay)
+        if not done:
+            self._count("hedged")
+            launched.add(secondary_name)
+            secondary_context = replace(context)
+            running[self._executor.submit(
+                contextvars.copy_context().run, self._attempt, secondary_name, secondary, invoke, secondary_context
+            )] = secondary_context
+
+        last_error = None
+        while running:
+            done, _ = wait(list(running), timeout=context.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                running.pop(future)
+                try:
+                    result = future.result()
+                except (UpstreamError, TimeoutError, RequestCancelled, _ErrorResponse) as e:
+                    last_error = e
+                    continue
+                for loser, loser_context in running.items():
+                    loser_context.cancelled = True
+                    loser.cancel()
+                if result[0] != primary_name:
+                    self._count("hedge_wins")
+                return result
+
+        for loser_context in running.values():
+            loser_context.cancelled = True
+        if running:
+            last_error = last_error or TimeoutError("Истекло время ожидания ответа провайдеров")
+        rest = [candidate for candidate in candidates[1:] if candidate[0] not in launched]
+        if rest and context.remaining() != 0:
+            return self._sequential(rest, invoke, context, last_error)
+        return self._fail(last_error)
+
+    async def _aattempt(self, name: str, service: AIModelService, invoke: AsyncInvoke, context: RequestContext) -> Attempt:
+        """Асинхронный аналог _attempt"""
+        response = await invoke(service, context)
+        if isinstance(response, dict) and "error" in response:
+            raise _ErrorResponse(name, response, context)
+        return name, response, context
+
+    async def _asequential(
+        self,
+        candidates: List[Tuple[str, AIModelService]],
+        invoke: AsyncInvoke,
+        context: RequestContext,
+        last_error: Optional[Exception] = None
+    ) -> Attempt:
+        for index, (name, service) in enumerate(candidates):
+            if index > 0 or last_error is not None:
+                self._count("failovers")
+            if context.remaining() == 0 or context.cancelled:
+                break
+            try:
+                return await self._aattempt(name, service, invoke, replace(context))
+            except (UpstreamError, TimeoutError, RequestCancelled, _ErrorResponse) as e:
+                last_error = e
+        return self._fail(last_error)
+
+    async def _ahedged(
+        self,
+        candidates: List[Tuple[str, AIModelService]],
+        invoke: AsyncInvoke,
+        context: RequestContext
+    ) -> Attempt:
+        (primary_name, primary), (secondary_name, secondary) = candidates[:2]
+        breaker = get_circuit_breaker(primary.model_name, primary.config)
+        delay = context.remaining(breaker.latency_percentile(0.95) or primary.config.hedge_delay)
+
+        running: Dict[asyncio.Task, RequestContext] = {}
+        launched = {primary_name}
+        primary_context = replace(context)
+        running[asyncio.ensure_future(self._aattempt(primary_name, primary, invoke, primary_context))] = primary_context
+
+        try:
+            done, _ = await asyncio.wait(list(running), timeout=delay)
+            if not done:
+                self._count("hedged")
+                launched.add(secondary_name)
+                secondary_context = replace(context)
+                running[asyncio.ensure_future(
+                    self._aattempt(secondary_name, secondary, invoke, secondary_context)
+                )] = secondary_context
+
+            last_error = None
+            while running:
+                done, _ = await asyncio.wait(list(running), timeout=context.remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    running.pop(task)
+                    try:
+                        result = task.result()
+                    except (UpstreamError, TimeoutError, RequestCancelled, _ErrorResponse) as e:
+                        last_error = e
+                        continue
+                    if result[0] != primary_name:
+                        self._count("hedge_wins")
+                    return result
+        finally:
+            # Проигравшая попытка отменяется вместе с запросом к провайдеру
+            for loser, loser_context in running.items():
+                loser_context.cancelled = True
+                loser.cancel()
+
+        if running:
+            last_error = last_error or TimeoutError("Истекло время ожидания ответа провайдеров")
+        rest = [candidate for candidate in candidates[1:] if candidate[0] not in launched]
+        if rest and context.remaining() != 0:
+            return await self._asequential(rest, invoke, context, last_error)
+        return self._fail(last_error)
+
+    @staticmethod
+    def _fail(error: Optional[Exception]) -> Attempt:
+        if isinstance(error, _ErrorResponse):
+            return error.name, error.response, error.context
+        if error is None:
+            raise TimeoutError("Истекло время ожидания ответа провайдеров")
+        if isinstance(error, RequestCancelled):
+            # Отменённая попытка не дошла до провайдера: клиенту это ошибка запроса, а не сбой сервера
+            raise UpstreamError(str(error), status_code=499) from error
+        raise error
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class _ErrorResponse(Exception):
+    """Провайдер вернул ответ с ошибкой; нужен, чтобы перейти к следующему"""
+
+    def __init__(self, name: str, response: Dict[str, Any], context: RequestContext):
+        super().__init__(response.get("error"))
+        self.name = name
+        self.response = response
+        self.context = context
+
+
+failover_router = None
+_router_lock = threading.Lock()
+
+def get_failover_router():
+    """Возвращает глобальный маршрутизатор запросов между провайдерами"""
+    global failover_router
+    if failover_router is None:
+        with _router_lock:
+            if failover_router is None:
+                failover_router = FailoverRouter(int(os.environ.get('HEDGE_WORKERS', 32)))
+    return failover_router
@@ -1,11 +1,35 @@
 from .base import AIModelService, AIServiceConfig
-from .chatgpt_service import ChatGPTService, ChatGPTConfig
-from .deepseek_service import DeepSeekService, DeepSeekConfig
-from .openrouter_deepseek_service import OpenRouterDeepSeekService, OpenRouterDeepSeekConfig
+from .context import RequestContext
+from ..utils.exceptions import UpstreamError, RateLimitExceeded, CircuitOpenError
+
+# Модули провайдеров импортируются при первом обращении к их классам
+_PROVIDER_EXPORTS = {
+    'ChatGPTService': '.chatgpt_service',
+    'ChatGPTConfig': '.chatgpt_service',
+    'DeepSeekService': '.deepseek_service',
+    'DeepSeekConfig': '.deepseek_service',
+    'OpenRouterDeepSeekService': '.openrouter_deepseek_service',
+    'OpenRouterDeepSeekConfig': '.openrouter_deepseek_service'
+}
+
+
+def __getattr__(name):
+    module_name = _PROVIDER_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
 
 __all__ = [
     'AIModelService',
     'AIServiceConfig',
+    'RequestContext',
+    'UpstreamError',
+    'RateLimitExceeded',
+    'CircuitOpenError',
     'ChatGPTService',
     'ChatGPTConfig',
     'DeepSeekService',
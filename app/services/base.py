@@ -1,9 +1,25 @@
 import requests
-import json
+import asyncio
+import logging
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional
-from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+from dataclasses import dataclass, field
 from ..utils.yaml_loader import get_prompt_loader
+from ..utils.http_pool import get_session_pool
+from ..utils.response_cache import ResponseCache, get_response_cache
+from ..utils.single_flight import get_single_flight
+from ..utils.rate_limiter import get_rate_limiter, parse_retry_after
+from ..utils.key_pool import AUTH_STATUSES, KeyLease, KeyPool, get_key_pool
+from ..utils.exceptions import RateLimitExceeded, RequestCancelled, UpstreamError
+from ..utils.circuit_breaker import get_circuit_breaker
+from ..utils.tokens import estimate_request_tokens, trim_history
+from ..utils.retry import RetryPolicy, retry_reason, retry_stats
+from ..utils.fast_json import RawResponse, dumps_bytes, loads
+from ..utils.timing import record_span, span
+from .context import RequestContext
+
+logger = logging.getLogger('neiro.services')
 
 @dataclass
 class AIServiceConfig:
@@ -13,11 +29,45 @@ class AIServiceConfig:
     default_model: str
     default_temperature: float = 0.7
     default_max_tokens: int = 1000
+    context_tokens: int = 0  # окно контекста модели для истории сессий, 0 - история не укорачивается
     timeout: int = 30
+    connect_timeout: float = 5.0
+    read_timeout: Optional[float] = None  # по умолчанию равен timeout
+    pool_connections: int = 10
+    pool_maxsize: int = 20
+    keep_alive: bool = True
+    requests_per_minute: int = 0  # 0 - без ограничения
+    tokens_per_minute: int = 0  # 0 - без ограничения
+    rate_limit_queue_size: int = 100
+    rate_limit_max_wait: float = 10.0
+    api_keys: str = ""  # пул ключей "ключ;weight=2;rpm=60,ключ2", по умолчанию - один api_key
+    api_keys_file: str = ""  # файл с пулом ключей, перечитывается при изменении
+    key_selection: str = "least_in_flight"  # или quota - ключ с наибольшим остатком лимитов
+    key_bench_seconds: float = 30.0  # отстранение ключа после 429 без Retry-After
+    key_auth_bench_seconds: float = 600.0  # отстранение ключа после 401 и 403
+    breaker_failure_threshold: float = 0.5  # доля ошибок в окне, при которой провайдер отключается
+    breaker_min_requests: int = 10
+    breaker_window: float = 60.0
+    breaker_open_seconds: float = 30.0
+    breaker_latency_threshold: float = 0.0  # порог p95 задержки в секундах, 0 - не учитывать
+    hedge_delay: float = 2.0  # задержка дублирующего запроса, пока нет статистики p95
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+
+    def get_timeouts(self) -> Tuple[float, float]:
+        """Возвращает пару (connect, read) таймаутов для requests"""
+        read_timeout = self.read_timeout if self.read_timeout is not None else self.timeout
+        return (self.connect_timeout, read_timeout)
+    
+    def get_request_budget(self) -> float:
+        """Наибольшее время запроса со всеми повторами, если клиент не задал дедлайн"""
+        retries = self.retry.max_retries()
+        return sum(self.get_timeouts()) * (retries + 1) + self.retry.backoff_max * retries
 
 class AIModelService(ABC):
     """Абстрактный базовый класс для всех сервисов нейросетей"""
     
+    api_key_error = "API ключ не настроен"
+    
     def __init__(self, model_name: str, config: Optional[AIServiceConfig] = None):
         self.model_name = model_name
         
@@ -34,6 +84,8 @@ class AIModelService(ABC):
         self, 
         message: str, 
         prompt_template: Optional[str] = None, 
+        *,
+        request_context: Optional[RequestContext] = None,
         **kwargs: Any
     ) -> Dict[str, Any]:
         """
@@ -42,6 +94,8 @@ class AIModelService(ABC):
         Args:
             message: Сообщение пользователя
             prompt_template: Имя шаблона промпта (из yaml-файлов)
+            request_context: Параметры обработки запроса (кэш и т.п.); передаётся
+                только по имени, чтобы не совпасть с переменной шаблона context
             **kwargs: Дополнительные параметры для генерации
         
         Returns:
@@ -49,60 +103,716 @@ class AIModelService(ABC):
         """
         pass
     
+    def prepare_request(
+        self, 
+        message: str, 
+        prompt_template: Optional[str] = None, 
+        history: Optional[Sequence[Dict[str, Any]]] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        Готовит тело запроса к API: подставляет сообщение в шаблон
+        или собирает запрос из параметров по умолчанию. История диалога
+        (history) вставляется перед сообщением пользователя
+        
+        Raises:
+            ValueError: Если не настроен ключ API, не найден шаблон
+                или не переданы используемые в нём переменные
+        """
+        with span('prompt'):
+            if not get_key_pool(self.model_name, self.config).configured:
+                raise ValueError(self.api_key_error)
+            
+            if prompt_template:
+                compiled = self.prompt_loader.get_compiled_prompt(self.model_name, prompt_template)
+                if compiled is None:
+                    raise ValueError(f"Шаблон промпта '{prompt_template}' не найден")
+            
+                payload = compiled.render(message=message, **kwargs)
+            else:
+                payload = {
+                    "model": kwargs.get("model", self.config.default_model),
+                    "messages": [{"role": "user", "content": message}],
+                    "temperature": kwargs.get("temperature", self.config.default_temperature),
+                    "max_tokens": kwargs.get("max_tokens", self.config.default_max_tokens)
+                }
+            
+            if history:
+                payload = self._with_history(payload, history)
+        return payload
+    
+    def _with_history(self, payload: Dict[str, Any], history: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Вставляет историю перед последним сообщением запроса (системные сообщения
+        шаблона остаются первыми). Старые сообщения отбрасываются, чтобы запрос
+        вместе с ответом уложился в окно контекста модели
+        """
+        messages = payload.get("messages") if isinstance(payload, dict) else None
+        if not isinstance(messages, list) or not messages:
+            raise ValueError("Шаблон промпта не поддерживает историю диалога")
+        
+        if self.config.context_tokens:
+            budget = self.config.context_tokens - estimate_request_tokens(payload)
+            kept = trim_history(history, budget)
+            if len(kept) < len(history):
+                logger.debug(
+                    "История укорочена с %d до %d сообщений под контекст %s",
+                    len(history), len(kept), self.model_name,
+                    extra={"model": self.model_name, "history_dropped": len(history) - len(kept)}
+                )
+        else:
+            kept = list(history)
+        return dict(payload, messages=messages[:-1] + kept + messages[-1:])
+    
+    async def agenerate_response(
+        self, 
+        message: str, 
+        prompt_template: Optional[str] = None, 
+        *,
+        request_context: Optional[RequestContext] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        Асинхронный аналог generate_response, выполняется в AsyncEngine
+        
+        Returns:
+            dict: Ответ от модели
+        """
+        try:
+            prompt_data = self.prepare_request(message, prompt_template, **kwargs)
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        return await self._amake_api_request(self.config.api_url, prompt_data, context=request_context)
+    
+    def generate_stream(
+        self, 
+        message: str, 
+        prompt_template: Optional[str] = None, 
+        *,
+        request_context: Optional[RequestContext] = None,
+        **kwargs: Any
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Запрашивает потоковый ответ модели. Соединение с API открывается
+        сразу, чтобы ошибки провайдера всплыли до начала отдачи клиенту.
+        Ожидание лимитов и чтение потока ограничены дедлайном request_context
+        
+        Returns:
+            Iterator[dict]: Чанки ответа провайдера по мере поступления
+            
+        Raises:
+            ValueError: Если запрос не удалось подготовить
+            UpstreamError: При ошибке запроса к API или превышении лимита
+        """
+        context = request_context or RequestContext()
+        prompt_data = dict(self.prepare_request(message, prompt_template, **kwargs))
+        prompt_data["stream"] = True
+        estimated = estimate_request_tokens(prompt_data)
+        limiter = get_rate_limiter(self.model_name, self.config)
+        with span('ratelimit'):
+            limiter.acquire(estimated, timeout=context.remaining())
+        pool = get_key_pool(self.model_name, self.config)
+        lease = pool.acquire(estimated, timeout=context.remaining())
+        if lease.wait > 0:
+            time.sleep(lease.wait)
+            record_span('ratelimit', lease.wait)
+        breaker = get_circuit_breaker(self.model_name, self.config)
+        try:
+            timeouts = self._attempt_timeouts(context)
+            breaker.allow()
+        except UpstreamError:
+            pool.release(lease)
+            raise
+        started = time.monotonic()
+        try:
+            response = self._open_stream(
+                self.config.api_url, prompt_data, self._auth_headers(lease.value, stream=True), timeouts
+            )
+        except UpstreamError as e:
+            self._attempt_failed(e, limiter, breaker, pool, lease, started)
+            context.upstream_time += time.monotonic() - started
+            raise
+        except BaseException:
+            breaker.release_probe()
+            pool.release(lease)
+            raise
+        breaker.record(True, time.monotonic() - started)
+        return self._leased_stream(response, limiter, pool, lease, estimated, context, started)
+    
+    def _leased_stream(
+        self, 
+        response: requests.Response, 
+        limiter: Any, 
+        pool: KeyPool, 
+        lease: KeyLease, 
+        estimated: int, 
+        context: RequestContext, 
+        started: float
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Чанки потока; ключ считается занятым, пока поток не дочитан. Резерв
+        токенов уточняется по usage из чанков (провайдеры присылают его в последнем)
+        """
+        events = self._iter_stream_events(response)
+        tokens = None
+        try:
+            for chunk in events:
+                usage_tokens = self._usage_tokens(chunk)
+                if usage_tokens is not None:
+                    tokens = usage_tokens
+                yield chunk
+                remaining = context.remaining()
+                if remaining is not None and remaining <= 0:
+                    raise UpstreamError(f"Истёк дедлайн потокового ответа {self.model_name}", status_code=504)
+        finally:
+            events.close()
+            context.upstream_time += time.monotonic() - started
+            limiter.reconcile(estimated, tokens)
+            pool.release(lease, tokens=tokens)
+    
     def get_prompt_template(self, prompt_name: str) -> Optional[Dict[str, Any]]:
         """Получает шаблон промпта из загрузчика"""
         return self.prompt_loader.get_prompt(self.model_name, prompt_name)
     
-    def format_prompt(self, template: Any, **kwargs: Any) -> Any:
-        """Форматирует промпт, подставляя переменные рекурсивно"""
-        if isinstance(template, str):
-            return template.format(**kwargs)
-        elif isinstance(template, dict):
-            result = {}
-            for key, value in template.items():
-                result[key] = self.format_prompt(value, **kwargs)
-            return result
-        elif isinstance(template, (list, tuple)):
-            return [self.format_prompt(item, **kwargs) for item in template]
-        else:
-            return template
+    def _get_cached(
+        self, 
+        request_key: str, 
+        data: Dict[str, Any], 
+        context: RequestContext
+    ) -> Optional[Dict[str, Any]]:
+        """Ищет ответ в кэше и отмечает в контексте, применялся ли кэш"""
+        cache = get_response_cache()
+        if not cache.should_cache(data, context.cache):
+            cache.count_bypass()
+            context.cache_status = "bypass"
+            return None
+        
+        with span('cache'):
+            cached = cache.get(request_key)
+        context.cache_status = "hit" if cached is not None else "miss"
+        return cached
+    
+    def _store_cached(self, request_key: str, result: Any, context: RequestContext):
+        """Сохраняет успешный ответ в кэш, если кэш применялся к запросу"""
+        if context.cache_status != "miss":
+            return
+        if isinstance(result, RawResponse):
+            get_response_cache().set(request_key, result.json())
+        elif "error" not in result:
+            get_response_cache().set(request_key, result)
+    
+    @staticmethod
+    def _as_requested(result: Any, context: RequestContext) -> Any:
+        """Разбирает тело ответа, если вызывающий не принимает RawResponse"""
+        if isinstance(result, RawResponse) and not context.raw:
+            return result.json()
+        return result
     
     def _make_api_request(
         self, 
         endpoint: str, 
         data: Dict[str, Any], 
-        headers: Optional[Dict[str, str]] = None
+        headers: Optional[Dict[str, str]] = None,
+        context: Optional[RequestContext] = None
     ) -> Dict[str, Any]:
         """
-        Выполняет запрос к API с обработкой ошибок
+        Выполняет запрос к API с обработкой ошибок, используя кэш ответов.
+        Одинаковые одновременные запросы объединяются в один
         
         Args:
             endpoint: URL эндпоинта API
             data: Данные для отправки
             headers: Заголовки запроса
+            context: Параметры обработки запроса
             
         Returns:
             dict: Ответ от API
             
         Raises:
-            Exception: При ошибке запроса
+            UpstreamError: При ошибке запроса
+            RateLimitExceeded: Если лимит провайдера не освободится вовремя
         """
+        context = context or RequestContext()
+        request_key = ResponseCache.make_key(self.model_name, endpoint, data)
+        cached = self._get_cached(request_key, data, context)
+        if cached is not None:
+            return cached
+        
+        def send():
+            context.coalesced = False
+            return self._send_limited(endpoint, data, headers, context)
+        
+        context.coalesced = True
+        started = time.monotonic()
         try:
-            headers = headers or {
-                "Authorization": f"Bearer {self.config.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
-                timeout=self.config.timeout
+            result = get_single_flight().do(
+                request_key,
+                send,
+                timeout=context.remaining(self.config.get_request_budget())
             )
+        finally:
+            context.upstream_time += time.monotonic() - started
+        self._store_cached(request_key, result, context)
+        return self._as_requested(result, context)
+    
+    def _send_limited(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]], 
+        context: RequestContext
+    ) -> Dict[str, Any]:
+        """
+        Отправляет запрос, повторяя его при временных сбоях провайдера
+        по правилам config.retry, пока позволяет дедлайн
+        """
+        retries: Dict[str, int] = {}
+        while True:
+            try:
+                return self._send_attempt(endpoint, data, headers, context)
+            except UpstreamError as e:
+                delay = self._retry_delay(e, retries, context)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+    
+    async def _asend_limited(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]], 
+        context: RequestContext
+    ) -> Dict[str, Any]:
+        """Асинхронный аналог _send_limited"""
+        retries: Dict[str, int] = {}
+        while True:
+            try:
+                return await self._asend_attempt(endpoint, data, headers, context)
+            except UpstreamError as e:
+                delay = self._retry_delay(e, retries, context)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+    
+    def _retry_delay(
+        self, 
+        error: UpstreamError, 
+        retries: Dict[str, int], 
+        context: RequestContext
+    ) -> Optional[float]:
+        """
+        Решает, повторять ли запрос после ошибки, и учитывает повтор
+        
+        Returns:
+            float: Пауза перед повтором или None, если ошибку нужно вернуть клиенту
+        """
+        reason = retry_reason(error)
+        if reason is None or context.cancelled:
+            return None
+        
+        if error.upstream_status in AUTH_STATUSES and self._can_switch_key(retries.get(reason, 0)):
+            delay = 0.0  # ключ отстранён, повтор уйдёт с другим ключом
+        else:
+            delay = self.config.retry.delay(error, retries)
+        if delay is None:
+            # Исчерпаны только повторы, предусмотренные правилами; ошибки без правила не повторяются вовсе
+            limit = self.config.retry.rules.get(reason, 0)
+            if limit > 0 and retries.get(reason, 0) >= limit:
+                retry_stats.record(self.model_name, "exhausted")
+            return None
+        remaining = context.remaining()
+        if remaining is not None and delay >= remaining:
+            retry_stats.record(self.model_name, "deadline")
+            return None
+        
+        retries[reason] = retries.get(reason, 0) + 1
+        context.retries += 1
+        retry_stats.record(self.model_name, reason)
+        logger.warning(f"Повтор запроса к {self.model_name} через {delay:.2f} с (причина: {reason}): {str(error)}")
+        return delay
+    
+    def _can_switch_key(self, switched: int) -> bool:
+        """Остались ли в пуле ключи, которые запрос ещё не пробовал"""
+        pool = get_key_pool(self.model_name, self.config)
+        return switched < pool.size - 1 and pool.next_available() == 0
+    
+    def _auth_headers(self, api_key: str, stream: bool = False) -> Dict[str, str]:
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return headers
+    
+    def _attempt_failed(
+        self, 
+        error: UpstreamError, 
+        limiter: Any, 
+        breaker: Any, 
+        pool: KeyPool, 
+        lease: KeyLease, 
+        started: float
+    ):
+        """Учитывает неудачную попытку в предохранителе, лимитах и пуле ключей"""
+        breaker.record(not self._is_provider_failure(error), time.monotonic() - started)
+        pool.release(lease, error)
+        if isinstance(error, RateLimitExceeded):
+            if pool.size > 1:
+                # Ключ отстранён: повтор ждёт, только если отстранены все ключи
+                error.retry_after = pool.next_available()
+            else:
+                limiter.pause(error.retry_after or 1)
+    
+    def _attempt_timeouts(self, context: RequestContext) -> Tuple[float, float]:
+        """
+        Таймауты одной попытки, урезанные до оставшегося до дедлайна времени
+        
+        Raises:
+            UpstreamError: Если дедлайн уже истёк
+        """
+        connect_timeout, read_timeout = self.config.get_timeouts()
+        remaining = context.remaining()
+        if remaining is None:
+            return (connect_timeout, read_timeout)
+        if remaining <= 0:
+            raise UpstreamError(f"Истёк дедлайн запроса к {self.model_name}", status_code=504)
+        return (min(connect_timeout, remaining), min(read_timeout, remaining))
+    
+    def _send_attempt(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]], 
+        context: RequestContext
+    ) -> Dict[str, Any]:
+        """Одна попытка запроса, дождавшись места в лимитах провайдера"""
+        limiter = get_rate_limiter(self.model_name, self.config)
+        estimated = estimate_request_tokens(data)
+        with span('ratelimit'):
+            limiter.acquire(estimated, timeout=context.remaining())
+        if context.cancelled:
+            raise RequestCancelled(f"Запрос к {self.model_name} отменён")
+        
+        # Ключ берётся до предохранителя: если ключа не дождаться, пробный запрос не занимается
+        pool = get_key_pool(self.model_name, self.config)
+        lease = pool.acquire(estimated, timeout=context.remaining())
+        if lease.wait > 0:
+            time.sleep(lease.wait)
+            record_span('ratelimit', lease.wait)
+        breaker = get_circuit_breaker(self.model_name, self.config)
+        try:
+            timeouts = self._attempt_timeouts(context)
+            breaker.allow()
+        except UpstreamError:
+            pool.release(lease)
+            raise
+        started = time.monotonic()
+        try:
+            result = self._send_request(
+                endpoint, data, headers or self._auth_headers(lease.value), timeouts, raw=context.raw
+            )
+        except UpstreamError as e:
+            self._attempt_failed(e, limiter, breaker, pool, lease, started)
+            raise
+        except BaseException:
+            # Отмена или непредвиденная ошибка: пробный запрос и ключ не должны остаться занятыми
+            breaker.release_probe()
+            pool.release(lease)
+            raise
+        elapsed = time.monotonic() - started
+        breaker.record(True, elapsed)
+        tokens = self._usage_tokens(result)
+        limiter.reconcile(estimated, tokens)
+        pool.release(lease, tokens=tokens)
+        logger.debug("Ответ %s за %.3f с, токенов: %s", self.model_name, elapsed, tokens,
+                     extra={"model": self.model_name, "upstream_ms": round(elapsed * 1000, 1), "tokens": tokens})
+        return result
+    
+    async def _asend_attempt(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]], 
+        context: RequestContext
+    ) -> Dict[str, Any]:
+        """Асинхронный аналог _send_attempt"""
+        limiter = get_rate_limiter(self.model_name, self.config)
+        estimated = estimate_request_tokens(data)
+        with span('ratelimit'):
+            await limiter.aacquire(estimated, timeout=context.remaining())
+        if context.cancelled:
+            raise RequestCancelled(f"Запрос к {self.model_name} отменён")
+        
+        # Ключ берётся до предохранителя: если ключа не дождаться, пробный запрос не занимается
+        pool = get_key_pool(self.model_name, self.config)
+        lease = pool.acquire(estimated, timeout=context.remaining())
+        if lease.wait > 0:
+            try:
+                await asyncio.sleep(lease.wait)
+            except asyncio.CancelledError:
+                pool.release(lease)
+                raise
+            record_span('ratelimit', lease.wait)
+        breaker = get_circuit_breaker(self.model_name, self.config)
+        try:
+            timeouts = self._attempt_timeouts(context)
+            breaker.allow()
+        except UpstreamError:
+            pool.release(lease)
+            raise
+        started = time.monotonic()
+        try:
+            result = await self._asend_request(
+                endpoint, data, headers or self._auth_headers(lease.value), timeouts, raw=context.raw
+            )
+        except UpstreamError as e:
+            self._attempt_failed(e, limiter, breaker, pool, lease, started)
+            raise
+        except BaseException:
+            # Отмена или непредвиденная ошибка: пробный запрос и ключ не должны остаться занятыми
+            breaker.release_probe()
+            pool.release(lease)
+            raise
+        elapsed = time.monotonic() - started
+        breaker.record(True, elapsed)
+        tokens = self._usage_tokens(result)
+        limiter.reconcile(estimated, tokens)
+        pool.release(lease, tokens=tokens)
+        logger.debug("Ответ %s за %.3f с, токенов: %s", self.model_name, elapsed, tokens,
+                     extra={"model": self.model_name, "upstream_ms": round(elapsed * 1000, 1), "tokens": tokens})
+        return result
+    
+    @staticmethod
+    def _is_provider_failure(error: UpstreamError) -> bool:
+        """Ошибка говорит о сбое провайдера (5xx, таймаут, обрыв), а не о самом запросе"""
+        status = error.upstream_status
+        return status is None or status >= 500 or status == 408
+    
+    @staticmethod
+    def _usage_tokens(result: Any) -> Optional[int]:
+        """Возвращает фактический расход токенов из поля usage ответа"""
+        if isinstance(result, RawResponse):
+            usage = result.usage()
+        else:
+            usage = result.get("usage") if isinstance(result, dict) else None
+        if isinstance(usage, dict) and isinstance(usage.get("total_tokens"), int):
+            return usage["total_tokens"]
+        return None
+    
+    def _upstream_error(
+        self, 
+        error: Exception, 
+        status: Optional[int] = None, 
+        headers: Optional[Any] = None, 
+        timeout: bool = False
+    ) -> UpstreamError:
+        """Преобразует ошибку HTTP-клиента в UpstreamError"""
+        error_msg = f"Ошибка запроса к API {self.model_name}: {str(error)}"
+        if status == 429:
+            retry_after = parse_retry_after(headers.get("Retry-After") if headers is not None else None)
+            return RateLimitExceeded(error_msg, retry_after=retry_after, upstream_status=status)
+        if timeout:
+            return UpstreamError(error_msg, status_code=504)
+        return UpstreamError(error_msg, upstream_status=status)
+    
+    def _send_request(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]] = None,
+        timeouts: Optional[Tuple[float, float]] = None,
+        raw: bool = False
+    ) -> Any:
+        """
+        Отправляет запрос к API через пул соединений. С raw=True успешный
+        ответ возвращается неразобранным (RawResponse), если это возможно
+        
+        Raises:
+            UpstreamError: При ошибке запроса
+        """
+        try:
+            headers = headers or self._auth_headers(self.config.api_key)
+            
+            with span('encode'):
+                body = dumps_bytes(data)
+            session = get_session_pool().get_session(self.model_name, self.config)
+            with span('upstream'):
+                response = session.post(
+                    endpoint,
+                    headers=headers,
+                    data=body,
+                    timeout=timeouts or self.config.get_timeouts()
+                )
+            record_span('ttfb', response.elapsed.total_seconds())
             
             response.raise_for_status()
-            return response.json()
+            return self._decode_body(response.content, response.headers.get('Content-Type', ''), raw)
+            
+        except requests.exceptions.HTTPError as e:
+            raise self._upstream_error(e, e.response.status_code, e.response.headers) from e
+        except requests.exceptions.Timeout as e:
+            raise self._upstream_error(e, timeout=True) from e
+        except requests.exceptions.RequestException as e:
+            raise self._upstream_error(e) from e
+    
+    async def _amake_api_request(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]] = None,
+        context: Optional[RequestContext] = None
+    ) -> Dict[str, Any]:
+        """
+        Асинхронный аналог _make_api_request через общий AsyncEngine
+        
+        Raises:
+            UpstreamError: При ошибке запроса
+        """
+        context = context or RequestContext()
+        request_key = ResponseCache.make_key(self.model_name, endpoint, data)
+        cached = self._get_cached(request_key, data, context)
+        if cached is not None:
+            return cached
+        
+        async def send():
+            context.coalesced = False
+            return await self._asend_limited(endpoint, data, headers, context)
+        
+        context.coalesced = True
+        started = time.monotonic()
+        try:
+            result = await get_single_flight().ado(
+                request_key,
+                send,
+                timeout=context.remaining(self.config.get_request_budget())
+            )
+        finally:
+            context.upstream_time += time.monotonic() - started
+        self._store_cached(request_key, result, context)
+        return self._as_requested(result, context)
+    
+    async def _asend_request(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]] = None,
+        timeouts: Optional[Tuple[float, float]] = None,
+        raw: bool = False
+    ) -> Any:
+        """
+        Отправляет запрос к API через AsyncEngine
+        
+        Raises:
+            UpstreamError: При ошибке запроса
+        """
+        import httpx
+        from ..utils.async_engine import get_async_engine
+        
+        try:
+            headers = headers or self._auth_headers(self.config.api_key)
+            
+            with span('encode'):
+                body = dumps_bytes(data)
+            with span('upstream'):
+                response = await get_async_engine().post_json(
+                    self.model_name,
+                    self.config,
+                    endpoint,
+                    body,
+                    headers,
+                    timeouts
+                )
+            
+            response.raise_for_status()
+            return self._decode_body(response.content, response.headers.get('Content-Type', ''), raw)
+            
+        except httpx.HTTPStatusError as e:
+            raise self._upstream_error(e, e.response.status_code, e.response.headers) from e
+        except httpx.TimeoutException as e:
+            raise self._upstream_error(e, timeout=True) from e
+        except httpx.HTTPError as e:
+            raise self._upstream_error(e) from e
+    
+    def _decode_body(self, body: bytes, content_type: str, raw: bool) -> Any:
+        """
+        Разбирает тело успешного ответа или, если вызывающему подходит
+        ответ как есть, возвращает его исходными байтами (RawResponse)
+        
+        Raises:
+            UpstreamError: Если тело не является JSON
+        """
+        with span('decode'):
+            try:
+                if raw and content_type.startswith('application/json'):
+                    return RawResponse.parse(body, content_type)
+                return loads(body)
+            except ValueError as e:
+                raise UpstreamError(f"Некорректный ответ API {self.model_name}: {str(e)}") from e
+    
+    def _open_stream(
+        self, 
+        endpoint: str, 
+        data: Dict[str, Any], 
+        headers: Optional[Dict[str, str]] = None,
+        timeouts: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        """
+        Открывает потоковый (SSE) запрос к API, не читая тело ответа.
+        Таймаут чтения действует на ожидание каждого следующего чанка
+        
+        Raises:
+            UpstreamError: При ошибке запроса
+        """
+        response = None
+        try:
+            headers = headers or self._auth_headers(self.config.api_key, stream=True)
+            
+            with span('encode'):
+                body = dumps_bytes(data)
+            session = get_session_pool().get_session(self.model_name, self.config)
+            with span('upstream'):
+                response = session.post(
+                    endpoint,
+                    headers=headers,
+                    data=body,
+                    timeout=timeouts or self.config.get_timeouts(),
+                    stream=True
+                )
+            
+            response.raise_for_status()
+            return response
+            
+        except requests.exceptions.RequestException as e:
+            if response is not None:
+                response.close()
+            if isinstance(e, requests.exceptions.HTTPError):
+                raise self._upstream_error(e, e.response.status_code, e.response.headers) from e
+            raise self._upstream_error(e, timeout=isinstance(e, requests.exceptions.Timeout)) from e
+    
+    def _iter_stream_events(self, response: requests.Response) -> Iterator[Dict[str, Any]]:
+        """Разбирает SSE-поток провайдера и отдаёт чанки по одному"""
+        try:
+            data_lines = []
+            for line in response.iter_lines():
+                if line:
+                    if line.startswith(b'data:'):
+                        data_lines.append(line[5:].strip())
+                    continue
+                
+                if not data_lines:
+                    continue
+                payload = b'\n'.join(data_lines)
+                data_lines = []
+                if payload == b'[DONE]':
+                    return
+                yield loads(payload)
             
+            if data_lines and b'\n'.join(data_lines) != b'[DONE]':
+                yield loads(b'\n'.join(data_lines))
         except requests.exceptions.RequestException as e:
-            error_msg = f"Ошибка запроса к API {self.model_name}: {str(e)}"
-            raise Exception(error_msg) from e
+            error_msg = f"Ошибка чтения потока API {self.model_name}: {str(e)}"
+            raise UpstreamError(error_msg) from e
+        finally:
+            response.close()
@@ -0,0 +1,22 @@
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class RequestContext:
+    """Параметры обработки одного запроса и сведения о том, как он был обработан"""
+    cache: Optional[bool] = None  # None - кэшировать только детерминированные запросы
+    deadline: Optional[float] = None  # момент time.monotonic(), после которого ответ не нужен
+    cache_status: Optional[str] = None  # hit / miss / bypass
+    coalesced: bool = False  # ответ получен от такого же одновременного запроса
+    cancelled: bool = False  # ответ больше не нужен, отправлять запрос не следует
+    retries: int = 0  # сколько раз запрос повторялся после сбоев провайдера
+    upstream_time: float = 0.0  # сколько секунд запрос ждал ответа провайдера
+    raw: bool = False  # ответ можно вернуть без разбора (RawResponse), он отдаётся клиенту как есть
+    
+    def remaining(self, default: Optional[float] = None) -> Optional[float]:
+        """Возвращает оставшееся до дедлайна время в секундах (не больше default)"""
+        if self.deadline is None:
+            return default
+        left = max(self.deadline - time.monotonic(), 0.0)
+        return left if default is None else min(left, default)
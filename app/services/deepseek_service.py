@@ -2,17 +2,26 @@ import os
 from typing import Any, Dict, Optional
 from dataclasses import dataclass
 from .base import AIModelService, AIServiceConfig
+from .context import RequestContext
 
 @dataclass
 class DeepSeekConfig(AIServiceConfig):
     """Конфигурация для DeepSeek сервиса"""
     api_key: str = os.environ.get("DEEPSEEK_API_KEY", "")
-    api_url: str = "https://api.deepseek.com/v1/chat/completions"
+    api_keys: str = os.environ.get("DEEPSEEK_API_KEYS", "")
+    api_keys_file: str = os.environ.get("DEEPSEEK_API_KEYS_FILE", "")
+    key_selection: str = os.environ.get("DEEPSEEK_KEY_SELECTION", "least_in_flight")
+    api_url: str = os.environ.get("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
     default_model: str = "deepseek-chat"
+    context_tokens: int = int(os.environ.get("DEEPSEEK_CONTEXT_TOKENS", 64000))
+    requests_per_minute: int = int(os.environ.get("DEEPSEEK_RPM", 0))
+    tokens_per_minute: int = int(os.environ.get("DEEPSEEK_TPM", 0))
 
 class DeepSeekService(AIModelService):
     """Сервис для работы с DeepSeek API"""
     
+    api_key_error = "API ключ DeepSeek не настроен"
+    
     def __init__(self, config: Optional[DeepSeekConfig] = None):
         super().__init__("deepseek", config)
     
@@ -23,27 +32,13 @@ class DeepSeekService(AIModelService):
         self, 
         message: str, 
         prompt_template: Optional[str] = None, 
+        *,
+        request_context: Optional[RequestContext] = None,
         **kwargs: Any
     ) -> Dict[str, Any]:
-        if not self.config.api_key:
-            return {"error": "API ключ DeepSeek не настроен"}
-        
-        if prompt_template:
-            template_data = self.get_prompt_template(prompt_template)
-            if not template_data:
-                return {"error": f"Шаблон промпта '{prompt_template}' не найден"}
-            
-            prompt_data = self.format_prompt(
-                template_data, 
-                message=message,
-                **kwargs
-            )
-        else:
-            prompt_data = {
-                "model": kwargs.get("model", self.config.default_model),
-                "messages": [{"role": "user", "content": message}],
-                "temperature": kwargs.get("temperature", self.config.default_temperature),
-                "max_tokens": kwargs.get("max_tokens", self.config.default_max_tokens)
-            }
+        try:
+            prompt_data = self.prepare_request(message, prompt_template, **kwargs)
+        except ValueError as e:
+            return {"error": str(e)}
         
-        return self._make_api_request(self.config.api_url, prompt_data)
+        return self._make_api_request(self.config.api_url, prompt_data, context=request_context)
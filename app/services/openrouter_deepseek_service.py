@@ -2,16 +2,25 @@ import os
 from typing import Any, Dict, Optional
 from dataclasses import dataclass
 from .base import AIModelService, AIServiceConfig
+from .context import RequestContext
 
 @dataclass
 class OpenRouterDeepSeekConfig(AIServiceConfig):
     """Конфигурация для OpenRouter DeepSeek сервиса"""
     api_key: str = os.environ.get("OPENROUTER_DEEPSEEK_API_KEY", "")
-    api_url: str = "https://openrouter.ai/api/v1/chat/completions"
+    api_keys: str = os.environ.get("OPENROUTER_DEEPSEEK_API_KEYS", "")
+    api_keys_file: str = os.environ.get("OPENROUTER_DEEPSEEK_API_KEYS_FILE", "")
+    key_selection: str = os.environ.get("OPENROUTER_DEEPSEEK_KEY_SELECTION", "least_in_flight")
+    api_url: str = os.environ.get("OPENROUTER_DEEPSEEK_API_URL", "https://openrouter.ai/api/v1/chat/completions")
     default_model: str = "deepseek/deepseek-r1-zero:free"
+    context_tokens: int = int(os.environ.get("OPENROUTER_DEEPSEEK_CONTEXT_TOKENS", 64000))
+    requests_per_minute: int = int(os.environ.get("OPENROUTER_DEEPSEEK_RPM", 0))
+    tokens_per_minute: int = int(os.environ.get("OPENROUTER_DEEPSEEK_TPM", 0))
 
 class OpenRouterDeepSeekService(AIModelService):
     """Сервис для работы с OpenRouter DeepSeek API"""
+    
+    api_key_error = "API ключ Openrouter Deepseek не настроен"
 
     def __init__(self, config: Optional[OpenRouterDeepSeekConfig] = None):
         super().__init__("openrouter-deepseek", config)
@@ -23,33 +32,13 @@ class OpenRouterDeepSeekService(AIModelService):
         self, 
         message: str, 
         prompt_template: Optional[str] = None, 
+        *,
+        request_context: Optional[RequestContext] = None,
         **kwargs: Any
     ) -> Dict[str, Any]:
-        if not self.config.api_key:
-            return {"error": "API ключ Openrouter Deepseek не настроен"}
-        
-        if prompt_template:
-            template_data = self.get_prompt_template(prompt_template)
-            if not template_data:
-                return {"error": f"Шаблон промпта '{prompt_template}' не найден"}
-            
-            prompt_data = self.format_prompt(
-                template_data, 
-                message=message,
-                **kwargs
-            )
-        else:
-            prompt_data = {
-                "model": kwargs.get("model", self.config.default_model),
-                "messages": [{"role": "user", "content": message}],
-                "temperature": kwargs.get("temperature", self.config.default_temperature),
-                "max_tokens": kwargs.get("max_tokens", self.config.default_max_tokens)
-            }
-        
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json"
-        }
+        try:
+            prompt_data = self.prepare_request(message, prompt_template, **kwargs)
+        except ValueError as e:
+            return {"error": str(e)}
         
-        response = self._make_api_request(self.config.api_url, prompt_data, headers)
-        return response
+        return self._make_api_request(self.config.api_url, prompt_data, context=request_context)
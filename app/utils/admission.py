@@ -0,0 +1,330 @@
+import math
+import os
+import re
+import select
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .exceptions import AdmissionRejected, ClientDisconnected
+from .metrics import observe_admission
+
+# Как часто ожидающий запрос проверяет, не отключился ли клиент
+POLL_INTERVAL = 0.05
+# Вес нового замера во времени обработки запроса
+EWMA_ALPHA = 0.2
+
+
+class PriorityClass:
+    """Класс приоритета: ограниченная очередь и доля мест обработки"""
+
+    def __init__(self, name: str, rank: int, max_queue: int, limit: int):
+        self.name = name
+        self.rank = rank
+        self.max_queue = max_queue
+        self.limit = limit
+        self.active = 0
+        self.waiters: Deque['_Waiter'] = deque()
+        self.counters = {
+            "admitted": 0, "queued": 0, "rejected_full": 0, "rejected_deadline": 0,
+            "expired": 0, "disconnected": 0
+        }
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionTicket:
+    """Место обработки, выданное запросу"""
+
+    __slots__ = ('priority_class', 'started', 'released')
+
+    def __init__(self, priority_class: PriorityClass):
+        self.priority_class = priority_class
+        self.started = time.monotonic()
+        self.released = False
+
+
+def parse_classes(spec: str, concurrency: int) -> List[PriorityClass]:
+    """
+    Разбирает классы приоритета, от высшего к низшему. Классы разделяются
+    запятыми, параметры - точкой с запятой:
+
+        interactive;queue=64, batch;queue=256;share=0.5
+
+    queue - наибольшая очередь класса, share - доля мест обработки,
+    которую класс может занять (по умолчанию все места)
+
+    Raises:
+        ValueError: Если параметр класса не распознан
+    """
+    classes = []
+    for entry in re.split(r'[,\n]', spec):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, *options = [part.strip() for part in entry.split(';')]
+        params: Dict[str, str] = {}
+        for option in options:
+            key, sep, raw = option.partition('=')
+            if not sep or key not in ("queue", "share"):
+                raise ValueError(f"Неизвестный параметр класса приоритета: '{option}'")
+            params[key] = raw.strip()
+        share = min(max(float(params.get("share", 1.0)), 0.0), 1.0)
+        classes.append(PriorityClass(
+            name,
+            rank=len(classes),
+            max_queue=int(params.get("queue", 64)),
+            limit=max(math.floor(concurrency * share), 1)
+        ))
+    if not classes:
+        raise ValueError("Не задано ни одного класса приоритета")
+    return classes
+
+
+def parse_clients(spec: str) -> Dict[str, str]:
+    """Разбирает соответствие клиентов классам: 'reports=batch, crm=interactive'"""
+    result = {}
+    for entry in re.split(r'[,\n]', spec):
+        client, sep, name = entry.partition('=')
+        if sep and client.strip() and name.strip():
+            result[client.strip()] = name.strip()
+    return result
+
+
+def socket_disconnected(sock: Any) -> bool:
+    """
+    Закрыл ли клиент соединение. Тело запроса к этому моменту уже прочитано,
+    поэтому пустое чтение означает, что клиент отключился
+    """
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+class AdmissionController:
+    """
+    Допуск запросов к обработке. Одновременно обрабатывается не больше
+    concurrency запросов, остальные ждут в очереди своего класса;
+    освободившееся место достаётся классу с высшим приоритетом. Запрос
+    отклоняется сразу, если очередь класса заполнена или ожидаемое время
+    в очереди больше оставшегося до дедлайна. Запросы отключившихся
+    клиентов снимаются с очереди и к провайдеру не отправляются
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        classes: List[PriorityClass],
+        default_class: Optional[str] = None,
+        clients: Optional[Dict[str, str]] = None
+    ):
+        self.concurrency = concurrency
+        self.classes = {item.name: item for item in classes}
+        self._ordered = sorted(classes, key=lambda item: item.rank)
+        self.default_class = default_class or self._ordered[0].name
+        if self.default_class not in self.classes:
+            raise ValueError(f"Неизвестный класс приоритета по умолчанию: {self.default_class}")
+        self.clients = clients or {}
+        for name in self.clients.values():
+            if name not in self.classes:
+                raise ValueError(f"Неизвестный класс приоритета клиента: {name}")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._service_time: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0
+
+    def classify(self, priority: Optional[str] = None, client: Optional[str] = None) -> PriorityClass:
+        """
+        Класс запроса: по клиенту из ADMISSION_CLIENTS, иначе по заголовку
+        X-Priority, иначе класс по умолчанию
+
+        Raises:
+            ValueError: Если класс из заголовка не существует
+        """
+        name = self.clients.get(client) if client else None
+        if name is None and priority:
+            name = priority.strip().lower()
+            if name not in self.classes:
+                raise ValueError(f"Неизвестный класс приоритета: {priority}")
+        return self.classes[name or self.default_class]
+
+    def _can_start(self, item: PriorityClass) -> bool:
+        return self._active < self.concurrency and item.active < item.limit
+
+    def _estimate_wait(self, item: PriorityClass) -> float:
+        """Ожидаемое время в очереди для нового запроса класса"""
+        if self._service_time is None:
+            return 0.0
+        ahead = sum(len(other.waiters) for other in self._ordered if other.rank <= item.rank)
+        return (ahead + 1) * self._service_time / min(self.concurrency, item.limit)
+
+    def _start(self, item: PriorityClass) -> AdmissionTicket:
+        self._active += 1
+        item.active += 1
+        return AdmissionTicket(item)
+
+    def admit(
+        self,
+        item: PriorityClass,
+        deadline: Optional[float] = None,
+        disconnected: Optional[Callable[[], bool]] = None
+    ) -> AdmissionTicket:
+        """
+        Ждёт места для обработки запроса
+
+        Args:
+            deadline: Момент time.monotonic(), после которого ответ клиенту не нужен
+            disconnected: Проверка, что клиент закрыл соединение
+
+        Raises:
+            AdmissionRejected: Очередь заполнена или дедлайн не будет выдержан
+            ClientDisconnected: Клиент отключился, пока запрос ждал в очереди
+        """
+        queued = time.monotonic()
+        with self._lock:
+            # Запрос не обгоняет ожидающих того же или более высокого приоритета
+            blocked = any(other.waiters for other in self._ordered if other.rank <= item.rank)
+            if not blocked and self._can_start(item):
+                ticket = self._start(item)
+                item.counters["admitted"] += 1
+                observe_admission(item.name, "admitted", 0.0)
+                return ticket
+            if len(item.waiters) >= item.max_queue:
+                item.counters["rejected_full"] += 1
+                observe_admission(item.name, "rejected_full")
+                raise AdmissionRejected(
+                    f"Очередь запросов класса {item.name} заполнена",
+                    retry_after=self._estimate_wait(item) or 1.0
+                )
+            wait = self._estimate_wait(item)
+            if deadline is not None and queued + wait > deadline:
+                item.counters["rejected_deadline"] += 1
+                observe_admission(item.name, "rejected_deadline")
+                raise AdmissionRejected(
+                    f"Запрос класса {item.name} не успеет дождаться обработки: ожидание около {wait:.1f} с",
+                    retry_after=wait
+                )
+            waiter = _Waiter()
+            item.waiters.append(waiter)
+            item.counters["queued"] += 1
+
+        while True:
+            timeout = POLL_INTERVAL
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.monotonic(), 0.0))
+            if waiter.event.wait(timeout):
+                break
+            gone = disconnected is not None and disconnected()
+            if gone or (deadline is not None and time.monotonic() >= deadline):
+                with self._lock:
+                    if not waiter.granted:
+                        item.waiters.remove(waiter)
+                        outcome = "disconnected" if gone else "expired"
+                        item.counters[outcome] += 1
+                        observe_admission(item.name, outcome, time.monotonic() - queued)
+                        if gone:
+                            raise ClientDisconnected("Клиент отключился, пока запрос ждал очереди")
+                        raise AdmissionRejected(
+                            f"Истекло время ожидания очереди класса {item.name}",
+                            retry_after=self._estimate_wait(item)
+                        )
+                break
+
+        ticket = AdmissionTicket(item)
+        # Перед отправкой провайдеру: клиент мог уйти, пока место освобождалось
+        if disconnected is not None and disconnected():
+            with self._lock:
+                item.counters["disconnected"] += 1
+            self.release(ticket, observe=False)
+            observe_admission(item.name, "disconnected", time.monotonic() - queued)
+            raise ClientDisconnected("Клиент отключился, пока запрос ждал очереди")
+        with self._lock:
+            item.counters["admitted"] += 1
+        observe_admission(item.name, "admitted", time.monotonic() - queued)
+        return ticket
+
+    def release(self, ticket: AdmissionTicket, observe: bool = True):
+        """Освобождает место и передаёт его ожидающему запросу с высшим приоритетом"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._active -= 1
+            ticket.priority_class.active -= 1
+            if observe:
+                elapsed = time.monotonic() - ticket.started
+                self._service_time = elapsed if self._service_time is None else (
+                    EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self._service_time
+                )
+            self._dispatch()
+
+    def _dispatch(self):
+        for item in self._ordered:
+            while item.waiters and self._can_start(item):
+                waiter = item.waiters.popleft()
+                self._active += 1
+                item.active += 1
+                waiter.granted = True
+                waiter.event.set()
+            if self._active >= self.concurrency:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "service_ms": round(self._service_time * 1000, 1) if self._service_time is not None else None,
+                "classes": {
+                    item.name: dict(
+                        item.counters,
+                        active=item.active,
+                        waiting=len(item.waiters),
+                        limit=item.limit,
+                        max_queue=item.max_queue
+                    )
+                    for item in self._ordered
+                }
+            }
+
+
+admission_controller = None
+_admission_lock = threading.Lock()
+
+def init_admission_controller() -> AdmissionController:
+    """Создаёт контроль допуска из переменных окружения (по умолчанию выключен)"""
+    global admission_controller
+    concurrency = int(os.environ.get('ADMISSION_CONCURRENCY', 0))
+    admission_controller = AdmissionController(
+        concurrency,
+        parse_classes(os.environ.get('ADMISSION_CLASSES', 'interactive;queue=64, batch;queue=256;share=0.5'),
+                      concurrency),
+        default_class=os.environ.get('ADMISSION_DEFAULT_CLASS') or None,
+        clients=parse_clients(os.environ.get('ADMISSION_CLIENTS', ''))
+    )
+    return admission_controller
+
+def get_admission_controller() -> AdmissionController:
+    """Возвращает глобальный контроль допуска"""
+    if admission_controller is None:
+        with _admission_lock:
+            if admission_controller is None:
+                init_admission_controller()
+    return admission_controller
@@ -0,0 +1,209 @@
+import asyncio
+import contextvars
+import os
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Any, Awaitable, Dict, Optional, Tuple
+
+from .timing import get_request_timer
+
+if TYPE_CHECKING:
+    import httpx
+
+
+async def _in_context(context: contextvars.Context, coro: Awaitable[Any]) -> Any:
+    """Выполняет корутину со значениями контекстных переменных из context"""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+class _ConnectionTrace:
+    """
+    Обработчик событий httpx (extensions["trace"]): замеряет установку
+    соединения (connect) и время до заголовков ответа (ttfb)
+    """
+
+    def __init__(self, timer: Any):
+        self.timer = timer
+        self.started = time.perf_counter()
+        self.connect_started: Optional[float] = None
+
+    async def __call__(self, event: str, info: Dict[str, Any]):
+        now = time.perf_counter()
+        if event == "connection.connect_tcp.started":
+            self.connect_started = now
+        elif event.endswith("send_request_headers.started") and self.connect_started is not None:
+            # TCP и TLS завершены, запрос уходит по новому соединению
+            self.timer.add("connect", now - self.connect_started)
+            self.connect_started = None
+        elif event.endswith("receive_response_headers.complete"):
+            self.timer.add("ttfb", now - self.started)
+
+
+class AsyncEngine:
+    """
+    Асинхронный движок запросов к провайдерам.
+
+    Все запросы выполняются в одном фоновом event loop, поэтому ожидание
+    ответа нейросети не занимает отдельный поток на каждый запрос.
+    Число одновременных запросов ограничивается семафором
+    """
+
+    def __init__(self, max_concurrency: int = 256):
+        self.max_concurrency = max_concurrency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._clients: Dict[str, 'httpx.AsyncClient'] = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+
+    def start(self):
+        """Запускает фоновый event loop, если он ещё не запущен"""
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name='async-engine', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def submit(self, coro: Awaitable[Any], context: Optional[contextvars.Context] = None) -> Future:
+        """
+        Планирует корутину в фоновом loop и возвращает Future. Корутина видит
+        контекстные переменные вызывающего потока (идентификатор запроса, замер этапов)
+        или переданного context
+        """
+        self.start()
+        context = context if context is not None else contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(_in_context(context, coro), self._loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет корутину в фоновом loop и ждёт результата не дольше timeout
+        секунд. Вызывающий поток занят всё время ожидания
+
+        Raises:
+            TimeoutError: Если корутина не завершилась вовремя (она отменяется)
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("Истекло время ожидания ответа провайдера") from None
+
+    def _get_client(self, provider: str, config: Any) -> 'httpx.AsyncClient':
+        """Возвращает AsyncClient провайдера (вызывается только внутри loop)"""
+        client = self._clients.get(provider)
+        if client is None:
+            # httpx импортируется только при включённом асинхронном режиме: это заметная часть времени запуска
+            import httpx
+            connect_timeout, read_timeout = config.get_timeouts()
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=config.pool_maxsize if config.keep_alive else 0
+                )
+            )
+            self._clients[provider] = client
+        return client
+
+    async def post_json(
+        self,
+        provider: str,
+        config: Any,
+        endpoint: str,
+        content: bytes,
+        headers: Dict[str, str],
+        timeouts: Optional[Tuple[float, float]] = None
+    ) -> 'httpx.Response':
+        """
+        Отправляет POST-запрос с учётом ограничения параллельности.
+        timeouts - пара (connect, read), по умолчанию берутся из config
+
+        Returns:
+            httpx.Response: Полностью прочитанный ответ
+        """
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            client = self._get_client(provider, config)
+            kwargs: Dict[str, Any] = {}
+            timer = get_request_timer()
+            if timer is not None:
+                kwargs["extensions"] = {"trace": _ConnectionTrace(timer)}
+            if timeouts is not None:
+                import httpx
+                connect_timeout, read_timeout = timeouts
+                kwargs["timeout"] = httpx.Timeout(read_timeout, connect=connect_timeout)
+            return await client.post(endpoint, content=content, headers=headers, **kwargs)
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает статистику движка"""
+        return {
+            "running": int(self._loop is not None),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting
+        }
+
+    def stop(self):
+        """Закрывает клиенты и останавливает фоновый loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def close_clients():
+            for client in list(self._clients.values()):
+                await client.aclose()
+            self._clients.clear()
+
+        asyncio.run_coroutine_threadsafe(close_clients(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+async_engine = None
+_engine_lock = threading.Lock()
+
+def get_async_engine():
+    """Возвращает глобальный асинхронный движок"""
+    global async_engine
+    if async_engine is None:
+        with _engine_lock:
+            if async_engine is None:
+                async_engine = AsyncEngine(int(os.environ.get('ASYNC_MAX_CONCURRENCY', 256)))
+    return async_engine
+
+def _reset_after_fork():
+    """Фоновый loop не переживает fork, дочерний процесс запускает свой"""
+    global async_engine, _engine_lock
+    async_engine = None
+    _engine_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
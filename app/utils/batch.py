@@ -0,0 +1,180 @@
+import os
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .async_engine import get_async_engine
+from .timing import detached_context
+
+# Как часто пакет, упёршийся в лимиты провайдеров, проверяет освободившиеся места
+POLL_INTERVAL = 0.05
+
+
+class ProviderSlots:
+    """
+    Ограничение одновременных запросов пакетов и заданий к каждому провайдеру,
+    общее для всего процесса: параллельные пакеты и воркеры очереди заданий
+    делят одни и те же места
+    """
+
+    def __init__(self, limit: int = 8):
+        self.limit = limit
+        self._running: Dict[str, int] = defaultdict(int)
+        self._cond = threading.Condition()
+
+    def try_acquire(self, provider: str) -> bool:
+        """Занимает место у провайдера, если оно есть, не дожидаясь"""
+        with self._cond:
+            if self._running[provider] >= self.limit:
+                return False
+            self._running[provider] += 1
+            return True
+
+    def release(self, provider: str):
+        with self._cond:
+            self._running[provider] -= 1
+            if not self._running[provider]:
+                del self._running[provider]
+            self._cond.notify_all()
+
+    def wait(self, timeout: float):
+        """Ждёт, пока какое-нибудь место освободится, не дольше timeout секунд"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._running)
+
+
+class BatchRunner:
+    """
+    Выполняет пакет элементов параллельно в общем пуле потоков или,
+    в асинхронном режиме, задачами AsyncEngine, ограничивая число
+    одновременных запросов к каждому провайдеру общими местами slots
+    """
+
+    def __init__(self, max_workers: int = 32, slots: Optional[ProviderSlots] = None):
+        self.max_workers = max_workers
+        self.slots = slots or ProviderSlots()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def run(
+        self,
+        items: List[Any],
+        process_item: Callable[[Any], Any],
+        provider_of: Callable[[Any], str],
+        asynchronous: bool = False
+    ) -> Iterator[Tuple[int, Any]]:
+        """
+        Запускает обработку элементов и отдаёт результаты по мере готовности
+
+        Args:
+            items: Элементы пакета
+            process_item: Обработчик элемента, не должен выбрасывать исключения
+            provider_of: Возвращает провайдера, к которому относится элемент
+            asynchronous: process_item - корутинная функция, элементы выполняются
+                в AsyncEngine и не занимают потоков пула
+
+        Yields:
+            tuple: (индекс элемента во входном списке, результат)
+        """
+        pending: Dict[str, deque] = defaultdict(deque)
+        for index, item in enumerate(items):
+            pending[provider_of(item)].append(index)
+
+        futures = {}
+
+        def fill():
+            for provider, queue in pending.items():
+                while queue and self.slots.try_acquire(provider):
+                    index = queue.popleft()
+                    future = self._submit(process_item, items[index], asynchronous)
+                    # Место освобождается по завершении элемента, даже если клиент уже не читает результаты
+                    future.add_done_callback(lambda _, provider=provider: self.slots.release(provider))
+                    futures[future] = index
+
+        fill()
+        while futures or any(pending.values()):
+            blocked = any(pending.values())
+            if not futures:
+                self.slots.wait(POLL_INTERVAL)
+                fill()
+                continue
+            done, _ = wait(list(futures), timeout=POLL_INTERVAL if blocked else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+            fill()
+
+    def _submit(self, process_item: Callable[[Any], Any], item: Any, asynchronous: bool) -> Future:
+        # Элементы видят идентификатор запроса, но не его замер этапов: они выполняются параллельно
+        context = detached_context()
+        if asynchronous:
+            return get_async_engine().submit(self._acall(process_item, item), context)
+        return self._executor.submit(context.run, self._call, process_item, item)
+
+    async def _acall(self, process_item: Callable[[Any], Any], item: Any) -> Any:
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return await process_item(item)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _call(self, process_item: Callable[[Any], Any], item: Any) -> Any:
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return process_item(item)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает статистику пула пакетной обработки"""
+        return {
+            "workers": self.max_workers,
+            "provider_limit": self.slots.limit,
+            "in_flight": self._in_flight,
+            "providers": self.slots.stats()
+        }
+
+
+provider_slots = None
+_slots_lock = threading.Lock()
+
+def get_provider_slots() -> ProviderSlots:
+    """Возвращает общие для пакетов и заданий места у провайдеров"""
+    global provider_slots
+    if provider_slots is None:
+        with _slots_lock:
+            if provider_slots is None:
+                provider_slots = ProviderSlots(int(os.environ.get('BATCH_PROVIDER_CONCURRENCY', 8)))
+    return provider_slots
+
+batch_runner = None
+_runner_lock = threading.Lock()
+
+def get_batch_runner():
+    """Возвращает глобальный исполнитель пакетов"""
+    global batch_runner
+    if batch_runner is None:
+        with _runner_lock:
+            if batch_runner is None:
+                batch_runner = BatchRunner(int(os.environ.get('BATCH_WORKERS', 32)), get_provider_slots())
+    return batch_runner
+
+def _reset_after_fork():
+    """Потоки пула и занятые места не переживают fork: дочерний процесс создаёт свои"""
+    global provider_slots, _slots_lock, batch_runner, _runner_lock
+    provider_slots = None
+    _slots_lock = threading.Lock()
+    batch_runner = None
+    _runner_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
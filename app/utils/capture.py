@@ -0,0 +1,179 @@
+import atexit
+import hashlib
+import logging
+import os
+import random
+import threading
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Optional
+
+from .fast_json import dumps
+from .log_pipeline import LogPipeline
+
+REDACT_MODES = ("hash", "drop")
+
+
+class TrafficCapture:
+    """
+    Запись формы трафика /api/process в JSON Lines для воспроизведения
+    (benchmarks.replay): модель, шаблон, размеры и время запроса, статус
+    и размер ответа. Текст сообщений не сохраняется: вместо него пишется
+    длина и, в режиме hash, солёный хэш - одинаковые сообщения остаются
+    одинаковыми при воспроизведении. Файл пишет фоновый поток, с ротацией
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 5,
+        redact: str = "hash",
+        sample_rate: float = 1.0,
+        salt: str = "",
+        queue_size: int = 10000
+    ):
+        if redact not in REDACT_MODES:
+            raise ValueError(f"Неизвестный режим скрытия сообщений: {redact}")
+        self.path = path
+        self.redact = redact
+        self.sample_rate = sample_rate
+        self.salt = salt.encode('utf-8')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.pipeline = LogPipeline([handler], queue_size=queue_size)
+        self.pipeline.start()
+        atexit.register(self.pipeline.stop)
+        self.logger = logging.getLogger('neiro.capture')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.pipeline.handler)
+        self._lock = threading.Lock()
+        self._counters = {"captured": 0, "skipped": 0}
+
+    def sampled(self) -> bool:
+        """Попадает ли очередной запрос в выборку"""
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            return True
+        with self._lock:
+            self._counters["skipped"] += 1
+        return False
+
+    def _digest(self, text: str) -> str:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=8, key=self.salt[:64]).hexdigest()
+
+    def _text_shape(self, text: str) -> Dict[str, Any]:
+        shape: Dict[str, Any] = {"chars": len(text)}
+        if self.redact == "hash":
+            shape["hash"] = self._digest(text)
+        return shape
+
+    def _value_shape(self, value: Any) -> Any:
+        """Числа и флаги сохраняются как есть, строки и структуры - только размером"""
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        return self._text_shape(value if isinstance(value, str) else dumps(value))
+
+    def describe(self, data: Any) -> Dict[str, Any]:
+        """Форма тела запроса без содержимого сообщений"""
+        if not isinstance(data, dict):
+            return {"invalid": True}
+        message = data.get("message")
+        parameters = data.get("parameters")
+        entry = {
+            "model": data.get("model"),
+            "template": data.get("prompt_template"),
+            "message": self._value_shape(message) if message is not None else None,
+            "parameters": (
+                {str(name): self._value_shape(value) for name, value in parameters.items()}
+                if isinstance(parameters, dict) else None
+            ),
+            "stream": bool(data.get("stream")),
+            "session": bool(data.get("session_id"))
+        }
+        for name in ("fallback", "hedge", "cache", "timeout"):
+            if data.get(name) not in (None, False, []):
+                entry[name] = data[name]
+        return entry
+
+    def record(
+        self,
+        data: Any,
+        request_bytes: Optional[int],
+        arrived: float,
+        duration: float,
+        response: Any,
+        context: Any = None,
+        usage: Optional[Dict[str, Any]] = None,
+        request_id: Optional[str] = None
+    ):
+        """
+        Записывает запрос и итог его обработки. Для потоковых ответов
+        duration - время до начала отдачи потока
+        """
+        entry = {"ts": round(arrived, 4), "id": request_id}
+        entry.update(self.describe(data))
+        entry.update({
+            "request_bytes": request_bytes,
+            "status": response.status_code,
+            "response_bytes": response.content_length,
+            "duration_ms": round(duration * 1000, 2),
+            "model_used": response.headers.get('X-Model-Used')
+        })
+        if context is not None:
+            entry.update({
+                "upstream_ms": round(context.upstream_time * 1000, 2),
+                "cache": context.cache_status,
+                "retries": context.retries
+            })
+        if isinstance(usage, dict):
+            entry["tokens"] = {
+                name: usage[name] for name in ("prompt_tokens", "completion_tokens") if isinstance(usage.get(name), int)
+            }
+        self.logger.info(dumps(entry))
+        with self._lock:
+            self._counters["captured"] += 1
+
+    def after_fork(self, tag: str):
+        """Каждый воркер пишет свой файл: <имя>.<tag>.jsonl"""
+        self.pipeline.after_fork(tag)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._counters)
+        result.update({
+            "file": self.path,
+            "sample_rate": self.sample_rate,
+            "dropped": self.pipeline.handler.dropped
+        })
+        return result
+
+
+traffic_capture = None
+_capture_ready = False
+_capture_lock = threading.Lock()
+
+def init_traffic_capture() -> Optional[TrafficCapture]:
+    """Включает запись трафика, если задан CAPTURE_FILE"""
+    global traffic_capture, _capture_ready
+    path = os.environ.get('CAPTURE_FILE', '')
+    traffic_capture = TrafficCapture(
+        path,
+        max_bytes=int(os.environ.get('CAPTURE_MAX_BYTES', 50 * 1024 * 1024)),
+        backup_count=int(os.environ.get('CAPTURE_BACKUP_COUNT', 5)),
+        redact=os.environ.get('CAPTURE_REDACT', 'hash'),
+        sample_rate=float(os.environ.get('CAPTURE_SAMPLE_RATE', 1.0)),
+        salt=os.environ.get('CAPTURE_SALT', '')
+    ) if path else None
+    _capture_ready = True
+    return traffic_capture
+
+def get_traffic_capture() -> Optional[TrafficCapture]:
+    """Возвращает запись трафика или None, если она выключена"""
+    if not _capture_ready:
+        with _capture_lock:
+            if not _capture_ready:
+                init_traffic_capture()
+    return traffic_capture
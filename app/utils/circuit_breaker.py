@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from .exceptions import CircuitOpenError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера. Следит за долей ошибок и p95 задержки
+    в скользящем окне; при деградации размыкается и некоторое время
+    не пропускает запросы, затем пропускает один пробный
+    """
+
+    def __init__(
+        self,
+        failure_threshold: float = 0.5,
+        min_requests: int = 10,
+        window: float = 60.0,
+        open_seconds: float = 30.0,
+        latency_threshold: float = 0.0,
+        max_samples: int = 1000
+    ):
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.latency_threshold = latency_threshold
+        self._samples: deque = deque(maxlen=max_samples)
+        self._state = CLOSED
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._counters = {"opened": 0, "rejected": 0}
+
+    def _trim(self, now: float):
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def _percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(sample[2] for sample in self._samples if sample[1])
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+    def allow(self):
+        """
+        Проверяет, можно ли отправить запрос
+
+        Raises:
+            CircuitOpenError: Если предохранитель разомкнут
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN and now >= self._opened_until:
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+
+            self._counters["rejected"] += 1
+            retry_after = max(self._opened_until - now, 1.0)
+        raise CircuitOpenError("Провайдер временно недоступен", retry_after=retry_after)
+
+    def release_probe(self):
+        """Снимает пробный запрос, не дошедший до провайдера, не учитывая его результат"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record(self, success: bool, latency: float):
+        """Учитывает результат запроса"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success:
+                    self._state = CLOSED
+                    self._samples.clear()
+                else:
+                    self._open(now)
+                    return
+
+            self._samples.append((now, success, latency))
+            self._trim(now)
+            if self._state == CLOSED and self._is_degraded():
+                self._open(now)
+
+    def _is_degraded(self) -> bool:
+        if len(self._samples) < self.min_requests:
+            return False
+        failures = sum(1 for sample in self._samples if not sample[1])
+        if failures / len(self._samples) >= self.failure_threshold:
+            return True
+        if self.latency_threshold > 0:
+            p95 = self._percentile(0.95)
+            return p95 is not None and p95 > self.latency_threshold
+        return False
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_until = now + self.open_seconds
+        self._counters["opened"] += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_until:
+                return HALF_OPEN
+            return self._state
+
+    def latency_percentile(self, q: float = 0.95) -> Optional[float]:
+        """Возвращает перцентиль задержки успешных запросов в окне"""
+        with self._lock:
+            self._trim(time.monotonic())
+            return self._percentile(q)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            total = len(self._samples)
+            failures = sum(1 for sample in self._samples if not sample[1])
+            result = dict(self._counters)
+            p50, p95 = self._percentile(0.5), self._percentile(0.95)
+        result.update({
+            "state": self.state,
+            "requests": total,
+            "error_rate": round(failures / total, 3) if total else 0.0,
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None
+        })
+        return result
+
+
+class CircuitBreakerRegistry:
+    """Предохранители по провайдерам"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, config: Any) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(provider)
+                if breaker is None:
+                    breaker = CircuitBreaker(
+                        config.breaker_failure_threshold,
+                        config.breaker_min_requests,
+                        config.breaker_window,
+                        config.breaker_open_seconds,
+                        config.breaker_latency_threshold
+                    )
+                    self._breakers[provider] = breaker
+        return breaker
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {provider: breaker.stats() for provider, breaker in breakers.items()}
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+def get_circuit_breaker(provider: str, config: Any) -> CircuitBreaker:
+    """Возвращает предохранитель провайдера"""
+    return circuit_breakers.get(provider, config)
@@ -0,0 +1,325 @@
+import io
+import os
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .fast_json import dumps
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+# Типы содержимого, которые имеет смысл сжимать
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript')
+GZIP_ENCODINGS = ('gzip', 'x-gzip')
+READ_CHUNK = 64 * 1024
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Разбирает Accept-Encoding в словарь {кодировка: q}"""
+    result = {}
+    for part in header.split(','):
+        coding, *params = [item.strip() for item in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding.lower()] = q
+    return result
+
+
+def choose_encoding(header: str, available: Iterable[str]) -> Optional[str]:
+    """
+    Выбирает кодировку ответа: наибольший q клиента, при равенстве -
+    первая в available. None - отдавать без сжатия
+    """
+    accepted = parse_accept_encoding(header)
+    default = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, default)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class _Encoder:
+    """Потоковое сжатие одного ответа"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Сжимает часть ответа и выталкивает её клиенту без ожидания следующих"""
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b'') -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class RequestBodyError(Exception):
+    """Тело запроса не удалось распаковать"""
+
+    def __init__(self, message: str, status: str):
+        super().__init__(message)
+        self.status = status
+
+
+def decompress_gzip(stream: Any, length: Optional[int], limit: int) -> bytes:
+    """
+    Распаковывает тело запроса в gzip по частям, не раскрывая больше limit байт
+
+    Raises:
+        RequestBodyError: Если тело повреждено или больше limit после распаковки
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    parts: List[bytes] = []
+    size = 0
+    remaining = length
+    try:
+        while remaining is None or remaining > 0:
+            chunk = stream.read(READ_CHUNK if remaining is None else min(READ_CHUNK, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            data = decompressor.decompress(chunk, limit - size + 1)
+            while True:
+                size += len(data)
+                if size > limit:
+                    raise RequestBodyError(
+                        f"Тело запроса после распаковки больше {limit} байт", '413 Request Entity Too Large'
+                    )
+                parts.append(data)
+                if not decompressor.unconsumed_tail:
+                    break
+                data = decompressor.decompress(decompressor.unconsumed_tail, limit - size + 1)
+            if decompressor.eof:
+                break
+        tail = decompressor.flush()
+    except zlib.error as e:
+        raise RequestBodyError(f"Повреждённое тело запроса в gzip: {str(e)}", '400 Bad Request')
+    if size + len(tail) > limit:
+        raise RequestBodyError(f"Тело запроса после распаковки больше {limit} байт", '413 Request Entity Too Large')
+    if not decompressor.eof:
+        raise RequestBodyError("Тело запроса в gzip обрезано", '400 Bad Request')
+    parts.append(tail)
+    return b''.join(parts)
+
+
+class CompressionMiddleware:
+    """
+    WSGI-обёртка приложения: сжимает ответы в br или gzip по Accept-Encoding
+    и распаковывает тела запросов с Content-Encoding: gzip. Ответы меньше
+    min_size не сжимаются; потоковые ответы (без Content-Length) сжимаются
+    по частям, каждая часть сразу уходит клиенту
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        min_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        max_request_size: int = 10 * 1024 * 1024,
+        enabled: bool = True
+    ):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.max_request_size = max_request_size
+        self.enabled = enabled
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._lock = threading.Lock()
+        self._counters = {
+            "compressed": 0, "streamed": 0, "skipped_small": 0, "bytes_in": 0, "bytes_out": 0,
+            "requests_decompressed": 0, "request_errors": 0
+        }
+
+    def _count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._counters[name] += value
+
+    def __call__(self, environ, start_response):
+        error = self._decode_request(environ)
+        if error is not None:
+            self._count(request_errors=1)
+            body = dumps({"error": str(error)}).encode('utf-8')
+            start_response(error.status, [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body)))
+            ])
+            return [body]
+
+        encoding = None
+        if self.enabled and environ.get('REQUEST_METHOD') != 'HEAD':
+            encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        state: Dict[str, Any] = {}
+        buffered: List[bytes] = []
+
+        def _start_response(status, headers, exc_info=None):
+            mode = self._mode(status, headers)
+            state.update(mode=mode, status=status, headers=headers, exc_info=exc_info)
+            if mode == 'buffer':
+                return buffered.append
+            if mode == 'stream':
+                headers = self._encoded_headers(headers, encoding)
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, _start_response)
+        mode = state.get('mode')
+        if mode == 'stream':
+            return self._stream(body, encoding)
+        if mode != 'buffer':
+            return body
+
+        try:
+            data = b''.join(buffered) + b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        compressed = _Encoder(encoding, self.gzip_level, self.brotli_quality).finish(data)
+        headers = state['headers']
+        if len(compressed) >= len(data):
+            headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+            start_response(state['status'], headers + [('Content-Length', str(len(data)))], state['exc_info'])
+            return [data]
+        self._count(compressed=1, bytes_in=len(data), bytes_out=len(compressed))
+        headers = self._encoded_headers(headers, encoding) + [('Content-Length', str(len(compressed)))]
+        start_response(state['status'], headers, state['exc_info'])
+        return [compressed]
+
+    def _decode_request(self, environ) -> Optional[RequestBodyError]:
+        """Подменяет тело запроса в gzip распакованным"""
+        coding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not coding or coding == 'identity':
+            return None
+        if coding not in GZIP_ENCODINGS:
+            return RequestBodyError(f"Кодировка тела запроса {coding} не поддерживается", '415 Unsupported Media Type')
+        try:
+            length = int(environ['CONTENT_LENGTH']) if environ.get('CONTENT_LENGTH') else None
+        except ValueError:
+            return RequestBodyError("Некорректный Content-Length", '400 Bad Request')
+        if length is None and not environ.get('wsgi.input_terminated'):
+            length = 0
+        try:
+            data = decompress_gzip(environ['wsgi.input'], length, self.max_request_size) if length != 0 else b''
+        except RequestBodyError as e:
+            return e
+        environ['wsgi.input'] = io.BytesIO(data)
+        environ['CONTENT_LENGTH'] = str(len(data))
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        environ.pop('wsgi.input_terminated', None)
+        self._count(requests_decompressed=1)
+        return None
+
+    def _mode(self, status: str, headers: List[Tuple[str, str]]) -> Optional[str]:
+        """Как отдавать ответ: None - без сжатия, buffer - целиком, stream - по частям"""
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 304):
+            return None
+        values = {name.lower(): value for name, value in headers}
+        content_type = values.get('content-type', '').lower()
+        if 'content-encoding' in values or 'no-transform' in values.get('cache-control', '').lower():
+            return None
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return None
+        length = values.get('content-length')
+        if length is None:
+            return 'stream'
+        if int(length) < self.min_size:
+            self._count(skipped_small=1)
+            return None
+        return 'buffer'
+
+    @staticmethod
+    def _encoded_headers(headers: List[Tuple[str, str]], encoding: str) -> List[Tuple[str, str]]:
+        """Заголовки сжатого ответа: без Content-Length, ETag становится слабым"""
+        result = []
+        vary = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                value = f"W/{value}"
+            if lower == 'vary':
+                vary = value
+                continue
+            result.append((name, value))
+        if vary is None:
+            vary = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            vary = f"{vary}, Accept-Encoding"
+        result += [('Content-Encoding', encoding), ('Vary', vary)]
+        return result
+
+    def _stream(self, body: Iterable[bytes], encoding: str):
+        encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+        size_in = size_out = 0
+        try:
+            for chunk in body:
+                if not chunk:
+                    continue
+                data = encoder.chunk(chunk)
+                size_in += len(chunk)
+                size_out += len(data)
+                yield data
+            data = encoder.finish()
+            size_out += len(data)
+            yield data
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            self._count(streamed=1, bytes_in=size_in, bytes_out=size_out)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._counters)
+        result.update({
+            "enabled": self.enabled,
+            "encodings": list(self.encodings),
+            "min_size": self.min_size
+        })
+        return result
+
+
+compression = None
+
+def init_compression(app: Any) -> CompressionMiddleware:
+    """Оборачивает WSGI-приложение сжатием с настройками из переменных окружения"""
+    global compression
+    compression = CompressionMiddleware(
+        app,
+        min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+        gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+        brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4)),
+        max_request_size=int(os.environ.get('REQUEST_MAX_DECOMPRESSED_BYTES', 10 * 1024 * 1024)),
+        enabled=os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+    )
+    return compression
+
+def get_compression() -> Optional[CompressionMiddleware]:
+    """Возвращает обёртку сжатия или None, если приложение создано без неё"""
+    return compression
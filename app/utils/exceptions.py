@@ -0,0 +1,44 @@
+from typing import Optional
+
+class UpstreamError(Exception):
+    """Ошибка при обращении к API провайдера"""
+    
+    def __init__(
+        self, 
+        message: str, 
+        status_code: int = 502, 
+        upstream_status: Optional[int] = None, 
+        retry_after: Optional[float] = None
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.upstream_status = upstream_status
+        self.retry_after = retry_after
+
+class RateLimitExceeded(UpstreamError):
+    """Превышен лимит запросов к провайдеру"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None, upstream_status: Optional[int] = None):
+        super().__init__(message, status_code=429, upstream_status=upstream_status, retry_after=retry_after)
+
+class CircuitOpenError(UpstreamError):
+    """Предохранитель провайдера разомкнут, запросы к нему временно не отправляются"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message, status_code=503, retry_after=retry_after)
+
+class RequestCancelled(Exception):
+    """Запрос отменён до отправки провайдеру (например, проиграл хеджированному дублю)"""
+
+class JobQueueFull(Exception):
+    """Очередь заданий заполнена"""
+
+class AdmissionRejected(Exception):
+    """Запрос не принят в обработку: очередь класса заполнена или дедлайн не успеть выдержать"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение, пока запрос ждал очереди"""
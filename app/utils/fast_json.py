@@ -0,0 +1,178 @@
+import json
+import os
+import re
+from typing import Any, Dict, Optional
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+# JSON_BACKEND=json принудительно включает стандартный модуль
+if os.environ.get('JSON_BACKEND', 'auto') == 'json':
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# Начало строки JSON или скобка: ключ верхнего уровня находится без разбора всего тела
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_COLON = re.compile(rb'\s*:\s*')
+# Сколько строк и скобок просматривается в поисках ключа, прежде чем тело разбирается целиком
+SCAN_LIMIT = 64
+
+_decoder = json.JSONDecoder()
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Кодирует объект в JSON (UTF-8, без экранирования не-ASCII символов)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # нестроковые ключи, очень большие целые и т.п. - стандартный модуль
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на orjson; без orjson работает как стандартный"""
+
+    ensure_ascii = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or kwargs:
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj, ensure_ascii=self.ensure_ascii)
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def _string_end(body: bytes, start: int) -> int:
+    """Позиция закрывающей кавычки строки, открытой перед start; -1 - строка не закрыта"""
+    end = body.find(b'"', start)
+    while end >= 0:
+        slash = end - 1
+        while body[slash] == 0x5C:  # обратная косая
+            slash -= 1
+        if (end - slash) % 2:
+            return end
+        end = body.find(b'"', end + 1)
+    return -1
+
+
+def top_level_value(body: bytes, key: bytes) -> Optional[int]:
+    """
+    Смещение значения ключа объекта верхнего уровня. Тело просматривается
+    только до этого ключа; строки пропускаются целиком (поиском закрывающей
+    кавычки), поэтому ключ внутри вложенного значения не принимается за ключ
+    верхнего уровня. None - тело не объект, ключа нет или он не встретился
+    среди первых SCAN_LIMIT строк и скобок
+    """
+    depth = 0
+    position = 0
+    for _ in range(SCAN_LIMIT):
+        match = _STRUCTURE.search(body, position)
+        if match is None:
+            return None
+        start = match.start()
+        token = body[start]
+        if token == 0x22:  # кавычка
+            end = _string_end(body, start + 1)
+            if end < 0:
+                return None
+            position = end + 1
+            if depth == 1 and body[start + 1:end] == key:
+                colon = _COLON.match(body, position)
+                if colon is not None:
+                    return colon.end()
+            continue
+        position = start + 1
+        if token == 0x7B or token == 0x5B:  # { [
+            if depth == 0 and (token == 0x5B or body[:start].strip()):
+                return None
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return None
+    return None
+
+
+class RawResponse:
+    """
+    Тело успешного ответа провайдера без разбора. Отдаётся клиенту как есть;
+    разбирается, только если ответ нужно изменить или сохранить
+    """
+
+    __slots__ = ('body', 'content_type', '_parsed')
+
+    def __init__(self, body: bytes, content_type: str = 'application/json', parsed: Optional[Dict[str, Any]] = None):
+        self.body = body
+        self.content_type = content_type
+        self._parsed = parsed
+
+    def json(self) -> Dict[str, Any]:
+        if self._parsed is None:
+            self._parsed = loads(self.body)
+        return self._parsed
+
+    def usage(self) -> Optional[Dict[str, Any]]:
+        """
+        Поле usage без разбора всего тела: провайдеры пишут его в конце ответа,
+        а внутри строк JSON последовательность "usage" без обратной косой не встречается
+        """
+        if self._parsed is not None:
+            usage = self._parsed.get("usage")
+            return usage if isinstance(usage, dict) else None
+        position = self.body.rfind(b'"usage"')
+        if position < 0:
+            return None
+        start = self.body.find(b'{', position)
+        if start < 0 or self.body[position + 7:start].strip(b' \t\r\n:'):
+            return None
+        try:
+            usage, _ = _decoder.raw_decode(self.body[start:].decode('utf-8', 'replace'))
+        except ValueError:
+            return None
+        return usage if isinstance(usage, dict) else None
+
+    @classmethod
+    def parse(cls, body: bytes, content_type: str = 'application/json') -> Any:
+        """
+        Возвращает RawResponse, если тело можно отдать как есть: объект
+        с массивом choices на верхнем уровне и без error (некоторые провайдеры
+        присылают ошибку с кодом 200), иначе - разобранный JSON. Внутри строк
+        последовательность "error" без обратной косой не встречается, поэтому
+        тело без неё точно без ключа error; choices ищется просмотром ключей
+        верхнего уровня до него. Если так решить нельзя, тело разбирается целиком
+
+        Raises:
+            ValueError: Если тело не является JSON
+        """
+        if b'"error"' not in body and body.rstrip().endswith(b'}'):
+            choices = top_level_value(body, b'choices')
+            if choices is not None and body[choices:choices + 1] == b'[':
+                return cls(body, content_type)
+        parsed = loads(body)
+        if isinstance(parsed, dict) and "error" not in parsed and isinstance(parsed.get("choices"), list):
+            return cls(body, content_type, parsed)
+        return parsed
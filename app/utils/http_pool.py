@@ -0,0 +1,207 @@
+import ipaddress
+import os
+import threading
+import time
+from typing import Any, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from .timing import record_span
+
+
+class _TimedConnect:
+    """Замеряет установку соединения (TCP и TLS) как этап запроса connect"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            record_span('connect', time.perf_counter() - started)
+
+
+class _TimedHTTPConnection(_TimedConnect, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnect, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, соединения которого отмечают время установки в замере запроса"""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+
+def internal_address(value: str):
+    """Адрес, если он не публичный (внутренний, loopback, link-local), иначе None"""
+    address = ipaddress.ip_address(value.split('%', 1)[0])
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return None if address.is_global else address
+
+
+class _PublicPeerConnect:
+    """
+    Проверяет адрес, с которым установлено TCP-соединение, до отправки первого
+    байта (и до TLS). Имя хоста при соединении разрешается заново и после
+    проверки могло смениться на внутренний адрес (DNS rebinding)
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = internal_address(sock.getpeername()[0])
+        if address is not None:
+            sock.close()
+            raise NewConnectionError(self, f"Хост {self.host} разрешился во внутренний адрес {address}")
+        return sock
+
+
+class _PublicHTTPConnection(_PublicPeerConnect, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicPeerConnect, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicOnlyHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, который соединяется только с публичными адресами"""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PublicHTTPConnectionPool,
+            "https": _PublicHTTPSConnectionPool
+        }
+
+
+class HTTPSessionPool:
+    """Пул долгоживущих HTTP-сессий: одна сессия с keep-alive на провайдера"""
+
+    def __init__(self):
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, provider: str, config: Any) -> requests.Session:
+        """
+        Возвращает сессию провайдера, создавая её при первом обращении
+
+        Args:
+            provider: Имя провайдера (ключ модели в фабрике)
+            config: Конфигурация сервиса (AIServiceConfig)
+
+        Returns:
+            requests.Session: Сессия с пулом соединений
+        """
+        session = self._sessions.get(provider)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(provider)
+            if session is None:
+                session = self._create_session(config)
+                self._sessions[provider] = session
+            return session
+
+    def _create_session(self, config: Any) -> requests.Session:
+        """Создаёт сессию с настроенным пулом соединений"""
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(
+            pool_connections=config.pool_connections,
+            pool_maxsize=config.pool_maxsize,
+            pool_block=False,
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not config.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Возвращает статистику соединений по провайдерам: open - открытые сейчас
+        (занятые запросами и свободные в пуле), created - созданные за всё время
+
+        Returns:
+            dict: {провайдер: {"open", "idle", "created", "requests", "reused"}}
+        """
+        with self._lock:
+            sessions = dict(self._sessions)
+
+        result = {}
+        for provider, session in sessions.items():
+            created = requests_count = idle = in_use = 0
+            for adapter in set(session.adapters.values()):
+                if not isinstance(adapter, HTTPAdapter):
+                    continue
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    created += pool.num_connections
+                    requests_count += pool.num_requests
+                    if pool.pool is not None:
+                        # Очередь пула заполнена соединениями и пустыми местами (None);
+                        # взятое из неё место занято запросом
+                        idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                        in_use += pool.pool.maxsize - pool.pool.qsize()
+            result[provider] = {
+                "open": in_use + idle,
+                "idle": idle,
+                "created": created,
+                "requests": requests_count,
+                "reused": max(requests_count - created, 0)
+            }
+        return result
+
+    def close_all(self):
+        """Закрывает все сессии и их соединения"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+session_pool = HTTPSessionPool()
+
+def get_session_pool():
+    """Возвращает глобальный пул HTTP-сессий"""
+    return session_pool
+
+def _reset_after_fork():
+    """Соединения родителя не переиспользуются в дочернем процессе"""
+    global session_pool
+    session_pool = HTTPSessionPool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,554 @@
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .async_engine import get_async_engine
+from .batch import POLL_INTERVAL, ProviderSlots, get_provider_slots
+from .exceptions import JobQueueFull
+from .http_pool import PublicOnlyHTTPAdapter, internal_address
+from .log_pipeline import get_request_id, set_request_id
+from .metrics import observe_job, observe_job_wait, set_jobs_queued, track_job_running
+
+logger = logging.getLogger('neiro.jobs')
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+# Выполняет тело задания, возвращает (HTTP-статус, тело ответа), исключений не выбрасывает.
+# В асинхронном режиме очереди - корутинная функция с тем же результатом
+JobRunner = Callable[[Dict[str, Any]], Tuple[int, Dict[str, Any]]]
+
+
+class Job:
+    """Задание очереди. Поля меняет только JobQueue под своей блокировкой"""
+
+    def __init__(self, payload: Dict[str, Any], priority: int, webhook: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.webhook = webhook
+        self.request_id = get_request_id()
+        self.status = QUEUED
+        self.status_code: Optional[int] = None
+        self.body: Optional[Dict[str, Any]] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "model": self.payload.get('model'),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+        if self.status in FINISHED:
+            result["status_code"] = self.status_code
+            if self.status == SUCCEEDED:
+                result["response"] = self.body
+            else:
+                result["error"] = (self.body or {}).get("error")
+        return result
+
+
+class SQLiteJobStore:
+    """
+    Состояние заданий в SQLite: воркеры serve.py видят задания друг друга,
+    хотя выполняет задание тот процесс, который его принял
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT data, expires_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def put(self, job: Dict[str, Any], expires_at: Optional[float] = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, data, expires_at) VALUES (?, ?, ?)",
+            (job["id"], json.dumps(job, ensure_ascii=False), expires_at)
+        )
+
+    def purge(self):
+        self._connect().execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+
+
+class WebhookSender:
+    """
+    Отправляет результат задания POST-запросом на адрес клиента в отдельном
+    небольшом пуле, чтобы медленный получатель не занимал воркеры очереди.
+    С секретом тело подписывается: X-Signature: sha256=<hmac>.
+    Без allowed_hosts webhook отправляется только на публичные адреса:
+    хосты, разрешающиеся во внутренние, loopback и link-local адреса,
+    отклоняются при приёме задания и повторно перед отправкой, а адрес
+    установленного соединения проверяется ещё раз, до отправки запроса
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        timeout: float = 10.0,
+        attempts: int = 3,
+        secret: str = '',
+        allowed_hosts: Optional[List[str]] = None
+    ):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.secret = secret
+        self.allowed_hosts = set(allowed_hosts or ())
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self._session = None
+        self._lock = threading.Lock()
+        self._counters = {"sent": 0, "failed": 0}
+
+    def validate(self, url: Any) -> Optional[str]:
+        """Проверяет адрес, возвращает текст ошибки или None"""
+        if not isinstance(url, str):
+            return "Поле webhook должно быть URL"
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            return "Поле webhook должно быть URL http или https"
+        if self.allowed_hosts:
+            if parsed.hostname not in self.allowed_hosts:
+                return f"Хост {parsed.hostname} не разрешён для webhook"
+            return None
+        try:
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        except ValueError:
+            return "Поле webhook должно быть URL http или https"
+        return self._check_addresses(parsed.hostname, port)
+
+    @staticmethod
+    def _check_addresses(host: str, port: int) -> Optional[str]:
+        """Проверяет, что все адреса хоста публичные, возвращает текст ошибки или None"""
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            return f"Не удалось разрешить хост {host} для webhook"
+        for info in infos:
+            address = internal_address(info[4][0])
+            if address is not None:
+                return f"Хост {host} разрешается во внутренний адрес {address}, webhook на него запрещён"
+        return None
+
+    def send(self, url: str, payload: Dict[str, Any]):
+        self._executor.submit(contextvars.copy_context().run, self._deliver, url, payload)
+
+    def _get_session(self):
+        """Сессия отправки; без allowed_hosts соединяется только с публичными адресами"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    if not self.allowed_hosts:
+                        adapter = PublicOnlyHTTPAdapter(max_retries=0)
+                        session.mount('https://', adapter)
+                        session.mount('http://', adapter)
+                        # Прокси из окружения соединялся бы с адресом сам, в обход проверки
+                        session.trust_env = False
+                    self._session = session
+        return self._session
+
+    def _deliver(self, url: str, payload: Dict[str, Any]):
+        import requests
+
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {"Content-Type": "application/json", "X-Job-ID": payload["id"]}
+        if self.secret:
+            digest = hmac.new(self.secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+            headers["X-Signature"] = f"sha256={digest}"
+
+        for attempt in range(self.attempts):
+            # Адрес проверяется перед каждой попыткой: DNS мог измениться после приёма задания
+            error = self.validate(url)
+            if error is not None:
+                self._count("failed")
+                logger.error(f"Webhook задания {payload['id']} не отправлен: {error}")
+                return
+            try:
+                # Перенаправление могло бы увести запрос на внутренний адрес в обход проверки
+                response = self._get_session().post(
+                    url, data=body, headers=headers, timeout=self.timeout, allow_redirects=False
+                )
+                if response.status_code < 500:
+                    self._count("sent" if response.ok else "failed")
+                    if not response.ok:
+                        logger.warning(f"Webhook задания {payload['id']} отклонён: {response.status_code}")
+                    return
+            except requests.RequestException as e:
+                logger.warning(f"Ошибка отправки webhook задания {payload['id']}: {str(e)}")
+            if attempt + 1 < self.attempts:
+                time.sleep(2 ** attempt)
+        self._count("failed")
+        logger.error(f"Webhook задания {payload['id']} не доставлен за {self.attempts} попытки")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class JobQueue:
+    """
+    Очередь заданий с приоритетами: задания выполняются пулом фоновых потоков,
+    поэтому ожидание долгих ответов не занимает потоки HTTP-сервера.
+    Чем больше priority, тем раньше задание попадёт в работу; при равном
+    приоритете - в порядке поступления. Результат хранится result_ttl секунд.
+    В асинхронном режиме (asynchronous) задания выполняются задачами
+    AsyncEngine, не больше workers одновременно, и не занимают по потоку.
+    С slots задание занимает место у своего провайдера наравне с пакетами:
+    если мест нет, берётся следующее по приоритету задание другого провайдера
+    """
+
+    def __init__(
+        self,
+        runner: JobRunner,
+        workers: int = 8,
+        max_queue: int = 1000,
+        result_ttl: float = 3600,
+        webhooks: Optional[WebhookSender] = None,
+        disk: Optional[SQLiteJobStore] = None,
+        asynchronous: bool = False,
+        slots: Optional[ProviderSlots] = None
+    ):
+        self.runner = runner
+        self.workers = workers
+        self.asynchronous = asynchronous
+        self.slots = slots
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.webhooks = webhooks or WebhookSender()
+        self.disk = disk
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[int, int, str]] = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._counters = {SUCCEEDED: 0, FAILED: 0, CANCELLED: 0, "rejected": 0, "expired": 0}
+
+    def _start(self):
+        """Запускает потоки при первом задании (в каждом процессе свои)"""
+        if self._threads:
+            return
+        if self.asynchronous:
+            self._slots = threading.Semaphore(self.workers)
+            thread = threading.Thread(target=self._dispatch, name='job_dispatch', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job_{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, payload: Dict[str, Any], priority: int = DEFAULT_PRIORITY, webhook: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Ставит задание в очередь
+
+        Raises:
+            JobQueueFull: Если в очереди уже max_queue заданий
+        """
+        job = Job(payload, min(max(priority, MIN_PRIORITY), MAX_PRIORITY), webhook)
+        with self._cond:
+            self._expire()
+            if len(self._heap) >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise JobQueueFull(f"Очередь заданий заполнена ({self.max_queue})")
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, next(self._sequence), job.id))
+            queued = len(self._heap)
+            snapshot = job.to_dict()
+            self._start()
+            self._cond.notify()
+        set_jobs_queued(queued)
+        self._persist(snapshot)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задания или None, если его нет или результат истёк"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and not self._expired(job):
+                return job.to_dict()
+        return self.disk.get(job_id) if self.disk is not None else None
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Ждёт завершения задания не дольше timeout секунд и возвращает его состояние"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+            return self.get(job_id)
+
+        # Задание принял другой процесс: его состояние доступно только через базу
+        deadline = time.monotonic() + timeout
+        state = self.get(job_id)
+        while state is not None and state["status"] not in FINISHED and time.monotonic() < deadline:
+            time.sleep(min(0.25, max(deadline - time.monotonic(), 0)))
+            state = self.get(job_id)
+        return state
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Отменяет задание, ещё не взятое в работу
+
+        Returns:
+            dict: Состояние задания (статус не меняется, если оно уже выполняется
+                или завершено) или None, если задания нет в этом процессе
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                self._heap = [entry for entry in self._heap if entry[2] != job_id]
+                heapq.heapify(self._heap)
+                self._finish(job, CANCELLED, 499, {"error": "Задание отменено"})
+            queued = len(self._heap)
+            snapshot = job.to_dict()
+        set_jobs_queued(queued)
+        if snapshot["status"] == CANCELLED:
+            observe_job(CANCELLED)
+            self._persist(snapshot, job.finished + self.result_ttl)
+        return snapshot
+
+    @staticmethod
+    def _provider(job: Job) -> str:
+        model = job.payload.get('model')
+        return model if isinstance(model, str) else ''
+
+    def _pop_runnable(self) -> Optional[Job]:
+        """
+        Снимает с очереди задание с наибольшим приоритетом, у провайдера
+        которого есть место (вызывается под блокировкой)
+        """
+        if self.slots is None:
+            return self._jobs[heapq.heappop(self._heap)[2]] if self._heap else None
+        for entry in sorted(self._heap):
+            job = self._jobs[entry[2]]
+            if self.slots.try_acquire(self._provider(job)):
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                return job
+        return None
+
+    def _take(self) -> Job:
+        """Ждёт задание с наибольшим приоритетом и отмечает его выполняемым"""
+        with self._cond:
+            job = self._pop_runnable()
+            while job is None:
+                # Места у провайдеров освобождают и пакеты, поэтому ожидание периодически прерывается
+                self._cond.wait(POLL_INTERVAL if self._heap else None)
+                job = self._pop_runnable()
+            queued = len(self._heap)
+            job.status = RUNNING
+            job.started = time.time()
+            self._running += 1
+            snapshot = job.to_dict()
+        set_jobs_queued(queued)
+        self._persist(snapshot)
+        return job
+
+    def _work(self):
+        while True:
+            self._execute(self._take())
+
+    def _dispatch(self):
+        """Передаёт задания в AsyncEngine, пока выполняется меньше workers"""
+        engine = get_async_engine()
+        while True:
+            self._slots.acquire()
+            job = self._take()
+            set_request_id(job.request_id)
+            future = engine.submit(self._aexecute(job))
+            set_request_id(None)
+            future.add_done_callback(lambda _: self._slots.release())
+
+    def _execute(self, job: Job):
+        set_request_id(job.request_id)
+        observe_job_wait(job.started - job.created)
+        provider = self._provider(job)
+        try:
+            with track_job_running():
+                status_code, body = self.runner(job.payload)
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задания {job.id}: {str(e)}", exc_info=True)
+            status_code, body = 500, {"error": "Внутренняя ошибка сервера"}
+        finally:
+            if self.slots is not None:
+                self.slots.release(provider)
+        self._complete(job, status_code, body)
+        set_request_id(None)
+
+    async def _aexecute(self, job: Job):
+        """Асинхронный аналог _execute"""
+        observe_job_wait(job.started - job.created)
+        provider = self._provider(job)
+        try:
+            with track_job_running():
+                status_code, body = await self.runner(job.payload)
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задания {job.id}: {str(e)}", exc_info=True)
+            status_code, body = 500, {"error": "Внутренняя ошибка сервера"}
+        finally:
+            if self.slots is not None:
+                self.slots.release(provider)
+        # Запись состояния в SQLite не должна задерживать event loop
+        await asyncio.to_thread(self._complete, job, status_code, body)
+
+    def _complete(self, job: Job, status_code: int, body: Dict[str, Any]):
+        """Сохраняет результат задания и отправляет webhook"""
+        model = self._provider(job)
+        with self._cond:
+            self._running -= 1
+            self._finish(job, SUCCEEDED if status_code == 200 else FAILED, status_code, body)
+            snapshot = job.to_dict()
+        observe_job(snapshot["status"])
+        logger.info(f"Задание {job.id} ({model}) завершено: {snapshot['status']}, {status_code}")
+        self._persist(snapshot, job.finished + self.result_ttl)
+        if job.webhook:
+            self.webhooks.send(job.webhook, snapshot)
+
+    def _finish(self, job: Job, status: str, status_code: int, body: Dict[str, Any]):
+        job.status = status
+        job.status_code = status_code
+        job.body = body
+        job.finished = time.time()
+        job.payload = {"model": job.payload.get('model')}
+        self._counters[status] += 1
+        job.done.set()
+
+    def _expired(self, job: Job) -> bool:
+        return job.finished is not None and time.time() - job.finished > self.result_ttl
+
+    def _expire(self):
+        """Удаляет истёкшие результаты (вызывается под блокировкой)"""
+        expired = [job_id for job_id, job in self._jobs.items() if self._expired(job)]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self._counters["expired"] += len(expired)
+        if expired and self.disk is not None:
+            self.disk.purge()
+
+    def _persist(self, snapshot: Dict[str, Any], expires_at: Optional[float] = None):
+        if self.disk is not None:
+            try:
+                self.disk.put(snapshot, expires_at)
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить состояние задания {snapshot['id']}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            result = dict(self._counters)
+            result.update({
+                "queued": len(self._heap),
+                "running": self._running,
+                "stored": len(self._jobs),
+                "workers": self.workers,
+                "max_queue": self.max_queue
+            })
+        result["webhooks"] = self.webhooks.stats()
+        return result
+
+
+job_queue = None
+_queue_lock = threading.Lock()
+
+def init_job_queue(runner: JobRunner, asynchronous: bool = False):
+    """Инициализирует глобальную очередь заданий из переменных окружения"""
+    global job_queue
+    db_path = os.environ.get('JOBS_DB', '')
+    allowed_hosts = [host.strip() for host in os.environ.get('JOBS_WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()]
+    job_queue = JobQueue(
+        runner,
+        workers=int(os.environ.get('JOBS_WORKERS', 8)),
+        max_queue=int(os.environ.get('JOBS_MAX_QUEUE', 1000)),
+        result_ttl=float(os.environ.get('JOBS_RESULT_TTL', 3600)),
+        webhooks=WebhookSender(
+            timeout=float(os.environ.get('JOBS_WEBHOOK_TIMEOUT', 10)),
+            secret=os.environ.get('JOBS_WEBHOOK_SECRET', ''),
+            allowed_hosts=allowed_hosts
+        ),
+        disk=SQLiteJobStore(db_path) if db_path else None,
+        asynchronous=asynchronous,
+        slots=get_provider_slots()
+    )
+    return job_queue
+
+def get_job_queue(runner: JobRunner, asynchronous: bool = False):
+    """Возвращает глобальную очередь заданий, создавая её с исполнителем runner"""
+    global job_queue
+    if job_queue is None:
+        with _queue_lock:
+            if job_queue is None:
+                init_job_queue(runner, asynchronous)
+    return job_queue
+
+def get_job_queue_stats() -> Optional[Dict[str, Any]]:
+    """Статистика очереди, если она создана"""
+    return job_queue.stats() if job_queue is not None else None
+
+def _reset_after_fork():
+    """
+    Потоки очереди не переживают fork: дочерний процесс создаёт свою
+    очередь при первом задании
+    """
+    global job_queue, _queue_lock
+    job_queue = None
+    _queue_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,355 @@
+import math
+import os
+import re
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from .exceptions import RateLimitExceeded, UpstreamError
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger('neiro.keys')
+
+# Как часто проверять, не изменился ли файл с ключами
+RELOAD_INTERVAL = float(os.environ.get('API_KEYS_RELOAD_INTERVAL', 5))
+
+SELECTION_STRATEGIES = ("least_in_flight", "quota")
+AUTH_STATUSES = (401, 403)
+
+
+class ApiKey:
+    """Ключ API из пула провайдера: вес, собственные лимиты и счётчики"""
+
+    def __init__(
+        self,
+        value: str,
+        name: Optional[str] = None,
+        weight: float = 1.0,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0
+    ):
+        self.value = value
+        self.name = name or mask_key(value)
+        self.weight = weight
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.in_flight = 0
+        self.benched_until = 0.0
+        self.counters = {"requests": 0, "errors": 0, "rate_limited": 0, "unauthorized": 0, "tokens": 0}
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """Сколько секунд ждать, пока собственные лимиты ключа пропустят запрос"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(min(tokens, self.tokens.capacity), now))
+        return wait
+
+    def remaining_quota(self, now: float) -> float:
+        """Доля оставшегося лимита ключа (1.0 - лимит не задан или не тронут)"""
+        shares = [1.0]
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket._refill(now)
+                shares.append(max(bucket.tokens, 0.0) / bucket.capacity)
+        return min(shares)
+
+    def take(self, tokens: int):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(min(tokens, self.tokens.capacity))
+
+    def inherit(self, previous: 'ApiKey'):
+        """Переносит состояние ключа, оставшегося в пуле после перечитывания"""
+        self.in_flight = previous.in_flight
+        self.benched_until = previous.benched_until
+        self.counters = previous.counters
+        for name in ("requests", "tokens"):
+            bucket, old = getattr(self, name), getattr(previous, name)
+            if bucket is not None and old is not None:
+                bucket.tokens = min(old.tokens, bucket.capacity)
+                bucket.updated = old.updated
+
+
+class KeyLease:
+    """Ключ, выданный одному запросу"""
+
+    __slots__ = ('key', 'wait', 'estimated')
+
+    def __init__(self, key: ApiKey, wait: float, estimated: int):
+        self.key = key
+        self.wait = wait
+        self.estimated = estimated
+
+    @property
+    def value(self) -> str:
+        return self.key.value
+
+
+def mask_key(value: str) -> str:
+    """Имя ключа для статистики и логов: сам ключ не показывается"""
+    if len(value) <= 8:
+        return "***"
+    return f"{value[:3]}...{value[-4:]}"
+
+
+def parse_keys(spec: str, share: float = 1.0) -> List[ApiKey]:
+    """
+    Разбирает описание пула ключей. Ключи разделяются запятыми или переводами
+    строк, параметры ключа - точкой с запятой; строки с # - комментарии:
+
+        sk-first;weight=2;rpm=60;tpm=90000, sk-second;name=reserve
+
+    Raises:
+        ValueError: Если параметр ключа не распознан
+    """
+    keys = []
+    seen = set()
+    for entry in re.split(r'[,\n]', spec):
+        entry = entry.split('#', 1)[0].strip()
+        if not entry:
+            continue
+        value, *options = [part.strip() for part in entry.split(';')]
+        params: Dict[str, str] = {}
+        for option in options:
+            name, sep, raw = option.partition('=')
+            if not sep or name not in ("name", "weight", "rpm", "tpm"):
+                raise ValueError(f"Неизвестный параметр ключа API: '{option}'")
+            params[name] = raw.strip()
+        if not value or value in seen:
+            continue
+        seen.add(value)
+        keys.append(ApiKey(
+            value,
+            name=params.get("name"),
+            weight=max(float(params.get("weight", 1)), 0.01),
+            requests_per_minute=float(params.get("rpm", 0)) * share,
+            tokens_per_minute=float(params.get("tpm", 0)) * share
+        ))
+    return keys
+
+
+class KeyPool:
+    """
+    Пул ключей API одного провайдера. Каждому запросу выдаётся ключ
+    с наименьшим числом запросов в работе на единицу веса (least_in_flight)
+    или с наибольшим остатком собственных лимитов (quota). Ключ, получивший
+    429, 401 или 403, временно отстраняется. Пул из файла перечитывается
+    при его изменении без перезапуска
+    """
+
+    def __init__(self, provider: str, config: Any, share: float = 1.0):
+        self.provider = provider
+        self.config = config
+        self.share = share
+        self.strategy = getattr(config, 'key_selection', 'least_in_flight')
+        if self.strategy not in SELECTION_STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия выбора ключа API: {self.strategy}")
+        self._lock = threading.Lock()
+        self._keys: List[ApiKey] = []
+        self._file_mtime: Optional[float] = None
+        self._checked = 0.0
+        self._load(self._read_spec())
+
+    @property
+    def size(self) -> int:
+        return len(self._keys)
+
+    @property
+    def configured(self) -> bool:
+        self._maybe_reload()
+        return bool(self._keys)
+
+    def _read_spec(self) -> str:
+        path = getattr(self.config, 'api_keys_file', '')
+        if path:
+            try:
+                self._file_mtime = os.stat(path).st_mtime
+                with open(path, 'r', encoding='utf-8') as f:
+                    return f.read()
+            except OSError as e:
+                logger.error(f"Не удалось прочитать ключи {self.provider} из {path}: {str(e)}")
+                self._file_mtime = None
+        return getattr(self.config, 'api_keys', '') or self.config.api_key or ''
+
+    def _load(self, spec: str):
+        try:
+            keys = parse_keys(spec, self.share)
+        except ValueError as e:
+            logger.error(f"Пул ключей {self.provider} не изменён: {str(e)}")
+            return
+        with self._lock:
+            previous = {key.value: key for key in self._keys}
+            for key in keys:
+                if key.value in previous:
+                    key.inherit(previous[key.value])
+            self._keys = keys
+        logger.info(f"Пул ключей {self.provider}: {len(keys)}",
+                    extra={"model": self.provider, "keys": len(keys)})
+
+    def reload(self):
+        """Перечитывает пул ключей; состояние оставшихся ключей сохраняется"""
+        self._load(self._read_spec())
+
+    def _maybe_reload(self):
+        path = getattr(self.config, 'api_keys_file', '')
+        now = time.monotonic()
+        if not path or now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._file_mtime:
+            self.reload()
+
+    def _score(self, key: ApiKey, now: float):
+        # При равной загрузке запросы распределяются пропорционально весам
+        load = key.in_flight / key.weight
+        used = key.counters["requests"] / key.weight
+        if self.strategy == "quota":
+            return (-key.remaining_quota(now), load, used)
+        return (load, -key.remaining_quota(now), used)
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> KeyLease:
+        """
+        Выбирает ключ для запроса и резервирует место в его лимитах
+
+        Returns:
+            KeyLease: Ключ и время, которое нужно подождать до отправки
+
+        Raises:
+            RateLimitExceeded: Если все ключи отстранены или их лимиты
+                не освободятся за допустимое время ожидания
+        """
+        max_wait = self.config.rate_limit_max_wait
+        if timeout is not None:
+            max_wait = min(max_wait, timeout)
+        self._maybe_reload()
+        with self._lock:
+            now = time.monotonic()
+            active = [key for key in self._keys if key.benched_until <= now]
+            if not active:
+                retry_after = min((key.benched_until - now for key in self._keys), default=1.0)
+                raise RateLimitExceeded(
+                    f"Все ключи API {self.provider} временно отстранены",
+                    retry_after=max(math.ceil(retry_after), 1)
+                )
+
+            waits = {id(key): key.wait_time(tokens, now) for key in active}
+            ready = [key for key in active if waits[id(key)] == 0]
+            if ready:
+                key = min(ready, key=lambda k: self._score(k, now))
+            else:
+                key = min(active, key=lambda k: waits[id(k)])
+            wait = waits[id(key)]
+            if wait > max_wait:
+                raise RateLimitExceeded(
+                    f"Превышены лимиты ключей API {self.provider}",
+                    retry_after=max(math.ceil(wait), 1)
+                )
+
+            key.take(tokens)
+            key.in_flight += 1
+            key.counters["requests"] += 1
+            return KeyLease(key, wait, tokens)
+
+    def release(self, lease: KeyLease, error: Optional[UpstreamError] = None, tokens: Optional[int] = None):
+        """
+        Возвращает ключ после запроса. После 429 ключ отстраняется на Retry-After,
+        после 401 и 403 - на config.key_auth_bench_seconds. Единственный ключ
+        не отстраняется: паузу после 429 выдерживает ограничитель провайдера
+        """
+        key = lease.key
+        with self._lock:
+            key.in_flight = max(key.in_flight - 1, 0)
+            if tokens is not None:
+                key.counters["tokens"] += tokens
+                if key.tokens is not None:
+                    key.tokens.take(tokens - min(lease.estimated, key.tokens.capacity))
+            if error is None:
+                return
+
+            status = error.upstream_status
+            if isinstance(error, RateLimitExceeded) and status == 429:
+                key.counters["rate_limited"] += 1
+                bench = error.retry_after or self.config.key_bench_seconds
+            elif status in AUTH_STATUSES:
+                key.counters["unauthorized"] += 1
+                bench = self.config.key_auth_bench_seconds
+            else:
+                key.counters["errors"] += 1
+                return
+            if len(self._keys) > 1:
+                key.benched_until = max(key.benched_until, time.monotonic() + bench)
+                logger.warning(f"Ключ {key.name} провайдера {self.provider} отстранён на {bench:.0f} с "
+                               f"(ответ {status})", extra={"model": self.provider, "key": key.name})
+
+    def next_available(self) -> float:
+        """Через сколько секунд появится неотстранённый ключ"""
+        with self._lock:
+            now = time.monotonic()
+            return max(min((key.benched_until - now for key in self._keys), default=0.0), 0.0)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            result = []
+            for key in self._keys:
+                item = dict(key.counters)
+                item.update(
+                    key=key.name,
+                    weight=key.weight,
+                    in_flight=key.in_flight,
+                    benched_for=round(max(key.benched_until - now, 0.0), 1),
+                    quota=round(key.remaining_quota(now), 3)
+                )
+                result.append(item)
+            return result
+
+
+class KeyPoolRegistry:
+    """Пулы ключей API по провайдерам"""
+
+    def __init__(self):
+        self._pools: Dict[str, KeyPool] = {}
+        self._lock = threading.Lock()
+        self._share = 1.0
+
+    def set_share(self, share: float):
+        """Доля лимитов ключей, доступная этому процессу (как у ограничителей запросов)"""
+        with self._lock:
+            self._share = share
+            self._pools.clear()
+
+    def get(self, provider: str, config: Any) -> KeyPool:
+        pool = self._pools.get(provider)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(provider)
+                if pool is None:
+                    pool = KeyPool(provider, config, self._share)
+                    self._pools[provider] = pool
+        return pool
+
+    def reload(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.reload()
+
+    def stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        with self._lock:
+            pools = dict(self._pools)
+        return {provider: pool.stats() for provider, pool in pools.items()}
+
+
+key_pools = KeyPoolRegistry()
+
+def get_key_pool(provider: str, config: Any) -> KeyPool:
+    """Возвращает пул ключей API провайдера"""
+    return key_pools.get(provider, config)
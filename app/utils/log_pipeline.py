@@ -0,0 +1,243 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Iterable, List, Optional
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar('request_id', default=None)
+
+# Стандартные атрибуты LogRecord; всё остальное из extra попадает в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id() -> Optional[str]:
+    """Возвращает идентификатор текущего запроса"""
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]):
+    """Задаёт идентификатор запроса для записей лога текущего потока"""
+    _request_id.set(request_id)
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи идентификатор запроса. Работает в потоке, создавшем запись"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю sample_rate записей уровня ниже WARNING от логгера prefix.
+    Решение принимается по идентификатору запроса, поэтому трасса запроса
+    сохраняется либо целиком, либо не сохраняется вовсе
+    """
+
+    def __init__(self, prefix: str, sample_rate: float):
+        super().__init__()
+        self.prefix = prefix
+        self.threshold = int(max(min(sample_rate, 1.0), 0.0) * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.threshold >= 0xFFFFFFFF:
+            return True
+        if record.name != self.prefix and not record.name.startswith(self.prefix + '.'):
+            return True
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            return zlib.crc32(request_id.encode('utf-8')) <= self.threshold
+        return random.random() * 0xFFFFFFFF <= self.threshold
+
+
+class LoggerNameFilter(logging.Filter):
+    """Пропускает записи указанных логгеров (и их потомков), кроме исключённых"""
+
+    def __init__(self, include: Iterable[str], exclude: Iterable[str] = ()):
+        super().__init__()
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+
+    @staticmethod
+    def _matches(name: str, prefixes) -> bool:
+        return any(name == prefix or name.startswith(prefix + '.') for prefix in prefixes)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self._matches(record.name, self.include) and not self._matches(record.name, self.exclude)
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись как одну строку JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладёт записи в ограниченную очередь, не форматируя их. Если очередь
+    переполнена, запись отбрасывается и учитывается в счётчике
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы подставляются сразу: объекты могут измениться, пока запись в очереди.
+        # Форматирование и трассировка исключения выполняются в фоновом потоке
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Асинхронный конвейер логирования: потоки запросов только кладут записи
+    в очередь, форматирование и запись на диск выполняет фоновый поток
+    """
+
+    def __init__(self, handlers: List[logging.Handler], queue_size: int = 10000, filters: Iterable[logging.Filter] = ()):
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        for log_filter in filters:
+            self.handler.addFilter(log_filter)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def after_fork(self, tag: str):
+        """
+        Перезапускает конвейер в дочернем процессе: фоновый поток родителя
+        не переживает fork, а его очередь могла остаться заблокированной.
+        Файлы логов получают суффикс tag, чтобы процессы не ротировали один файл
+        """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.handler.dropped = 0
+        self.handler._lock = threading.Lock()
+        handlers = self.listener.handlers
+        for handler in handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+                base, ext = os.path.splitext(handler.baseFilename)
+                handler.baseFilename = f"{base}.{tag}{ext}"
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+        self.start()
+
+    def stop(self):
+        """Дожидается записи накопленных сообщений и останавливает фоновый поток"""
+        if self._started:
+            self._started = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "dropped": self.handler.dropped
+        }
+
+
+log_pipeline = None
+
+
+def _file_handler(path: str, max_bytes: int, backup_count: int, level: int, log_filter: logging.Filter) -> logging.Handler:
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+    handler.setFormatter(JsonFormatter())
+    handler.setLevel(level)
+    handler.addFilter(log_filter)
+    return handler
+
+
+def init_log_pipeline(app_logger_name: str, log_dir: Optional[str] = 'logs') -> LogPipeline:
+    """
+    Переводит логирование на асинхронный конвейер. Обработчики, уже
+    установленные на корневом логгере (например, консоль), переносятся
+    в фоновый поток. Файлы логов пишутся в формате JSON Lines:
+    logs/neuro_flask.log - логи приложения, logs/message_trace.log - трассировка
+    сервисов (neiro.services) с выборкой LOG_TRACE_SAMPLE_RATE
+    """
+    global log_pipeline
+    if log_pipeline is not None:
+        return log_pipeline
+
+    max_bytes = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    sample_rate = float(os.environ.get('LOG_TRACE_SAMPLE_RATE', 1.0))
+    queue_size = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        handlers.append(_file_handler(
+            os.path.join(log_dir, 'neuro_flask.log'), max_bytes, backup_count, logging.INFO,
+            LoggerNameFilter([app_logger_name, 'neiro'], exclude=['neiro.services'])
+        ))
+        handlers.append(_file_handler(
+            os.path.join(log_dir, 'message_trace.log'), max_bytes, backup_count, logging.DEBUG,
+            LoggerNameFilter(['neiro.services'])
+        ))
+
+    pipeline = LogPipeline(
+        handlers,
+        queue_size=queue_size,
+        filters=[RequestIdFilter(), SamplingFilter('neiro.services', sample_rate)]
+    )
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(pipeline.handler)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+
+    log_pipeline = pipeline
+    return pipeline
+
+
+def get_log_pipeline() -> Optional[LogPipeline]:
+    """Возвращает конвейер логирования, если он запущен"""
+    return log_pipeline
@@ -0,0 +1,179 @@
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Метрики хранятся в процессе; если задана PROMETHEUS_MULTIPROC_DIR, prometheus_client
+# пишет их в mmap-файлы этой директории, и /metrics суммирует значения всех воркеров
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+OVERHEAD_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+LABELS = ('model', 'prompt_template')
+
+REQUESTS = Counter(
+    'neiro_requests_total', 'Обработанные запросы к нейросетям', LABELS + ('status',)
+)
+ERRORS = Counter(
+    'neiro_request_errors_total', 'Запросы, завершившиеся ошибкой, по виду ошибки', LABELS + ('kind',)
+)
+REQUEST_DURATION = Histogram(
+    'neiro_request_duration_seconds', 'Полное время обработки запроса', LABELS, buckets=LATENCY_BUCKETS
+)
+UPSTREAM_DURATION = Histogram(
+    'neiro_upstream_duration_seconds',
+    'Время ожидания провайдера, включая лимиты и повторы',
+    LABELS,
+    buckets=LATENCY_BUCKETS
+)
+OVERHEAD_DURATION = Histogram(
+    'neiro_server_overhead_seconds',
+    'Время обработки запроса на сервере без ожидания провайдера',
+    LABELS,
+    buckets=OVERHEAD_BUCKETS
+)
+UPSTREAM_TOKENS = Counter(
+    'neiro_upstream_tokens_total', 'Токены по полю usage ответа провайдера', LABELS + ('kind',)
+)
+IN_FLIGHT = Gauge(
+    'neiro_requests_in_flight', 'Запросы в обработке', ('model',), multiprocess_mode='livesum'
+)
+JOBS_QUEUED = Gauge(
+    'neiro_jobs_queued', 'Задания, ожидающие в очереди', multiprocess_mode='livesum'
+)
+JOBS_RUNNING = Gauge(
+    'neiro_jobs_running', 'Задания в работе', multiprocess_mode='livesum'
+)
+JOBS = Counter(
+    'neiro_jobs_total', 'Завершённые задания по итогу', ('status',)
+)
+JOB_WAIT = Histogram(
+    'neiro_job_wait_seconds', 'Время ожидания задания в очереди', buckets=LATENCY_BUCKETS
+)
+ADMISSION = Counter(
+    'neiro_admission_total', 'Решения контроля допуска по классам приоритета', ('priority_class', 'outcome')
+)
+ADMISSION_WAIT = Histogram(
+    'neiro_admission_wait_seconds',
+    'Время ожидания места обработки',
+    ('priority_class',),
+    buckets=OVERHEAD_BUCKETS + (2.5, 5.0, 10.0, 30.0)
+)
+
+ERROR_KINDS = {
+    400: "bad_request",
+    429: "rate_limited",
+    500: "internal",
+    502: "upstream",
+    503: "unavailable",
+    504: "timeout",
+}
+
+UNKNOWN = "unknown"
+NO_TEMPLATE = "none"
+
+
+def request_labels(data: Any, known_models, has_template: Callable[[str, str], bool]) -> Tuple[str, str]:
+    """
+    Метки запроса. Неизвестные модели и шаблоны сводятся к одному значению,
+    чтобы произвольный ввод клиента не плодил временные ряды.
+    has_template(model, template) проверяет, что шаблон существует
+    """
+    if not isinstance(data, dict):
+        return UNKNOWN, NO_TEMPLATE
+    model = data.get('model')
+    if not isinstance(model, str) or model not in known_models:
+        model = UNKNOWN
+    template = data.get('prompt_template')
+    if not template:
+        template = NO_TEMPLATE
+    elif not isinstance(template, str) or model == UNKNOWN or not has_template(model, template):
+        template = UNKNOWN
+    return model, template
+
+
+def observe_request(
+    model: str,
+    prompt_template: str,
+    status: int,
+    duration: float,
+    upstream_time: float = 0.0,
+    usage: Optional[Dict[str, Any]] = None
+):
+    """Учитывает завершённый запрос"""
+    labels = (model, prompt_template)
+    REQUESTS.labels(*labels, str(status)).inc()
+    if status >= 400:
+        ERRORS.labels(*labels, ERROR_KINDS.get(status, str(status))).inc()
+
+    upstream_time = min(upstream_time, duration)
+    REQUEST_DURATION.labels(*labels).observe(duration)
+    OVERHEAD_DURATION.labels(*labels).observe(duration - upstream_time)
+    if upstream_time > 0:
+        UPSTREAM_DURATION.labels(*labels).observe(upstream_time)
+
+    if isinstance(usage, dict):
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            value = usage.get(kind)
+            if isinstance(value, int) and value > 0:
+                UPSTREAM_TOKENS.labels(*labels, kind.replace('_tokens', '')).inc(value)
+
+
+def track_in_flight(model: str):
+    """Контекстный менеджер, учитывающий запрос в обработке"""
+    return IN_FLIGHT.labels(model).track_inprogress()
+
+
+def set_jobs_queued(count: int):
+    JOBS_QUEUED.set(count)
+
+
+def observe_job_wait(seconds: float):
+    JOB_WAIT.observe(seconds)
+
+
+def observe_job(status: str):
+    JOBS.labels(status).inc()
+
+
+def track_job_running():
+    """Контекстный менеджер, учитывающий задание в работе"""
+    return JOBS_RUNNING.track_inprogress()
+
+
+def observe_admission(priority_class: str, outcome: str, wait: Optional[float] = None):
+    """Учитывает решение о допуске запроса; wait - время в очереди"""
+    ADMISSION.labels(priority_class, outcome).inc()
+    if wait is not None:
+        ADMISSION_WAIT.labels(priority_class).observe(wait)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Возвращает метрики в формате Prometheus
+
+    Returns:
+        tuple: (тело ответа, Content-Type)
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Удаляет данные живых метрик завершившегося воркера"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
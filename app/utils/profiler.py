@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger('neiro.profiler')
+
+MAX_DEPTH = 128
+
+
+class RequestProfile:
+    """Стеки, снятые с потока одного запроса"""
+
+    __slots__ = ('thread_id', 'sampled', 'stacks', 'samples')
+
+    def __init__(self, thread_id: int, sampled: bool):
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+
+    def add(self, frame: Any):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик запросов. Фоновый поток раз в interval секунд
+    снимает стеки потоков, обрабатывающих отслеживаемые запросы. Профиль
+    сохраняется, если запрос попал в выборку 1 из sample_every или
+    выполнялся дольше slow_ms; в каталоге хранятся последние keep профилей.
+    Стеки записываются в свёрнутом виде (folded), пригодном для flamegraph
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_every: int = 0,
+        slow_ms: float = 0.0,
+        interval: float = 0.005,
+        keep: int = 50
+    ):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active: Dict[int, RequestProfile] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+        self._counters = {"profiled": 0, "saved": 0, "write_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_every > 0 or self.slow_ms > 0
+
+    def begin(self) -> Optional[RequestProfile]:
+        """
+        Начинает отслеживать запрос текущего потока
+
+        Returns:
+            RequestProfile: Профиль запроса или None, если запрос не отслеживается
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._seq += 1
+            sampled = self.sample_every > 0 and self._seq % self.sample_every == 0
+            if not sampled and self.slow_ms <= 0:
+                return None
+            profile = RequestProfile(threading.get_ident(), sampled)
+            self._active[profile.thread_id] = profile
+            self._counters["profiled"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+        return profile
+
+    def end(self, profile: RequestProfile, duration: float, meta: Dict[str, Any]) -> Optional[str]:
+        """
+        Завершает отслеживание и сохраняет профиль, если запрос попал
+        в выборку или оказался медленным
+
+        Returns:
+            str: Путь к файлу профиля или None
+        """
+        with self._lock:
+            if self._active.get(profile.thread_id) is profile:
+                del self._active[profile.thread_id]
+        slow = self.slow_ms > 0 and duration * 1000 >= self.slow_ms
+        if not (profile.sampled or slow):
+            return None
+        return self._write(profile, duration, dict(meta, reason="slow" if slow else "sampled"))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.add(frame)
+            del frames
+
+    def _write(self, profile: RequestProfile, duration: float, meta: Dict[str, Any]) -> Optional[str]:
+        """Записывает профиль и удаляет самые старые сверх keep"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{seq}.json"
+        path = os.path.join(self.directory, name)
+        entry = dict(
+            meta,
+            duration_ms=round(duration * 1000, 2),
+            interval_ms=round(self.interval * 1000, 2),
+            samples=profile.samples,
+            stacks=dict(sorted(profile.stacks.items(), key=lambda item: -item[1]))
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._prune()
+        except OSError as e:
+            with self._lock:
+                self._counters["write_errors"] += 1
+            logger.warning(f"Не удалось сохранить профиль запроса: {str(e)}")
+            return None
+        with self._lock:
+            self._counters["saved"] += 1
+        logger.info(f"Профиль запроса сохранён: {path} ({meta.get('reason')}, {entry['duration_ms']} мс)",
+                    extra={"profile": path})
+        return path
+
+    def _prune(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(files) <= self.keep:
+            return
+        files.sort(key=lambda file: os.stat(file).st_mtime)
+        for file in files[:len(files) - self.keep]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass  # файл уже удалил другой процесс
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._counters)
+            result["active"] = len(self._active)
+        result.update({
+            "enabled": self.enabled,
+            "sample_every": self.sample_every,
+            "slow_ms": self.slow_ms
+        })
+        return result
+
+
+profiler = None
+_profiler_lock = threading.Lock()
+
+def init_profiler() -> SamplingProfiler:
+    """Инициализирует профилировщик из переменных окружения (по умолчанию выключен)"""
+    global profiler
+    profiler = SamplingProfiler(
+        os.environ.get('PROFILE_DIR', os.path.join('logs', 'profiles')),
+        sample_every=int(os.environ.get('PROFILE_SAMPLE_EVERY', 0)),
+        slow_ms=float(os.environ.get('PROFILE_SLOW_MS', 0)),
+        interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+        keep=int(os.environ.get('PROFILE_KEEP', 50))
+    )
+    return profiler
+
+def get_profiler() -> SamplingProfiler:
+    """Возвращает глобальный профилировщик"""
+    global profiler
+    if profiler is None:
+        with _profiler_lock:
+            if profiler is None:
+                init_profiler()
+    return profiler
+
+def _reset_after_fork():
+    """Поток профилировщика не переживает fork: дочерний процесс создаёт свой"""
+    global profiler
+    profiler = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
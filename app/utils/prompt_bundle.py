@@ -0,0 +1,205 @@
+"""
+Собранный пакет промптов: все шаблоны директории prompts/ в одном файле
+с индексом по (модель, шаблон). Пакет проверяется при сборке, отображается
+в память (mmap) и разбирается по мере обращения к моделям; процессы,
+открывшие один файл, разделяют его страницы. Новый пакет подменяет прежний
+атомарной заменой файла, работающие процессы подхватывают его сами.
+
+    python -m app.utils.prompt_bundle build --prompts prompts --output prompts.bundle
+    python -m app.utils.prompt_bundle check prompts.bundle
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import yaml
+
+from .fast_json import loads
+from .prompt_template import TemplateError, compile_prompt
+from .yaml_loader import PROMPT_EXTENSIONS, _YamlLoader
+
+MAGIC = b'NPBUNDLE'
+FORMAT_VERSION = 1
+# Заголовок: сигнатура, версия формата, длина индекса
+_HEADER = struct.Struct('<8sII')
+
+
+class PromptBundleError(ValueError):
+    """Пакет промптов повреждён, не той версии или не прошёл проверку при сборке"""
+
+
+class BundleEntry(NamedTuple):
+    """Шаблон в пакете: смещение и длина его JSON от начала данных"""
+    model_name: str
+    prompt_name: str
+    path: str
+    offset: int
+    length: int
+    digest: str
+
+
+class PromptBundle:
+    """Открытый пакет промптов. Шаблоны разбираются только по запросу"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < _HEADER.size:
+                raise PromptBundleError(f"Файл {path} не является пакетом промптов")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.entries, self.created = self._read_index(stat.st_size)
+        except PromptBundleError:
+            self._map.close()
+            raise
+        self.models: Set[str] = {entry.model_name for entry in self.entries}
+
+    def _read_index(self, size: int) -> Tuple[List[BundleEntry], float]:
+        magic, version, index_length = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise PromptBundleError(f"Файл {self.path} не является пакетом промптов")
+        if version != FORMAT_VERSION:
+            raise PromptBundleError(f"Версия пакета промптов {version} не поддерживается (нужна {FORMAT_VERSION})")
+        self._data_offset = _HEADER.size + index_length
+        if self._data_offset > size:
+            raise PromptBundleError(f"Пакет промптов {self.path} обрезан")
+        try:
+            index = json.loads(self._map[_HEADER.size:self._data_offset].decode('utf-8'))
+            entries = [BundleEntry(*item) for item in index["entries"]]
+        except (ValueError, KeyError, TypeError) as e:
+            raise PromptBundleError(f"Повреждён индекс пакета промптов {self.path}: {str(e)}") from e
+        data_size = size - self._data_offset
+        for entry in entries:
+            if entry.offset < 0 or entry.offset + entry.length > data_size:
+                raise PromptBundleError(f"Пакет промптов {self.path} обрезан: {entry.model_name}/{entry.prompt_name}")
+        return entries, index.get("created", 0.0)
+
+    def load(self, entry: BundleEntry):
+        """
+        Разбирает шаблон из пакета
+
+        Raises:
+            PromptBundleError: Если данные шаблона повреждены
+        """
+        start = self._data_offset + entry.offset
+        try:
+            return loads(self._map[start:start + entry.length])
+        except ValueError as e:
+            raise PromptBundleError(f"Повреждён шаблон {entry.model_name}/{entry.prompt_name} в пакете: {str(e)}") from e
+
+
+def build_bundle(prompts_dir: str, output: str) -> Dict[str, int]:
+    """
+    Собирает пакет из директории промптов и атомарно заменяет им output.
+    Каждый шаблон разбирается и компилируется; при любой ошибке пакет
+    не записывается
+
+    Returns:
+        dict: Число шаблонов и моделей, размер пакета в байтах
+
+    Raises:
+        PromptBundleError: Со списком всех ошибок в шаблонах
+    """
+    entries: List[list] = []
+    chunks: List[bytes] = []
+    errors: List[str] = []
+    offset = 0
+    for model_name in sorted(os.listdir(prompts_dir)):
+        model_dir = os.path.join(prompts_dir, model_name)
+        if not os.path.isdir(model_dir):
+            continue
+        for file_name in sorted(os.listdir(model_dir)):
+            file_path = os.path.join(model_dir, file_name)
+            if not file_name.endswith(PROMPT_EXTENSIONS) or not os.path.isfile(file_path):
+                continue
+            prompt_name = os.path.splitext(file_name)[0]
+            try:
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+                data = yaml.load(content.decode('utf-8'), Loader=_YamlLoader)
+                compile_prompt(data, f"{model_name}/{prompt_name}")
+                # Стандартный json строже orjson: значения, которые не переживут разбор из JSON, отклоняются
+                encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            except (TemplateError, yaml.YAMLError, UnicodeDecodeError, TypeError, ValueError, OSError) as e:
+                errors.append(f"{file_path}: {str(e)}")
+                continue
+            digest = hashlib.sha256(content).hexdigest()
+            entries.append([model_name, prompt_name, os.path.join(model_name, file_name), offset, len(encoded), digest])
+            chunks.append(encoded)
+            offset += len(encoded)
+    if errors:
+        raise PromptBundleError("Ошибки в шаблонах промптов:\n" + "\n".join(errors))
+
+    index = json.dumps({"created": time.time(), "entries": entries}, ensure_ascii=False).encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(index)))
+            f.write(index)
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        # Процессы, открывшие прежний файл, дочитывают его, новые открывают уже этот
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {
+        "templates": len(entries),
+        "models": len({entry[0] for entry in entries}),
+        "bytes": _HEADER.size + len(index) + offset
+    }
+
+
+def check_bundle(path: str) -> Dict[str, int]:
+    """
+    Открывает пакет и разбирает все шаблоны
+
+    Raises:
+        PromptBundleError: Если пакет или шаблон повреждён
+    """
+    bundle = PromptBundle(path)
+    for entry in bundle.entries:
+        compile_prompt(bundle.load(entry), f"{entry.model_name}/{entry.prompt_name}")
+    return {"templates": len(bundle.entries), "models": len(bundle.models), "bytes": bundle.signature[2]}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сборка и проверка пакета промптов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Собрать пакет из директории промптов")
+    build.add_argument('--prompts', default='prompts', help="Директория промптов")
+    build.add_argument('--output', default='prompts.bundle', help="Файл пакета (заменяется атомарно)")
+    check = commands.add_parser('check', help="Проверить пакет")
+    check.add_argument('bundle')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        if args.command == 'build':
+            result = build_bundle(args.prompts, args.output)
+            target = args.output
+        else:
+            result = check_bundle(args.bundle)
+            target = args.bundle
+    except (PromptBundleError, TemplateError, OSError) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{target}: {result['templates']} шаблонов, {result['models']} моделей, {result['bytes']} байт "
+          f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import re
+from string import Formatter
+from typing import Any, Dict, FrozenSet, Optional, Set
+
+_formatter = Formatter()
+_FIELD_ROOT = re.compile(r'^[^.\[]*')
+
+
+class TemplateError(ValueError):
+    """Ошибка в шаблоне промпта или в переданных для него переменных"""
+
+
+def _collect_fields(text: str, fields: Set[str]) -> bool:
+    """
+    Разбирает строку формата и добавляет в fields имена переменных
+
+    Returns:
+        bool: True, если в строке есть подстановки
+
+    Raises:
+        TemplateError: Если строка формата некорректна
+    """
+    has_fields = False
+    try:
+        parsed = list(_formatter.parse(text))
+    except ValueError as e:
+        raise TemplateError(f"Некорректная строка шаблона {text!r}: {str(e)}") from e
+
+    for _, field_name, format_spec, _ in parsed:
+        if field_name is None:
+            continue
+        root = _FIELD_ROOT.match(field_name).group(0)
+        if not root or root.isdigit():
+            raise TemplateError(f"Позиционная подстановка в строке шаблона {text!r}, используйте имена переменных")
+        fields.add(root)
+        has_fields = True
+        if format_spec:
+            _collect_fields(format_spec, fields)
+    return has_fields
+
+
+class CompiledPrompt:
+    """
+    Скомпилированный шаблон промпта.
+
+    При компиляции неизменяемые части шаблона собираются один раз,
+    а строки с подстановками запоминаются как слоты. При рендеринге
+    копируются только контейнеры на пути к слотам, остальное разделяется
+    между запросами, поэтому результат нельзя изменять глубже первого уровня
+    """
+
+    def __init__(self, template: Any):
+        fields: Set[str] = set()
+        self.skeleton, self._plan = self._compile(template, fields)
+        self.variables: FrozenSet[str] = frozenset(fields)
+
+    def _compile(self, node: Any, fields: Set[str]):
+        """Возвращает (статическая часть узла, план подстановок или None)"""
+        if isinstance(node, str):
+            if _collect_fields(node, fields):
+                return node, node
+            return node.format(), None
+
+        if isinstance(node, dict):
+            skeleton, plan = {}, {}
+            for key, value in node.items():
+                skeleton[key], child_plan = self._compile(value, fields)
+                if child_plan is not None:
+                    plan[key] = child_plan
+            return skeleton, (plan or None)
+
+        if isinstance(node, (list, tuple)):
+            skeleton, plan = [], {}
+            for index, item in enumerate(node):
+                static, child_plan = self._compile(item, fields)
+                skeleton.append(static)
+                if child_plan is not None:
+                    plan[index] = child_plan
+            return skeleton, (plan or None)
+
+        return node, None
+
+    def render(self, **kwargs: Any) -> Any:
+        """
+        Подставляет переменные в шаблон
+
+        Raises:
+            TemplateError: Если не переданы переменные, используемые в шаблоне
+        """
+        missing = self.variables.difference(kwargs)
+        if missing:
+            raise TemplateError(f"Не переданы переменные шаблона: {', '.join(sorted(missing))}")
+
+        if self._plan is None:
+            return self._shallow_copy(self.skeleton)
+        return self._render(self.skeleton, self._plan, kwargs)
+
+    def _render(self, skeleton: Any, plan: Any, values: Dict[str, Any]) -> Any:
+        if isinstance(plan, str):
+            return plan.format_map(values)
+
+        result = self._shallow_copy(skeleton)
+        for key, child_plan in plan.items():
+            result[key] = self._render(skeleton[key], child_plan, values)
+        return result
+
+    @staticmethod
+    def _shallow_copy(node: Any) -> Any:
+        if isinstance(node, dict):
+            return dict(node)
+        if isinstance(node, list):
+            return list(node)
+        return node
+
+
+def compile_prompt(template: Any, name: Optional[str] = None) -> CompiledPrompt:
+    """
+    Компилирует шаблон промпта
+
+    Raises:
+        TemplateError: Если шаблон содержит некорректные подстановки
+    """
+    try:
+        return CompiledPrompt(template)
+    except TemplateError as e:
+        if name:
+            raise TemplateError(f"{name}: {str(e)}") from e
+        raise
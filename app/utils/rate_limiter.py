@@ -0,0 +1,215 @@
+import asyncio
+import math
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from .exceptions import RateLimitExceeded
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Корзина токенов с поминутным лимитом. Остаток может уходить в минус:
+    так резервируются места в очереди, и запросы пропускаются по порядку
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, чтобы в корзине хватило amount токенов"""
+        self._refill(now)
+        deficit = amount - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class ProviderRateLimiter:
+    """
+    Ограничитель запросов к провайдеру: лимиты запросов и токенов в минуту
+    с ограниченной очередью ожидания. Если место в лимите не освободится
+    за допустимое время ожидания, запрос сразу отклоняется
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_queue: int = 100,
+        max_wait: float = 10.0
+    ):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._paused_until = 0.0
+        self._counters = {"admitted": 0, "queued": 0, "rejected": 0, "upstream_429": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _is_idle(self) -> bool:
+        """Лимиты не заданы и провайдер не просил подождать"""
+        return not self.enabled and self._paused_until <= time.monotonic()
+
+    def _reserve(self, tokens: int, timeout: Optional[float]) -> float:
+        """
+        Резервирует место в лимитах
+
+        Returns:
+            float: Сколько секунд нужно подождать до отправки запроса
+
+        Raises:
+            RateLimitExceeded: Если ждать пришлось бы дольше допустимого
+        """
+        max_wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, 0.0)
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1, now))
+            if self.tokens is not None:
+                tokens = min(tokens, self.tokens.capacity)
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+
+            if wait > max_wait or (wait > 0 and self._waiting >= self.max_queue):
+                self._counters["rejected"] += 1
+                raise RateLimitExceeded(
+                    "Превышен лимит запросов к провайдеру",
+                    retry_after=max(math.ceil(wait), 1)
+                )
+
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            self._counters["admitted"] += 1
+            if wait > 0:
+                self._waiting += 1
+                self._counters["queued"] += 1
+            return wait
+
+    def _leave_queue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None):
+        """Ждёт места в лимитах перед отправкой запроса"""
+        if self._is_idle():
+            return
+        wait = self._reserve(tokens, timeout)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_queue()
+
+    async def aacquire(self, tokens: int, timeout: Optional[float] = None):
+        """Асинхронный аналог acquire"""
+        if self._is_idle():
+            return
+        wait = self._reserve(tokens, timeout)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_queue()
+
+    def reconcile(self, estimated: int, actual: Optional[int]):
+        """Корректирует лимит токенов по фактическому расходу из поля usage ответа"""
+        if self.tokens is None or actual is None:
+            return
+        with self._lock:
+            # Резерв был урезан до ёмкости (_reserve): возвращается только то, что взято
+            self.tokens.take(actual - min(estimated, self.tokens.capacity))
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу после ответа 429 от провайдера"""
+        with self._lock:
+            self._counters["upstream_429"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            result = dict(self._counters)
+            result["waiting"] = self._waiting
+            if self.requests is not None:
+                self.requests._refill(now)
+                result["requests_available"] = round(self.requests.tokens, 2)
+            if self.tokens is not None:
+                self.tokens._refill(now)
+                result["tokens_available"] = round(self.tokens.tokens, 2)
+        return result
+
+
+class RateLimiterRegistry:
+    """Ограничители запросов по провайдерам"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderRateLimiter] = {}
+        self._lock = threading.Lock()
+        self._share = 1.0
+
+    def set_share(self, share: float):
+        """
+        Задаёт долю лимитов провайдеров, доступную этому процессу. Когда
+        запросы обслуживают несколько процессов, лимит делится между ними
+        """
+        with self._lock:
+            self._share = share
+            self._limiters.clear()
+
+    def get(self, provider: str, config: Any) -> ProviderRateLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(provider)
+                if limiter is None:
+                    limiter = ProviderRateLimiter(
+                        config.requests_per_minute * self._share,
+                        config.tokens_per_minute * self._share,
+                        config.rate_limit_queue_size,
+                        config.rate_limit_max_wait
+                    )
+                    self._limiters[provider] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {provider: limiter.stats() for provider, limiter in limiters.items()}
+
+
+rate_limiters = RateLimiterRegistry()
+
+def get_rate_limiter(provider: str, config: Any) -> ProviderRateLimiter:
+    """Возвращает ограничитель запросов провайдера"""
+    return rate_limiters.get(provider, config)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class MemoryCache:
+    """LRU-кэш в памяти процесса с ограничением размера и временем жизни записей"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    Дисковый кэш в SQLite. Переживает перезапуск и разделяется
+    между процессами-воркерами через общий файл базы
+    """
+
+    def __init__(self, path: str, ttl: float = 3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self.evictions = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._connect().execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl)
+        )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов нейросетей: LRU в памяти и, опционально, SQLite.
+
+    Ключ - хэш канонического JSON полностью сформированного запроса к API.
+    По умолчанию кэшируются только запросы с temperature == 0
+    """
+
+    def __init__(self, memory: MemoryCache, disk: Optional[SQLiteCache] = None, enabled: bool = True):
+        self.memory = memory
+        self.disk = disk
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "bypass": 0}
+
+    @staticmethod
+    def make_key(provider: str, endpoint: str, payload: Dict[str, Any]) -> str:
+        """Строит ключ кэша из канонического представления запроса"""
+        canonical = json.dumps(
+            [provider, endpoint, payload],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def should_cache(self, payload: Dict[str, Any], opt_in: Optional[bool] = None) -> bool:
+        """
+        Решает, можно ли использовать кэш для запроса
+
+        Args:
+            payload: Тело запроса к API
+            opt_in: Явный выбор клиента (True/False) или None для правила по умолчанию
+        """
+        if not self.enabled or opt_in is False:
+            return False
+        if opt_in:
+            return True
+        try:
+            return float(payload.get("temperature", 1)) == 0
+        except (TypeError, ValueError):
+            return False
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+    def count_bypass(self):
+        self._count("bypass")
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("hits", "disk_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает счётчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            result = dict(self._counters)
+        result.update({
+            "enabled": self.enabled,
+            "entries": len(self.memory),
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0
+        })
+        return result
+
+
+response_cache = None
+_cache_lock = threading.Lock()
+
+def init_response_cache():
+    """Инициализирует глобальный кэш ответов из переменных окружения"""
+    global response_cache
+    ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    db_path = os.environ.get('RESPONSE_CACHE_DB', '')
+    response_cache = ResponseCache(
+        MemoryCache(int(os.environ.get('RESPONSE_CACHE_SIZE', 1024)), ttl),
+        SQLiteCache(db_path, ttl) if db_path else None,
+        enabled=os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+    )
+    return response_cache
+
+def get_response_cache():
+    """Возвращает глобальный кэш ответов"""
+    global response_cache
+    if response_cache is None:
+        with _cache_lock:
+            if response_cache is None:
+                init_response_cache()
+    return response_cache
+
+def _reset_after_fork():
+    """Соединения SQLite нельзя использовать после fork, дочерний процесс открывает свои"""
+    if response_cache is not None and response_cache.disk is not None:
+        response_cache.disk._local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
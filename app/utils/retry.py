@@ -0,0 +1,87 @@
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from .exceptions import UpstreamError
+
+# Сколько раз повторять запрос при каждой причине сбоя
+DEFAULT_RETRY_RULES = {
+    "connection": 2,  # обрыв или отказ соединения
+    "timeout": 1,
+    "429": 3,
+    "500": 1,
+    "502": 2,
+    "503": 2,
+    "504": 1,
+}
+
+
+def retry_reason(error: UpstreamError) -> Optional[str]:
+    """
+    Определяет причину сбоя запроса к провайдеру
+
+    Returns:
+        str: connection, timeout или HTTP-код ответа провайдера;
+            None для ошибок, возникших до отправки (лимиты, предохранитель)
+    """
+    if error.upstream_status is not None:
+        return str(error.upstream_status)
+    if error.status_code == 502:
+        return "connection"
+    if error.status_code == 504:
+        return "timeout"
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """Правила повтора запросов к провайдеру"""
+    rules: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_RETRY_RULES))
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    max_retry_after: float = 30.0  # если провайдер просит ждать дольше, запрос не повторяется
+
+    def max_retries(self) -> int:
+        return max(self.rules.values(), default=0)
+
+    def delay(self, error: UpstreamError, retries: Dict[str, int]) -> Optional[float]:
+        """
+        Возвращает паузу перед повтором или None, если повторять не нужно.
+        Пауза - экспоненциальная с полным джиттером, но не меньше Retry-After
+
+        Args:
+            error: Ошибка очередной попытки
+            retries: Сколько раз запрос уже повторялся по каждой причине
+        """
+        reason = retry_reason(error)
+        if reason is None or retries.get(reason, 0) >= self.rules.get(reason, 0):
+            return None
+
+        attempt = sum(retries.values())
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if error.retry_after is not None:
+            if error.retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, error.retry_after)
+        return delay
+
+
+class RetryStats:
+    """Счётчики повторов по провайдерам и причинам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def record(self, provider: str, event: str):
+        with self._lock:
+            counters = self._counters.setdefault(provider, {})
+            counters[event] = counters.get(event, 0) + 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {provider: dict(counters) for provider, counters in self._counters.items()}
+
+
+retry_stats = RetryStats()
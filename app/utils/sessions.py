@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Session:
+    """
+    Сессия диалога: модель, шаблон и история сообщений. Объект неизменяем,
+    каждое обновление создаёт новую версию, поэтому запрос может читать
+    историю без блокировок, пока другой запрос её дополняет
+    """
+    id: str
+    model: str
+    prompt_template: Optional[str] = None
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    messages: Tuple[Dict[str, str], ...] = ()
+    created: float = 0.0
+    updated: float = 0.0
+    version: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = asdict(self)
+        result["messages"] = list(self.messages)
+        return result
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Session':
+        return cls(**dict(data, messages=tuple(data.get("messages") or ())))
+
+
+class SQLiteSessionStore:
+    """
+    Хранилище сессий в SQLite. Хранит сессии, вытесненные из памяти, и позволяет
+    процессам-воркерам видеть сессии друг друга через общий файл базы
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Session]:
+        row = self._connect().execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return Session.from_dict(json.loads(row[0])) if row is not None else None
+
+    def version(self, session_id: str) -> Optional[int]:
+        row = self._connect().execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def update(self, session: Session, expected_version: int) -> bool:
+        """
+        Записывает новую версию сессии, только если в базе всё ещё expected_version
+
+        Returns:
+            bool: False, если сессию успел обновить или удалить другой процесс
+        """
+        return self._connect().execute(
+            "UPDATE sessions SET data = ?, version = ?, updated = ? WHERE id = ? AND version = ?",
+            (json.dumps(session.to_dict(), ensure_ascii=False), session.version, session.updated,
+             session.id, expected_version)
+        ).rowcount > 0
+
+    def put(self, session: Session):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (id, data, version, updated) VALUES (?, ?, ?, ?)",
+            (session.id, json.dumps(session.to_dict(), ensure_ascii=False), session.version, session.updated)
+        )
+
+    def delete(self, session_id: str) -> bool:
+        return self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def purge(self, updated_before: float) -> int:
+        """Удаляет сессии, не обновлявшиеся с updated_before"""
+        return self._connect().execute("DELETE FROM sessions WHERE updated < ?", (updated_before,)).rowcount
+
+
+class SessionStore:
+    """
+    Сессии диалогов: LRU в памяти процесса с ограничением числа сессий
+    и, опционально, SQLite. Без SQLite вытесненная из памяти сессия теряется.
+    Дописывание истории в процессе выполняется по очереди, между процессами -
+    условной записью по версии, поэтому одновременные обмены не теряются
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        ttl: float = 86400,
+        max_messages: int = 200,
+        disk: Optional[SQLiteSessionStore] = None
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.disk = disk
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._counters = {"created": 0, "evicted": 0, "expired": 0, "disk_loads": 0, "conflicts": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, session: Session):
+        with self._lock:
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters["evicted"] += 1
+
+    def _forget(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def create(self, model: str, prompt_template: Optional[str] = None, parameters: Optional[Dict[str, Any]] = None) -> Session:
+        """Создаёт новую сессию"""
+        now = time.time()
+        session = Session(uuid.uuid4().hex, model, prompt_template, dict(parameters or {}), (), now, now, 1)
+        self._remember(session)
+        if self.disk is not None:
+            self.disk.put(session)
+        with self._lock:
+            self._counters["created"] += 1
+            purge = self._counters["created"] % 100 == 0
+        if purge and self.disk is not None:
+            self.disk.purge(now - self.ttl)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Возвращает актуальную версию сессии или None, если её нет или она истекла"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+
+        if self.disk is not None:
+            # Сессию мог обновить другой процесс
+            if session is None or self.disk.version(session_id) != session.version:
+                session = self.disk.get(session_id)
+                if session is None:
+                    self._forget(session_id)
+                    return None
+                self._count("disk_loads")
+                self._remember(session)
+
+        if session is not None and time.time() - session.updated > self.ttl:
+            self.delete(session_id)
+            self._count("expired")
+            return None
+        return session
+
+    def append(self, session_id: str, messages: Iterable[Dict[str, str]]) -> Optional[Session]:
+        """
+        Дописывает сообщения в историю сессии. Хранится не больше max_messages
+        последних сообщений
+
+        Returns:
+            Session: Новая версия сессии или None, если сессии нет
+        """
+        messages = tuple(messages)
+        # Чтение и запись новой версии - одна операция: иначе два одновременных обмена
+        # построили бы одну и ту же версию и один из них потерялся бы
+        with self._append_lock:
+            while True:
+                with self._lock:
+                    session = self._sessions.get(session_id)
+                if session is None or self.disk is not None:
+                    session = self.get(session_id)
+                if session is None:
+                    return None
+
+                history = session.messages + messages
+                if self.max_messages and len(history) > self.max_messages:
+                    history = history[-self.max_messages:]
+                updated = replace(session, messages=history, updated=time.time(), version=session.version + 1)
+                # Другой процесс мог дописать сессию после чтения: тогда история перечитывается
+                if self.disk is None or self.disk.update(updated, session.version):
+                    self._remember(updated)
+                    return updated
+                self._count("conflicts")
+
+    def delete(self, session_id: str) -> bool:
+        """Удаляет сессию, возвращает True, если она существовала"""
+        deleted = self._forget(session_id)
+        if self.disk is not None:
+            deleted = self.disk.delete(session_id) or deleted
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._counters)
+            result["active"] = len(self._sessions)
+        result.update({
+            "max_sessions": self.max_sessions,
+            "disk": self.disk is not None
+        })
+        return result
+
+
+session_store = None
+_store_lock = threading.Lock()
+
+def init_session_store():
+    """Инициализирует глобальное хранилище сессий из переменных окружения"""
+    global session_store
+    db_path = os.environ.get('SESSIONS_DB', '')
+    session_store = SessionStore(
+        max_sessions=int(os.environ.get('SESSIONS_MAX', 10000)),
+        ttl=float(os.environ.get('SESSIONS_TTL', 86400)),
+        max_messages=int(os.environ.get('SESSIONS_MAX_MESSAGES', 200)),
+        disk=SQLiteSessionStore(db_path) if db_path else None
+    )
+    return session_store
+
+def get_session_store():
+    """Возвращает глобальное хранилище сессий"""
+    global session_store
+    if session_store is None:
+        with _store_lock:
+            if session_store is None:
+                init_session_store()
+    return session_store
+
+def _reset_after_fork():
+    """Соединения SQLite нельзя использовать после fork, дочерний процесс открывает свои"""
+    if session_store is not None and session_store.disk is not None:
+        session_store.disk._local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .exceptions import RequestCancelled, UpstreamError
+
+
+class _Call:
+    """Выполняющийся запрос, результата которого ждут одинаковые запросы"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+def _leader_only(error: BaseException) -> bool:
+    """
+    Ошибка относится к самому ведущему запросу, а не к ответу провайдера:
+    его отменили или у него истёк дедлайн. Ожидающие её не наследуют
+    """
+    if isinstance(error, (RequestCancelled, TimeoutError, asyncio.CancelledError)):
+        return True
+    return isinstance(error, UpstreamError) and error.status_code == 504
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов: пока запрос с данным
+    ключом выполняется, повторные запросы ждут его результата, а не
+    отправляют свой. Если ведущий запрос отменён или не уложился в свой
+    дедлайн, ожидающий запрос выполняется сам (становится ведущим)
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "collapsed": 0, "timeouts": 0, "retried": 0}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет fn или дожидается результата уже выполняющегося вызова с тем же ключом
+
+        Args:
+            key: Ключ запроса (хэш тела запроса к API)
+            fn: Функция, выполняющая запрос
+            timeout: Сколько ждать чужой результат, в секундах
+
+        Raises:
+            TimeoutError: Если результат не получен за timeout
+        """
+        if not self.enabled:
+            return fn()
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                    self._counters["leaders"] += 1
+                else:
+                    self._counters["collapsed"] += 1
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        self._calls.pop(key, None)
+                    call.event.set()
+
+            remaining = max(deadline - time.monotonic(), 0.0) if deadline is not None else None
+            if not call.event.wait(remaining):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise TimeoutError("Истекло время ожидания ответа на такой же запрос")
+            if call.error is None:
+                return call.result
+            if not _leader_only(call.error):
+                raise call.error
+            with self._lock:
+                self._counters["retried"] += 1
+
+    async def ado(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None
+    ) -> Any:
+        """Асинхронный аналог do, вызывается только из event loop AsyncEngine"""
+        if not self.enabled:
+            return await fn()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            future = self._async_calls.get(key)
+            if future is None:
+                break
+            with self._lock:
+                self._counters["collapsed"] += 1
+            remaining = max(deadline - loop.time(), 0.0) if deadline is not None else None
+            # asyncio.wait не отменяет future ведущего по таймауту ожидающего
+            await asyncio.wait({future}, timeout=remaining)
+            if not future.done():
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise TimeoutError("Истекло время ожидания ответа на такой же запрос")
+            if not future.cancelled():
+                error = future.exception()
+                if error is None:
+                    return future.result()
+                if not _leader_only(error):
+                    raise error
+            with self._lock:
+                self._counters["retried"] += 1
+
+        future = loop.create_future()
+        self._async_calls[key] = future
+        with self._lock:
+            self._counters["leaders"] += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # помечаем исключение как полученное, если ожидающих нет
+            raise
+        finally:
+            self._async_calls.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счётчики объединённых запросов"""
+        with self._lock:
+            result = dict(self._counters)
+            result["in_flight"] = len(self._calls) + len(self._async_calls)
+        result["enabled"] = self.enabled
+        return result
+
+
+single_flight = SingleFlight(os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1')
+
+def get_single_flight():
+    """Возвращает глобальный объединитель запросов"""
+    return single_flight
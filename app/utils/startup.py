@@ -0,0 +1,61 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger('neiro.startup')
+
+
+class StartupReport:
+    """Длительность фаз запуска приложения, от импорта пакета до регистрации маршрутов"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.total: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Замеряет фазу запуска"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self) -> float:
+        """Фиксирует общее время запуска в секундах"""
+        self.total = time.perf_counter() - self.started
+        return self.total
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.total * 1000, 1) if self.total is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+        }
+
+    def log(self, target_ms: float = 0):
+        """Пишет отчёт в лог; при превышении target_ms - предупреждение"""
+        total_ms = (self.total if self.total is not None else self.finish()) * 1000
+        phases = ", ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in self.phases.items())
+        message = f"Запуск за {total_ms:.1f} мс ({phases})"
+        if target_ms and total_ms > target_ms:
+            logger.warning(f"{message}, превышена цель {target_ms:.0f} мс", extra={"startup": self.as_dict()})
+        else:
+            logger.info(message, extra={"startup": self.as_dict()})
+
+
+startup_report = None
+
+
+def get_startup_report() -> Optional[StartupReport]:
+    """Возвращает отчёт о последнем запуске приложения"""
+    return startup_report
+
+
+def set_startup_report(report: StartupReport):
+    global startup_report
+    startup_report = report
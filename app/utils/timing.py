@@ -0,0 +1,84 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+_timer: contextvars.ContextVar = contextvars.ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    """
+    Длительности этапов обработки одного запроса. Одноимённые этапы
+    (например, повторы запроса к провайдеру) суммируются
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._spans: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self._spans[name] = self._spans.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, float]:
+        """Длительности этапов в миллисекундах"""
+        with self._lock:
+            return {name: round(seconds * 1000, 2) for name, seconds in self._spans.items()}
+
+    def header(self, total: Optional[float] = None) -> str:
+        """Значение заголовка Server-Timing"""
+        parts = [f"{name};dur={ms}" for name, ms in self.as_dict().items()]
+        if total is not None:
+            parts.append(f"total;dur={round(total * 1000, 2)}")
+        return ", ".join(parts)
+
+
+def start_request_timer() -> RequestTimer:
+    """Начинает замер этапов запроса в текущем контексте"""
+    timer = RequestTimer()
+    _timer.set(timer)
+    return timer
+
+
+def get_request_timer() -> Optional[RequestTimer]:
+    return _timer.get()
+
+
+def clear_request_timer():
+    _timer.set(None)
+
+
+def detached_context() -> contextvars.Context:
+    """
+    Копия текущего контекста без замера этапов. Части запроса, выполняемые
+    параллельно (элементы пакета), иначе суммировали бы свои этапы в один замер
+    """
+    context = contextvars.copy_context()
+    context.run(clear_request_timer)
+    return context
+
+
+def record_span(name: str, seconds: float):
+    """Добавляет длительность этапа к замеру текущего запроса, если он ведётся"""
+    timer = _timer.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Замеряет этап запроса. Вне запроса ничего не делает"""
+    timer = _timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
@@ -0,0 +1,54 @@
+import json
+from typing import Any, Dict, List, Sequence
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_text_tokens(text: Any) -> int:
+    """Грубая оценка числа токенов в тексте (около 4 символов на токен)"""
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """Оценка числа токенов одного сообщения чата с учётом служебной разметки"""
+    return estimate_text_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_request_tokens(payload: Dict[str, Any]) -> int:
+    """
+    Оценивает число токенов, которое запрос израсходует из лимита провайдера:
+    токены сообщений плюс запрошенный максимум токенов ответа
+    """
+    messages = payload.get("messages")
+    if isinstance(messages, list):
+        prompt_tokens = sum(estimate_message_tokens(m) for m in messages if isinstance(m, dict))
+    else:
+        prompt_tokens = estimate_text_tokens(payload)
+
+    try:
+        completion_tokens = int(payload.get("max_tokens") or 0)
+    except (TypeError, ValueError):
+        completion_tokens = 0
+    return prompt_tokens + completion_tokens
+
+
+def trim_history(messages: Sequence[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """
+    Оставляет последние сообщения истории, которые укладываются в budget токенов.
+    История не начинается с ответа модели, оставшегося без вопроса
+    """
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        used += estimate_message_tokens(message)
+        if used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    start = 0
+    while start < len(kept) and kept[start].get("role") == "assistant":
+        start += 1
+    return kept[start:]
@@ -1,94 +1,443 @@
+import hashlib
+import logging
 import os
+import threading
+import time
+from functools import partial
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set
+
 import yaml
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from .prompt_template import CompiledPrompt, TemplateError, compile_prompt
+
+logger = logging.getLogger('neiro.prompts')
+
+PROMPT_EXTENSIONS = ('.yaml', '.yml')
+
+# Разбор на C (libyaml) в разы быстрее, если PyYAML собран с ним
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Как часто проверять, не заменён ли файл пакета промптов
+BUNDLE_CHECK_INTERVAL = float(os.environ.get('PROMPTS_BUNDLE_CHECK_INTERVAL', 2))
+
+
+class PromptFile(NamedTuple):
+    """Загруженный файл промпта"""
+    model_name: str
+    prompt_name: str
+    mtime: float
+    size: int
+    digest: str
+    data: Any
+    compiled: CompiledPrompt
+
+
+class PromptSnapshot:
+    """
+    Неизменяемый снимок реестра промптов. Новый снимок собирается отдельно
+    и подменяет текущий одним присваиванием, поэтому запросы никогда
+    не видят частично загруженный реестр. Содержимое снимка изменять нельзя
+    """
+
+    def __init__(self, version: int, files: Dict[str, PromptFile]):
+        self.version = version
+        self.files = files
+        self.prompts: Dict[str, Dict[str, Any]] = {}
+        self.compiled: Dict[str, Dict[str, CompiledPrompt]] = {}
+        self._fingerprints: Dict[Optional[str], str] = {}
+        for entry in files.values():
+            self.prompts.setdefault(entry.model_name, {})[entry.prompt_name] = entry.data
+            self.compiled.setdefault(entry.model_name, {})[entry.prompt_name] = entry.compiled
+
+    def count(self) -> int:
+        return len(self.files)
+
+    def fingerprint(self, model_name: Optional[str] = None) -> str:
+        """
+        Хэш содержимого снимка (или шаблонов одной модели). В отличие
+        от версии не зависит от порядка перезагрузок и совпадает у всех
+        процессов с одинаковыми файлами
+        """
+        result = self._fingerprints.get(model_name)
+        if result is None:
+            digest = hashlib.blake2b(digest_size=12)
+            for path in sorted(self.files):
+                entry = self.files[path]
+                if model_name is None or entry.model_name == model_name:
+                    digest.update(f"{path}\0{entry.digest}\0".encode('utf-8'))
+            result = self._fingerprints[model_name] = digest.hexdigest()
+        return result
+
 
 class PromptLoader:
-    def __init__(self, prompts_dir='prompts'):
+    """
+    Реестр промптов. С lazy=True шаблоны модели загружаются при первом
+    обращении к ней, с watch=False изменения файлов не отслеживаются
+    (и пакет watchdog не требуется). С bundle_path шаблоны читаются
+    из собранного пакета (app.utils.prompt_bundle) всегда лениво,
+    а замена файла пакета подхватывается без наблюдателя за файлами
+    """
+
+    def __init__(self, prompts_dir='prompts', watch=True, lazy=False, bundle_path=None):
         self.prompts_dir = prompts_dir
-        self.prompts = {}
-        self.last_loaded = {}
-        self.load_all_prompts()
-        self._setup_file_watcher()
-    
+        self.bundle_path = bundle_path
+        self._snapshot = PromptSnapshot(0, {})
+        self._failed = {}
+        self._reload_lock = threading.Lock()
+        self._bundle = None
+        self._bundle_checked = 0.0
+        self._bundle_failed = None
+        if bundle_path:
+            self._bundle = self._open_bundle()
+            lazy, watch = True, False
+        # Модели, шаблоны которых загружены; None - все модели
+        self._models: Optional[Set[str]] = set() if lazy else None
+        self.load_stats = {"files": 0, "parse_ms": 0.0, "compile_ms": 0.0}
+        if not lazy:
+            self.load_all_prompts()
+        if watch:
+            self._setup_file_watcher()
+
+    @property
+    def snapshot(self) -> PromptSnapshot:
+        """Текущий снимок реестра"""
+        return self._snapshot
+
+    @property
+    def prompts(self) -> Dict[str, Dict[str, Any]]:
+        return self._snapshot.prompts
+
+    @property
+    def compiled(self) -> Dict[str, Dict[str, CompiledPrompt]]:
+        return self._snapshot.compiled
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def lazy(self) -> bool:
+        """Загружены ли ещё не все модели"""
+        return self._models is not None
+
+    def ensure_loaded(self, model_name: Optional[str] = None):
+        """
+        Загружает шаблоны модели (или всех моделей, если model_name не задан),
+        если они ещё не загружены
+        """
+        if self._bundle is not None:
+            self._maybe_swap_bundle()
+        models = self._models
+        if models is None or model_name in models:
+            return
+        if model_name is None:
+            with self._reload_lock:
+                self._models = None
+            self.load_all_prompts()
+            return
+        if not self._has_model(model_name):
+            return
+        self._reload([model_name])
+
+    def _has_model(self, model_name: str) -> bool:
+        if self._bundle is not None:
+            return model_name in self._bundle.models
+        return model_name not in ('.', '..') and os.sep not in model_name and os.path.isdir(
+            os.path.join(self.prompts_dir, model_name)
+        )
+
     def load_all_prompts(self):
-        """Загружает все промпты из директорий"""
-        for model_name in os.listdir(self.prompts_dir):
-            model_dir = os.path.join(self.prompts_dir, model_name)
-            if os.path.isdir(model_dir):
-                self.prompts[model_name] = {}
-                for prompt_file in os.listdir(model_dir):
-                    if prompt_file.endswith('.yaml') or prompt_file.endswith('.yml'):
-                        prompt_path = os.path.join(model_dir, prompt_file)
-                        prompt_name = os.path.splitext(prompt_file)[0]
-                        self.load_prompt(model_name, prompt_name, prompt_path)
-    
+        """
+        Загружает промпты из директорий. Повторно разбираются только
+        изменившиеся файлы, удалённые файлы исключаются из реестра.
+        В ленивом режиме перечитываются только уже загруженные модели
+
+        Returns:
+            PromptSnapshot: Актуальный снимок реестра
+        """
+        if self._bundle is not None:
+            self._maybe_swap_bundle(force=True)
+        return self._reload(None)
+
+    def _reload(self, models: Optional[Iterable[str]]):
+        """Перечитывает шаблоны указанных моделей, None - всех загружаемых"""
+        with self._reload_lock:
+            current = self._snapshot
+            if models is None:
+                files = {}
+                scan = self._models
+            else:
+                scan = set(models)
+                if self._models is not None:
+                    self._models |= scan
+                files = {path: entry for path, entry in current.files.items() if entry.model_name not in scan}
+            changed = False
+
+            for model_name, prompt_name, path, load in self._sources(scan):
+                previous = current.files.get(path)
+                entry = load(model_name, prompt_name, path, previous)
+                if entry is None:
+                    continue
+                files[path] = entry
+                changed = changed or entry is not previous
+
+            changed = changed or files.keys() != current.files.keys()
+            if changed:
+                self._snapshot = PromptSnapshot(current.version + 1, files)
+                logger.info(f"Реестр промптов обновлён до версии {self._snapshot.version}: {len(files)} шаблонов")
+            return self._snapshot
+
+    def _sources(self, scan: Optional[Set[str]]):
+        """(модель, шаблон, путь, функция загрузки) для шаблонов моделей из scan, None - всех"""
+        bundle = self._bundle
+        if bundle is not None:
+            for item in bundle.entries:
+                if scan is None or item.model_name in scan:
+                    path = os.path.join(self.prompts_dir, item.path)
+                    yield item.model_name, item.prompt_name, path, partial(self._load_bundle_entry, bundle, item)
+            return
+        for model_entry in self._scandir(self.prompts_dir):
+            if not model_entry.is_dir() or (scan is not None and model_entry.name not in scan):
+                continue
+            for file_entry in self._scandir(model_entry.path):
+                if not file_entry.name.endswith(PROMPT_EXTENSIONS) or not file_entry.is_file():
+                    continue
+                yield model_entry.name, os.path.splitext(file_entry.name)[0], file_entry.path, self._load_file
+
     def load_prompt(self, model_name, prompt_name, file_path):
-        """Загружает отдельный промпт из YAML-файла"""
+        """Загружает отдельный промпт из YAML-файла и публикует новый снимок"""
+        with self._reload_lock:
+            current = self._snapshot
+            previous = current.files.get(file_path)
+            entry = self._load_file(model_name, prompt_name, file_path, previous, force=True)
+            if entry is None:
+                return None
+            if entry is not previous:
+                files = dict(current.files)
+                files[file_path] = entry
+                self._snapshot = PromptSnapshot(current.version + 1, files)
+            return entry.data
+
+    def _load_file(
+        self,
+        model_name: str,
+        prompt_name: str,
+        file_path: str,
+        previous: Optional[PromptFile],
+        force: bool = False
+    ) -> Optional[PromptFile]:
+        """
+        Загружает файл, если он изменился с прошлой загрузки
+
+        Returns:
+            PromptFile: Новая запись, прежняя запись без изменений
+                или None, если файл не удалось загрузить впервые
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                prompt_data = yaml.safe_load(f)
-                self.prompts.setdefault(model_name, {})[prompt_name] = prompt_data
-                self.last_loaded[file_path] = os.path.getmtime(file_path)
-                print(f"Загружен промпт: {model_name}/{prompt_name}")
-                print(prompt_data)
-                return prompt_data
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Не удалось прочитать файл промпта {file_path}: {str(e)}")
+            return previous
+
+        signature = (stat.st_mtime, stat.st_size)
+        if not force:
+            if previous is not None and (previous.mtime, previous.size) == signature:
+                return previous
+            if self._failed.get(file_path) == signature:
+                return previous
+
+        try:
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if previous is not None and previous.digest == digest:
+                return previous._replace(mtime=stat.st_mtime, size=stat.st_size)
+
+            started = time.perf_counter()
+            prompt_data = yaml.load(content.decode('utf-8'), Loader=_YamlLoader)
+            parsed = time.perf_counter()
+            compiled = compile_prompt(prompt_data, f"{model_name}/{prompt_name}")
+            self.load_stats["files"] += 1
+            self.load_stats["parse_ms"] += (parsed - started) * 1000
+            self.load_stats["compile_ms"] += (time.perf_counter() - parsed) * 1000
+            if 'message' not in compiled.variables:
+                logger.warning(f"Шаблон {model_name}/{prompt_name} не использует {{message}}")
+            logger.info(f"Загружен промпт: {model_name}/{prompt_name}")
+            self._failed.pop(file_path, None)
+            return PromptFile(model_name, prompt_name, stat.st_mtime, stat.st_size, digest, prompt_data, compiled)
+
+        except TemplateError as e:
+            logger.error(f"Ошибка в шаблоне промпта {file_path}: {str(e)}")
         except Exception as e:
-            print(f"Ошибка при загрузке промпта {file_path}: {str(e)}")
-            return None
-    
+            logger.error(f"Ошибка при загрузке промпта {file_path}: {str(e)}")
+        self._failed[file_path] = signature
+        return previous
+
+    def _load_bundle_entry(
+        self,
+        bundle: Any,
+        item: Any,
+        model_name: str,
+        prompt_name: str,
+        path: str,
+        previous: Optional[PromptFile]
+    ) -> Optional[PromptFile]:
+        """Разбирает шаблон из пакета; неизменившийся шаблон остаётся прежним"""
+        if previous is not None and previous.digest == item.digest:
+            return previous
+        try:
+            started = time.perf_counter()
+            prompt_data = bundle.load(item)
+            parsed = time.perf_counter()
+            compiled = compile_prompt(prompt_data, f"{model_name}/{prompt_name}")
+        except ValueError as e:
+            logger.error(f"Ошибка при загрузке промпта {model_name}/{prompt_name} из пакета: {str(e)}")
+            return previous
+        self.load_stats["files"] += 1
+        self.load_stats["parse_ms"] += (parsed - started) * 1000
+        self.load_stats["compile_ms"] += (time.perf_counter() - parsed) * 1000
+        return PromptFile(model_name, prompt_name, bundle.created, item.length, item.digest, prompt_data, compiled)
+
+    def _open_bundle(self):
+        """
+        Открывает пакет промптов
+
+        Raises:
+            PromptBundleError: Если пакет повреждён
+            OSError: Если файл не удалось открыть
+        """
+        from .prompt_bundle import PromptBundle
+        bundle = PromptBundle(self.bundle_path)
+        logger.info(f"Пакет промптов {self.bundle_path}: {len(bundle.entries)} шаблонов")
+        return bundle
+
+    def _maybe_swap_bundle(self, force: bool = False):
+        """
+        Переходит на новый пакет, если файл заменён. Повреждённый пакет
+        не принимается, реестр остаётся на прежнем
+        """
+        now = time.monotonic()
+        if not force and now - self._bundle_checked < BUNDLE_CHECK_INTERVAL:
+            return
+        self._bundle_checked = now
+        try:
+            stat = os.stat(self.bundle_path)
+        except OSError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._bundle.signature or signature == self._bundle_failed:
+            return
+        try:
+            bundle = self._open_bundle()
+        except (OSError, ValueError) as e:
+            self._bundle_failed = signature
+            logger.error(f"Новый пакет промптов не принят: {str(e)}")
+            return
+        with self._reload_lock:
+            self._bundle = bundle
+        # Перечитываются только загруженные модели, неизменившиеся шаблоны не разбираются заново
+        self._reload(None)
+
+    @staticmethod
+    def _scandir(path):
+        try:
+            with os.scandir(path) as entries:
+                return list(entries)
+        except OSError as e:
+            logger.error(f"Не удалось прочитать директорию {path}: {str(e)}")
+            return []
+
     def get_prompt(self, model_name, prompt_name):
         """Получает промпт по имени модели и промпта"""
-        if model_name in self.prompts and prompt_name in self.prompts[model_name]:
-            return self.prompts[model_name][prompt_name]
-        return None
-    
+        if self._models is not None or self._bundle is not None:
+            self.ensure_loaded(model_name)
+        return self._snapshot.prompts.get(model_name, {}).get(prompt_name)
+
+    def get_compiled_prompt(self, model_name, prompt_name):
+        """Получает скомпилированный шаблон промпта"""
+        if self._models is not None or self._bundle is not None:
+            self.ensure_loaded(model_name)
+        return self._snapshot.compiled.get(model_name, {}).get(prompt_name)
+
     def _setup_file_watcher(self):
         """Настраивает отслеживание изменений в файлах промптов"""
-        event_handler = PromptFileHandler(self)
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.warning("Пакет watchdog не установлен, изменения файлов промптов не отслеживаются")
+            return
+        self.event_handler = PromptFileHandler(self)
         self.observer = Observer()
-        self.observer.schedule(event_handler, self.prompts_dir, recursive=True)
+        self.observer.schedule(self.event_handler, self.prompts_dir, recursive=True)
         self.observer.start()
-    
+
     def stop_watching(self):
         """Останавливает отслеживание файлов"""
         if hasattr(self, 'observer'):
             self.observer.stop()
             self.observer.join()
+        if hasattr(self, 'event_handler'):
+            self.event_handler.cancel()
 
-class PromptFileHandler(FileSystemEventHandler):
-    def __init__(self, prompt_loader):
+
+class PromptFileHandler:
+    """
+    Перезагружает реестр при изменении файлов промптов. Серия событий
+    от редактора (запись, переименование временного файла и т.п.)
+    объединяется в одну перезагрузку
+    """
+
+    def __init__(self, prompt_loader, debounce=0.3):
         self.prompt_loader = prompt_loader
-        self.loading = False  
-        super().__init__()
-    
-    def on_modified(self, event):
-        if not event.is_directory and (event.src_path.endswith('.yaml') or event.src_path.endswith('.yml')):
-            if self.loading:    
-                return
-            
-            self.loading = True 
-            try:
-                rel_path = os.path.relpath(event.src_path, self.prompt_loader.prompts_dir)
-                parts = os.path.normpath(rel_path).split(os.sep)
-                
-                if len(parts) >= 2:
-                    model_name = parts[0]
-                    prompt_name = os.path.splitext(parts[1])[0]
-                    
-                    current_mtime = os.path.getmtime(event.src_path)
-                    if event.src_path not in self.prompt_loader.last_loaded or current_mtime > self.prompt_loader.last_loaded[event.src_path]:
-                        print(f"Обновление промпта: {model_name}/{prompt_name}")
-                        self.prompt_loader.load_prompt(model_name, prompt_name, event.src_path)
-            finally:
-                self.loading = False  
+        self.debounce = debounce
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def dispatch(self, event):
+        """Точка входа для наблюдателя watchdog"""
+        self.on_any_event(event)
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if event.is_directory or any(path.endswith(PROMPT_EXTENSIONS) for path in paths):
+            self._schedule_reload()
+
+    def _schedule_reload(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._reload)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _reload(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.prompt_loader.load_all_prompts()
+        except Exception as e:
+            logger.error(f"Ошибка при перезагрузке промптов: {str(e)}")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
 
 prompt_loader = None
 
-def init_prompt_loader(prompts_dir='prompts'):
-    """Инициализирует глобальный загрузчик промптов"""
+def init_prompt_loader(prompts_dir='prompts', watch=None, lazy=None, bundle_path=None):
+    """
+    Инициализирует глобальный загрузчик промптов. По умолчанию режимы
+    берутся из PROMPTS_HOT_RELOAD, PROMPTS_LAZY и PROMPTS_BUNDLE
+    """
     global prompt_loader
-    prompt_loader = PromptLoader(prompts_dir)
+    if watch is None:
+        watch = os.environ.get('PROMPTS_HOT_RELOAD', '1') == '1'
+    if lazy is None:
+        lazy = os.environ.get('PROMPTS_LAZY', '0') == '1'
+    if bundle_path is None:
+        bundle_path = os.environ.get('PROMPTS_BUNDLE') or None
+    prompt_loader = PromptLoader(prompts_dir, watch=watch, lazy=lazy, bundle_path=bundle_path)
     return prompt_loader
 
 def get_prompt_loader():
@@ -96,4 +445,4 @@ def get_prompt_loader():
     global prompt_loader
     if prompt_loader is None:
         prompt_loader = init_prompt_loader()
-    return prompt_loader 
\ No newline at end of file
+    return prompt_loader
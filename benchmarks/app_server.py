@@ -0,0 +1,24 @@
+"""
+Запуск приложения для нагрузочного теста на заданном порту.
+
+    python -m benchmarks.app_server --port 5152
+"""
+import argparse
+import logging
+
+from app import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер приложения для бенчмарков")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5152)
+    args = parser.parse_args()
+
+    app = create_app()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
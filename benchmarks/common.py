@@ -0,0 +1,116 @@
+"""Общие функции бенчмарков: перцентили, ресурсы процесса, сохранение результатов"""
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def percentile(sorted_values, q):
+    """Перцентиль уже отсортированного списка (ближайший ранг)"""
+    if not sorted_values:
+        return None
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """Сводка задержек в миллисекундах"""
+    values = sorted(latencies)
+    result = {"count": len(values)}
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        value = percentile(values, q)
+        result[name] = round(value * 1000, 3) if value is not None else None
+    result["mean"] = round(sum(values) / len(values) * 1000, 3) if values else None
+    return result
+
+
+class ProcessSampler:
+    """
+    Снимает CPU и RSS процесса и его потомков из /proc (только Linux).
+    Потомки учитываются, чтобы мерить и многопроцессный режим сервера
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.max_rss = 0
+
+    def _pids(self):
+        pids = [self.pid]
+        index = 0
+        while index < len(pids):
+            try:
+                with open(f"/proc/{pids[index]}/task/{pids[index]}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+            index += 1
+        return pids
+
+    def cpu_seconds(self):
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+        return total / _CLOCK_TICKS
+
+    def rss_bytes(self):
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * _PAGE_SIZE
+            except OSError:
+                continue
+        self.max_rss = max(self.max_rss, total)
+        return total
+
+    @staticmethod
+    def available():
+        return os.path.exists('/proc/self/stat')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(kind, results, params, output=None):
+    """
+    Сохраняет результаты в benchmarks/results/<время>-<вид>.json
+
+    Returns:
+        str: Путь к файлу
+    """
+    document = {
+        "kind": kind,
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{kind}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return output
@@ -0,0 +1,96 @@
+"""
+Сравнивает два файла результатов бенчмарков и отмечает регрессии.
+
+    python -m benchmarks.compare benchmarks/results/old-load.json benchmarks/results/new-load.json
+    python -m benchmarks.compare old-micro.json new-micro.json --threshold 0.05
+
+Код возврата 1, если хотя бы одна метрика ухудшилась сильнее порога.
+"""
+import argparse
+import json
+import sys
+
+# метрика -> True, если больше значит лучше
+LOAD_METRICS = {
+    "rps": True,
+    "latency_ms.p50": False,
+    "latency_ms.p95": False,
+    "latency_ms.p99": False,
+    "server_cpu_ms_per_request": False,
+    "server_rss_mb": False,
+}
+MICRO_METRICS = {"best_us": False}
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def lookup(row, metric):
+    value = row
+    for part in metric.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def rows_by_key(document):
+    """Строки результатов по ключу сравнения"""
+    if document["kind"] == "load":
+        return {f"concurrency={row['concurrency']}": row for row in document["results"]}
+    if document["kind"] == "replay":
+        return {f"speed={row['speed']}": row for row in document["results"]}
+    return dict(document["results"])
+
+
+def compare(old, new, threshold):
+    """
+    Returns:
+        list: Строки (ключ, метрика, было, стало, изменение, регрессия)
+    """
+    if old["kind"] != new["kind"]:
+        raise ValueError(f"Нельзя сравнить результаты разных видов: {old['kind']} и {new['kind']}")
+    metrics = LOAD_METRICS if new["kind"] in ("load", "replay") else MICRO_METRICS
+    old_rows, new_rows = rows_by_key(old), rows_by_key(new)
+
+    report = []
+    for key, new_row in new_rows.items():
+        old_row = old_rows.get(key)
+        if old_row is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            before, after = lookup(old_row, metric), lookup(new_row, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            report.append((key, metric, before, after, change, worse > threshold))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарков")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help="Допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    print(f"было: {old.get('revision')} ({old.get('created')}), стало: {new.get('revision')} ({new.get('created')})")
+    report = compare(old, new, args.threshold)
+
+    regressions = 0
+    for key, metric, before, after, change, regressed in report:
+        mark = "РЕГРЕССИЯ" if regressed else ""
+        regressions += regressed
+        print(f"{key:<45} {metric:<28} {before:>12} {after:>12} {change:>+8.1%} {mark}")
+
+    if regressions:
+        print(f"Регрессий: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
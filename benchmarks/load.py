@@ -0,0 +1,228 @@
+"""
+Нагрузочный тест /api/process с фиксированными уровнями параллельности.
+
+По умолчанию поднимает заменитель провайдера (benchmarks.mock_upstream)
+и сервер приложения, направив на заменитель все провайдеры, и для каждого
+уровня параллельности измеряет req/s, p50/p95/p99 задержки, CPU и RSS сервера.
+
+    python -m benchmarks.load --concurrency 1,8,32 --duration 10
+    python -m benchmarks.load --target http://127.0.0.1:5151 --server-pid 12345
+"""
+import argparse
+import itertools
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from .common import ROOT_DIR, ProcessSampler, save_results, summarize
+
+PROVIDER_PREFIXES = ('OPENAI', 'DEEPSEEK', 'OPENROUTER_DEEPSEEK')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30.0, process=None):
+    """Ждёт, пока сервер начнёт отвечать"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Процесс завершился с кодом {process.returncode}: {url}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"Сервер не ответил за {timeout} с: {url}")
+
+
+def start_mock(args):
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'benchmarks.mock_upstream',
+        '--port', str(port),
+        '--latency', args.latency,
+        '--error-rate', str(args.error_rate),
+        '--errors', args.errors,
+        '--response-tokens', str(args.response_tokens)
+    ]
+    process = subprocess.Popen(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+    wait_for(f"http://127.0.0.1:{port}/stats", process=process)
+    return process, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+def start_server(args, upstream_url):
+    port = free_port()
+    env = dict(os.environ)
+    for prefix in PROVIDER_PREFIXES:
+        env[f"{prefix}_API_URL"] = upstream_url
+        env.setdefault(f"{prefix}_API_KEY", "bench")
+    env.setdefault('RESPONSE_CACHE_ENABLED', '0')
+    for assignment in args.env:
+        name, _, value = assignment.partition('=')
+        env[name] = value
+
+    command = shlex.split(args.server_cmd.format(python=sys.executable, port=port))
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    target = f"http://127.0.0.1:{port}"
+    wait_for(f"{target}/api/models", process=process)
+    return process, target
+
+
+def stop(process):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_level(target, concurrency, duration, payload, stream, unique, sampler=None):
+    """Гоняет запросы из concurrency потоков в течение duration секунд"""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = itertools.count()
+    stop_at = time.monotonic() + duration
+    url = f"{target}/api/process"
+
+    def worker():
+        session = requests.Session()
+        local_latencies, local_statuses = [], {}
+        while time.monotonic() < stop_at:
+            body = dict(payload)
+            if unique:
+                body['message'] = f"{payload['message']} #{next(counter)}"
+            if stream:
+                body['stream'] = True
+            started = time.perf_counter()
+            try:
+                response = session.post(url, json=body, stream=stream, timeout=120)
+                for _ in response.iter_content(chunk_size=None):
+                    pass
+                status = str(response.status_code)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    cpu_before = sampler.cpu_seconds() if sampler else None
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    max_rss = 0
+    while any(thread.is_alive() for thread in threads):
+        if sampler:
+            max_rss = max(max_rss, sampler.rss_bytes())
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+
+    result = {
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 2),
+        "statuses": statuses,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith('2')),
+        "latency_ms": summarize(latencies)
+    }
+    if sampler:
+        cpu = sampler.cpu_seconds() - cpu_before
+        result["server_cpu_percent"] = round(cpu / elapsed * 100, 1)
+        result["server_cpu_ms_per_request"] = round(cpu / len(latencies) * 1000, 3) if latencies else None
+        result["server_rss_mb"] = round(max_rss / 2 ** 20, 1)
+    return result
+
+
+def print_table(results):
+    header = f"{'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'cpu %':>7} {'rss MB':>7}"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        latency = row['latency_ms']
+        print(
+            f"{row['concurrency']:>5} {row['rps']:>9} {latency['p50'] or '-':>9} {latency['p95'] or '-':>9} "
+            f"{latency['p99'] or '-':>9} {row['errors']:>7} {row.get('server_cpu_percent', '-'):>7} "
+            f"{row.get('server_rss_mb', '-'):>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /api/process")
+    parser.add_argument('--concurrency', default='1,8,32', help="Уровни параллельности через запятую")
+    parser.add_argument('--duration', type=float, default=10.0, help="Секунд на каждый уровень")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Прогрев перед замерами, секунд")
+    parser.add_argument('--model', default='deepseek')
+    parser.add_argument('--prompt-template', default=None)
+    parser.add_argument('--message', default='Привет! Расскажи о себе')
+    parser.add_argument('--stream', action='store_true', help="Потоковые (SSE) запросы")
+    parser.add_argument('--same-message', action='store_true',
+                        help="Одинаковые сообщения (проверка кэша и объединения запросов)")
+    parser.add_argument('--target', default=None, help="Адрес уже запущенного сервера")
+    parser.add_argument('--server-pid', type=int, default=None, help="PID сервера для замера CPU и RSS с --target")
+    parser.add_argument('--server-cmd', default='{python} -m benchmarks.app_server --port {port}',
+                        help="Команда запуска сервера, {python} и {port} подставляются")
+    parser.add_argument('--env', action='append', default=[], help="Переменная окружения сервера NAME=VALUE")
+    parser.add_argument('--latency', default='fixed:0.05', help="Задержка заменителя провайдера")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--errors', default='503')
+    parser.add_argument('--response-tokens', type=int, default=50)
+    parser.add_argument('--output', default=None, help="Файл результатов (по умолчанию benchmarks/results/)")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    payload = {"model": args.model, "message": args.message}
+    if args.prompt_template:
+        payload["prompt_template"] = args.prompt_template
+
+    mock = server = None
+    try:
+        if args.target:
+            target, pid = args.target.rstrip('/'), args.server_pid
+        else:
+            mock, upstream_url = start_mock(args)
+            server, target = start_server(args, upstream_url)
+            pid = server.pid
+        sampler = ProcessSampler(pid) if pid and ProcessSampler.available() else None
+
+        if args.warmup > 0:
+            run_level(target, max(levels), args.warmup, payload, args.stream, not args.same_message)
+
+        results = []
+        for level in levels:
+            results.append(run_level(
+                target, level, args.duration, payload, args.stream, not args.same_message, sampler
+            ))
+            print(f"concurrency={level}: {results[-1]['rps']} req/s", file=sys.stderr)
+    finally:
+        stop(server)
+        stop(mock)
+
+    print_table(results)
+    if not args.no_save:
+        params = {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'no_save', 'server_pid')
+        }
+        print(f"Результаты сохранены: {save_results('load', results, params, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Микробенчмарки горячих участков: подготовка промпта, загрузка реестра промптов,
+кодирование и разбор JSON.
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter prompt --repeat 7
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+from app.services.deepseek_service import DeepSeekConfig, DeepSeekService
+from app.utils.fast_json import RawResponse
+from app.utils.prompt_bundle import build_bundle
+from app.utils.prompt_template import compile_prompt
+from app.utils.yaml_loader import PromptLoader, PromptSnapshot, init_prompt_loader
+
+from .common import ROOT_DIR, save_results
+
+MESSAGE = "Привет! Расскажи, как устроен этот сервер и что он умеет. " * 4
+
+
+def sample_completion(tokens=400):
+    """Ответ провайдера размером в несколько КБ"""
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "model": "deepseek-chat",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": ("слово " * tokens).strip()},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 120, "completion_tokens": tokens, "total_tokens": 120 + tokens}
+    }
+
+
+def make_prompt_tree(directory, copies):
+    """Размножает шаблоны из prompts/ во временной директории"""
+    source = os.path.join(ROOT_DIR, 'prompts')
+    for model in os.listdir(source):
+        model_dir = os.path.join(source, model)
+        if not os.path.isdir(model_dir):
+            continue
+        target_dir = os.path.join(directory, model)
+        os.makedirs(target_dir, exist_ok=True)
+        for name in os.listdir(model_dir):
+            stem, ext = os.path.splitext(name)
+            for index in range(copies):
+                shutil.copy(os.path.join(model_dir, name), os.path.join(target_dir, f"{stem}_{index}{ext}"))
+
+
+def build_cases(prompt_copies):
+    """Возвращает список случаев (имя, функция) и функцию очистки"""
+    prompts_dir = os.path.join(ROOT_DIR, 'prompts')
+    loader = init_prompt_loader(prompts_dir, watch=False, lazy=False)
+    service = DeepSeekService(DeepSeekConfig(api_key="bench"))
+    template = loader.get_prompt('deepseek', 'base')
+    compiled = compile_prompt(template)
+
+    completion = sample_completion()
+    completion_bytes = json.dumps(completion, ensure_ascii=False).encode('utf-8')
+    request_payload = service.prepare_request(MESSAGE, 'base')
+
+    tree = tempfile.mkdtemp(prefix='bench-prompts-')
+    make_prompt_tree(tree, prompt_copies)
+    tree_loader = PromptLoader(tree, watch=False)
+
+    def full_reload():
+        tree_loader._snapshot = PromptSnapshot(0, {})
+        tree_loader.load_all_prompts()
+
+    bundle_path = os.path.join(tree, 'prompts.bundle')
+    build_bundle(tree, bundle_path)
+
+    cases = [
+        ("prompt.compiled_render", lambda: compiled.render(message=MESSAGE)),
+        ("prompt.prepare_request", lambda: service.prepare_request(MESSAGE, 'base')),
+        ("prompt.prepare_request_default", lambda: service.prepare_request(MESSAGE)),
+        (f"loader.full_load_{tree_loader.snapshot.count()}_files", full_reload),
+        (f"loader.incremental_reload_{tree_loader.snapshot.count()}_files", tree_loader.load_all_prompts),
+        # Запуск с пакетом: открыть пакет и разобрать шаблоны одной модели / всех моделей
+        (f"bundle.open_first_use_{tree_loader.snapshot.count()}_files",
+         lambda: PromptLoader(tree, watch=False, bundle_path=bundle_path).get_compiled_prompt('deepseek', 'base_0')),
+        (f"bundle.full_load_{tree_loader.snapshot.count()}_files",
+         lambda: PromptLoader(tree, watch=False, bundle_path=bundle_path).ensure_loaded()),
+        ("json.encode_request", lambda: json.dumps(request_payload, ensure_ascii=False).encode('utf-8')),
+        ("json.decode_completion", lambda: json.loads(completion_bytes)),
+        ("json.encode_completion", lambda: json.dumps(completion, ensure_ascii=False).encode('utf-8')),
+        ("json.roundtrip_completion", lambda: json.dumps(json.loads(completion_bytes), ensure_ascii=False).encode('utf-8')),
+        ("passthrough.completion", lambda: RawResponse.parse(completion_bytes).usage()),
+    ]
+
+    try:
+        import orjson
+        cases.extend([
+            ("orjson.decode_completion", lambda: orjson.loads(completion_bytes)),
+            ("orjson.encode_completion", lambda: orjson.dumps(completion)),
+        ])
+    except ImportError:
+        pass
+
+    def cleanup():
+        shutil.rmtree(tree, ignore_errors=True)
+
+    return cases, cleanup
+
+
+def measure(func, repeat, min_time):
+    """Подбирает число повторов под min_time и возвращает лучшее и медианное время вызова"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    runs = sorted(timer.repeat(repeat=repeat, number=number))
+    best = runs[0] / number
+    median = runs[len(runs) // 2] / number
+    return {
+        "number": number,
+        "best_us": round(best * 1e6, 3),
+        "median_us": round(median * 1e6, 3),
+        "ops_per_sec": round(1 / best, 1) if best else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки")
+    parser.add_argument('--filter', default='', help="Запускать только случаи, содержащие подстроку")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Минимальная длительность одного замера, секунд")
+    parser.add_argument('--prompt-copies', type=int, default=50, help="Копий каждого шаблона для замера загрузчика")
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    cases, cleanup = build_cases(args.prompt_copies)
+    results = {}
+    try:
+        for name, func in cases:
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(func, args.repeat, args.min_time)
+            row = results[name]
+            print(f"{name:<45} {row['best_us']:>12.3f} us  {row['ops_per_sec']:>12} ops/s")
+    finally:
+        cleanup()
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key not in ('output', 'no_save')}
+        print(f"Результаты сохранены: {save_results('micro', results, params, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Локальный заменитель провайдера с протоколом /v1/chat/completions (OpenAI-совместимый).
+
+Поддерживает обычные и потоковые (SSE) ответы, настраиваемое распределение
+задержки, внедрение ошибок и размер ответа.
+
+Запуск:
+    python -m benchmarks.mock_upstream --port 18080 --latency lognormal:0.2:0.5 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """
+    Разбирает описание распределения задержки в секундах:
+        fixed:0.1            - постоянная
+        uniform:0.05:0.3     - равномерная на отрезке
+        normal:0.2:0.05      - нормальная (среднее, отклонение), не меньше нуля
+        lognormal:0.2:0.5    - логнормальная (медиана, сигма)
+
+    Returns:
+        callable: Функция без аргументов, возвращающая очередную задержку
+    """
+    kind, *params = spec.split(':')
+    try:
+        values = [float(param) for param in params]
+    except ValueError:
+        raise ValueError(f"Некорректные параметры задержки: {spec}")
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda: max(random.gauss(values[0], values[1]), 0.0)
+    if kind == 'lognormal' and len(values) == 2:
+        median, sigma = values
+        return lambda: random.lognormvariate(0.0, sigma) * median
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def parse_errors(spec):
+    """Разбирает список кодов ошибок с весами: '503:3,429:1,500'"""
+    codes, weights = [], []
+    for part in filter(None, spec.split(',')):
+        code, _, weight = part.partition(':')
+        codes.append(int(code))
+        weights.append(float(weight) if weight else 1.0)
+    return codes, weights
+
+
+class MockUpstream(ThreadingHTTPServer):
+    """HTTP-сервер заменителя провайдера"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency='fixed:0.05', error_rate=0.0, errors='503', response_tokens=50,
+                 stream_chunks=10, retry_after=1):
+        super().__init__(address, MockHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_codes, self.error_weights = parse_errors(errors)
+        self.response_tokens = response_tokens
+        self.stream_chunks = stream_chunks
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "streams": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def pick_error(self):
+        """Возвращает код ошибки для очередного запроса или None"""
+        if self.error_rate > 0 and self.error_codes and random.random() < self.error_rate:
+            return random.choices(self.error_codes, self.error_weights)[0]
+        return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело уходят одним пакетом, без задержки Nagle
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._send_json(404, {"error": {"message": "not found"}})
+        with self.server.lock:
+            self._send_json(200, dict(self.server.counters))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid json"}})
+
+        server = self.server
+        server.count("requests")
+        time.sleep(server.latency())
+
+        code = server.pick_error()
+        if code is not None:
+            server.count("errors")
+            headers = {"Retry-After": str(server.retry_after)} if code in (429, 503) else {}
+            return self._send_json(code, {"error": {"message": f"injected {code}"}}, headers)
+
+        tokens = int(body.get('max_tokens') or server.response_tokens)
+        tokens = min(tokens, server.response_tokens)
+        if body.get('stream'):
+            server.count("streams")
+            return self._send_stream(body, tokens)
+        return self._send_json(200, self._completion(body, tokens))
+
+    def _completion(self, body, tokens):
+        messages = body.get('messages') or []
+        prompt_tokens = sum(len(str(message.get('content', ''))) // 4 + 4 for message in messages)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'mock'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self._text(tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens
+            }
+        }
+
+    @staticmethod
+    def _text(tokens):
+        return ("слово " * tokens).strip()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        chunks = max(self.server.stream_chunks, 1)
+        per_chunk = max(tokens // chunks, 1)
+        for _ in range(chunks):
+            event = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "model": body.get('model', 'mock'),
+                "choices": [{"index": 0, "delta": {"content": self._text(per_chunk) + " "}}]
+            }
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заменитель OpenAI-совместимого провайдера")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', default='fixed:0.05', help="fixed:S | uniform:A:B | normal:M:SD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов с ошибкой")
+    parser.add_argument('--errors', default='503', help="Коды ошибок с весами, например 503:3,429:1")
+    parser.add_argument('--response-tokens', type=int, default=50, help="Размер ответа в словах")
+    parser.add_argument('--stream-chunks', type=int, default=10)
+    args = parser.parse_args()
+
+    server = MockUpstream(
+        (args.host, args.port),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        errors=args.errors,
+        response_tokens=args.response_tokens,
+        stream_chunks=args.stream_chunks
+    )
+    print(f"Заменитель провайдера слушает http://{args.host}:{args.port}/v1/chat/completions", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
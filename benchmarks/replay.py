@@ -0,0 +1,275 @@
+"""
+Воспроизведение записанного трафика /api/process (CAPTURE_FILE) с исходными
+интервалами между запросами, ускоренное в --speed раз.
+
+По умолчанию, как benchmarks.load, поднимает заменитель провайдера и сервер
+приложения. Сообщения восстанавливаются по длине: сообщения с одинаковым
+хэшем остаются одинаковыми, поэтому кэш и объединение запросов работают
+как на исходном трафике. Отчёт: пропускная способность, перцентили задержки
+(всего и по моделям), коды ответов и ошибки, отставание от расписания.
+
+    python -m benchmarks.replay logs/capture.jsonl --speed 5
+    python -m benchmarks.replay logs/capture*.jsonl* --speed 10 --latency auto --response-tokens auto
+    python -m benchmarks.replay logs/capture.jsonl --target http://127.0.0.1:5151 --server-pid 12345
+"""
+import argparse
+import glob
+import json
+import math
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .common import ProcessSampler, save_results, summarize
+from .load import start_mock, start_server, stop
+
+FILLER = "слово "
+
+
+def load_records(patterns, limit=None):
+    """
+    Читает записи из файлов (поддерживаются маски) и сортирует по времени прихода.
+    Записи без модели и запросы, не прошедшие разбор, пропускаются
+
+    Returns:
+        tuple: (записи, число пропущенных строк)
+    """
+    paths = sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+    records, skipped = [], 0
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                if not isinstance(record, dict) or not record.get("model") or "ts" not in record:
+                    skipped += 1
+                    continue
+                records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    if limit:
+        records = records[:limit]
+    return records, skipped
+
+
+def synth_text(shape, unique):
+    """
+    Текст заданной длины. Одинаковый хэш даёт одинаковый текст; без хэша
+    (режим drop) текст делается уникальным по unique
+    """
+    if not isinstance(shape, dict):
+        return shape
+    chars = int(shape.get("chars") or 0)
+    seed = f"{shape.get('hash') or unique} "
+    repeat = math.ceil(max(chars - len(seed), 0) / len(FILLER))
+    return (seed + FILLER * repeat)[:max(chars, len(seed))]
+
+
+def build_body(record, index):
+    """Тело запроса /api/process по записи; сессии воспроизводятся как обычные запросы"""
+    body = {"model": record["model"], "message": synth_text(record.get("message") or {"chars": 1}, f"r{index}")}
+    if record.get("template"):
+        body["prompt_template"] = record["template"]
+    parameters = record.get("parameters")
+    if isinstance(parameters, dict):
+        body["parameters"] = {
+            name: synth_text(value, f"r{index}.{name}") for name, value in parameters.items()
+        }
+    if record.get("stream"):
+        body["stream"] = True
+    for name in ("fallback", "hedge", "cache", "timeout"):
+        if name in record:
+            body[name] = record[name]
+    return body
+
+
+def fit_latency(records):
+    """Логнормальное распределение задержки провайдера по записанным upstream_ms"""
+    values = [
+        record["upstream_ms"] / 1000 for record in records
+        if record.get("upstream_ms") and record.get("cache") != "hit" and 200 <= record.get("status", 0) < 300
+    ]
+    if len(values) < 2:
+        return "fixed:0.05"
+    logs = [math.log(value) for value in values]
+    return f"lognormal:{math.exp(statistics.median(logs)):.4f}:{statistics.pstdev(logs):.4f}"
+
+
+def fit_response_tokens(records, default=50):
+    """Медианный размер ответа провайдера в токенах"""
+    values = [
+        record["tokens"]["completion_tokens"] for record in records
+        if isinstance(record.get("tokens"), dict) and record["tokens"].get("completion_tokens")
+    ]
+    return int(statistics.median(values)) if values else default
+
+
+def replay(target, records, speed, max_workers, sampler=None):
+    """Отправляет запросы по расписанию исходного трафика, сжатому в speed раз"""
+    url = f"{target}/api/process"
+    local = threading.local()
+    lock = threading.Lock()
+    rows = []
+
+    def send(index, record, due):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = build_body(record, index)
+        started = time.perf_counter()
+        try:
+            response = session.post(url, json=body, stream=bool(body.get("stream")), timeout=300)
+            for _ in response.iter_content(chunk_size=None):
+                pass
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            rows.append((record["model"], status, finished - started, started - due, finished, record))
+
+    base = records[0]["ts"]
+    cpu_before = sampler.cpu_seconds() if sampler else None
+    max_rss = 0
+    start = time.perf_counter() + 0.1
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='replay') as executor:
+        for index, record in enumerate(records):
+            due = start + (record["ts"] - base) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if sampler and index % 50 == 0:
+                max_rss = max(max_rss, sampler.rss_bytes())
+            executor.submit(send, index, record, due)
+    elapsed = max((row[4] for row in rows), default=start) - start
+
+    result = report(rows, records, speed, elapsed)
+    if sampler:
+        cpu = sampler.cpu_seconds() - cpu_before
+        result["server_cpu_percent"] = round(cpu / elapsed * 100, 1) if elapsed > 0 else None
+        result["server_cpu_ms_per_request"] = round(cpu / len(rows) * 1000, 3) if rows else None
+        result["server_rss_mb"] = round(max(max_rss, sampler.rss_bytes()) / 2 ** 20, 1)
+    return result
+
+
+def _is_error(status):
+    return not status.startswith('2')
+
+
+def report(rows, records, speed, elapsed):
+    span = (records[-1]["ts"] - records[0]["ts"]) / speed
+    statuses, by_model = {}, {}
+    for model, status, latency, _, _, _ in rows:
+        statuses[status] = statuses.get(status, 0) + 1
+        by_model.setdefault(model, []).append((status, latency))
+
+    # Ошибки, которых не было в исходном трафике, говорят о нехватке мощности
+    new_errors = sum(
+        1 for _, status, _, _, _, record in rows
+        if _is_error(status) and 200 <= record.get("status", 0) < 300
+    )
+    return {
+        "speed": speed,
+        "requests": len(rows),
+        "duration": round(elapsed, 3),
+        "offered_rps": round(len(rows) / span, 2) if span > 0 else None,
+        "rps": round(len(rows) / elapsed, 2) if elapsed > 0 else None,
+        "statuses": statuses,
+        "errors": sum(count for status, count in statuses.items() if _is_error(status)),
+        "new_errors": new_errors,
+        "latency_ms": summarize([row[2] for row in rows]),
+        "schedule_lag_ms": summarize([max(row[3], 0.0) for row in rows]),
+        "captured_latency_ms": summarize([
+            record["duration_ms"] / 1000 for record in records if record.get("duration_ms") is not None
+        ]),
+        "models": {
+            model: dict(
+                summarize([latency for _, latency in values]),
+                errors=sum(1 for status, _ in values if _is_error(status))
+            )
+            for model, values in sorted(by_model.items())
+        }
+    }
+
+
+def print_report(result):
+    latency, lag = result["latency_ms"], result["schedule_lag_ms"]
+    print(f"Запросов: {result['requests']} за {result['duration']} с (x{result['speed']})")
+    print(f"Поток: задано {result['offered_rps']} req/s, обслужено {result['rps']} req/s")
+    print(f"Задержка, мс: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}"
+          f"  (в записи p50 {result['captured_latency_ms']['p50']}, p95 {result['captured_latency_ms']['p95']})")
+    print(f"Отставание от расписания, мс: p95 {lag['p95']}  p99 {lag['p99']}")
+    print(f"Ошибки: {result['errors']} (новых относительно записи: {result['new_errors']}), коды: {result['statuses']}")
+    if "server_cpu_percent" in result:
+        print(f"Сервер: CPU {result['server_cpu_percent']}%, RSS {result['server_rss_mb']} MB")
+    header = f"{'model':<24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(header)
+    print('-' * len(header))
+    for model, row in result["models"].items():
+        print(f"{model:<24} {row['count']:>7} {row['p50'] or '-':>9} {row['p95'] or '-':>9} "
+              f"{row['p99'] or '-':>9} {row['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика /api/process")
+    parser.add_argument('captures', nargs='+', help="Файлы записи (CAPTURE_FILE), можно с масками")
+    parser.add_argument('--speed', type=float, default=1.0, help="Ускорение относительно записи: 1, 5, 10")
+    parser.add_argument('--limit', type=int, default=None, help="Воспроизвести только первые N запросов")
+    parser.add_argument('--max-workers', type=int, default=256, help="Наибольшее число одновременных запросов")
+    parser.add_argument('--target', default=None, help="Адрес уже запущенного сервера")
+    parser.add_argument('--server-pid', type=int, default=None, help="PID сервера для замера CPU и RSS с --target")
+    parser.add_argument('--server-cmd', default='{python} -m benchmarks.app_server --port {port}',
+                        help="Команда запуска сервера, {python} и {port} подставляются")
+    parser.add_argument('--env', action='append', default=[], help="Переменная окружения сервера NAME=VALUE")
+    parser.add_argument('--latency', default='fixed:0.05',
+                        help="Задержка заменителя провайдера; auto - по записанным upstream_ms")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--errors', default='503')
+    parser.add_argument('--response-tokens', default='50', help="Размер ответа заменителя; auto - по записи")
+    parser.add_argument('--output', default=None, help="Файл результатов (по умолчанию benchmarks/results/)")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    records, skipped = load_records(args.captures, args.limit)
+    if not records:
+        parser.error("В файлах записи нет запросов")
+    if args.latency == 'auto':
+        args.latency = fit_latency(records)
+    args.response_tokens = (
+        fit_response_tokens(records) if args.response_tokens == 'auto' else int(args.response_tokens)
+    )
+    print(f"Записей: {len(records)} (пропущено строк: {skipped}), задержка провайдера {args.latency}, "
+          f"ответ {args.response_tokens} токенов", file=sys.stderr)
+
+    mock = server = None
+    try:
+        if args.target:
+            target, pid = args.target.rstrip('/'), args.server_pid
+        else:
+            mock, upstream_url = start_mock(args)
+            server, target = start_server(args, upstream_url)
+            pid = server.pid
+        sampler = ProcessSampler(pid) if pid and ProcessSampler.available() else None
+        result = replay(target, records, args.speed, args.max_workers, sampler)
+    finally:
+        stop(server)
+        stop(mock)
+
+    print_report(result)
+    if not args.no_save:
+        params = {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'no_save', 'server_pid')
+        }
+        params["records"] = len(records)
+        print(f"Результаты сохранены: {save_results('replay', [result], params, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""
+Производственный запуск сервера.
+
+Приложение, реестр промптов и сервисы загружаются один раз в главном процессе,
+после чего он порождает воркеры через fork: они разделяют память с главным
+процессом (copy-on-write) и принимают соединения с общего слушающего сокета.
+Каждый воркер обслуживает запросы пулом потоков.
+
+    python serve.py --host 0.0.0.0 --port 5151 --workers 4 --threads 32
+
+Сигналы главному процессу:
+    SIGHUP          перечитать промпты и плавно заменить воркеры
+    SIGTERM/SIGINT  плавная остановка: воркеры дообслуживают начатые запросы
+
+Изменение файлов промптов отслеживает только главный процесс и тоже плавно
+заменяет воркеры. С --workers 0 (или без fork) сервер работает в одном процессе.
+"""
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+# Метрики воркеров сводятся через общую директорию, она должна быть задана до импорта приложения
+if hasattr(os, 'fork') and not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='neiro-metrics-')
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from app import create_app
+from app.utils.capture import get_traffic_capture
+from app.utils.log_pipeline import get_log_pipeline
+from app.utils.metrics import mark_process_dead
+from app.utils.rate_limiter import rate_limiters
+from app.utils.key_pool import key_pools
+from app.utils.yaml_loader import get_prompt_loader
+
+logger = logging.getLogger('neiro.serve')
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Закрывает keep-alive соединения, когда воркер завершает работу"""
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if self.server.draining:
+            self.close_connection = True
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI-сервер с ограниченным пулом потоков. Пока все потоки заняты,
+    новые соединения не принимаются и достаются другим воркерам
+    """
+
+    multithread = True
+    multiprocess = False
+
+    def __init__(self, host, port, app, threads, fd=None, keepalive_timeout=5.0):
+        RequestHandler.timeout = keepalive_timeout
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.threads = threads
+        self.draining = False
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def _handle_request_noblock(self):
+        if not self._slots.acquire(timeout=0.5):
+            return
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            self._slots.release()
+            return
+        thread = threading.Thread(target=self._process, args=(request, client_address), daemon=True)
+        thread.start()
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def begin_drain(self):
+        """Прекращает приём соединений, начатые запросы продолжают обслуживаться"""
+        if not self.draining:
+            self.draining = True
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def wait_drained(self, timeout):
+        """Ждёт завершения начатых запросов не дольше timeout секунд"""
+        deadline = time.monotonic() + timeout
+        acquired = 0
+        while acquired < self.threads:
+            if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                return False
+            acquired += 1
+        return True
+
+
+class RequestCounter:
+    """WSGI-обёртка, завершающая воркер после заданного числа запросов"""
+
+    def __init__(self, app, max_requests, on_limit):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        try:
+            return self.app(environ, start_response)
+        finally:
+            if self.max_requests:
+                with self._lock:
+                    self.count += 1
+                    reached = self.count == self.max_requests
+                if reached:
+                    self.on_limit()
+
+
+def bind_socket(host, port, backlog):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # Соединение принимает первый освободившийся воркер, остальные не блокируются в accept
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, args, slot):
+    """Тело воркера: обслуживает запросы до сигнала или лимита запросов"""
+    random.seed()
+    pipeline = get_log_pipeline()
+    if pipeline is not None:
+        pipeline.after_fork(f"w{slot}")
+    capture = get_traffic_capture()
+    if capture is not None:
+        capture.after_fork(f"w{slot}")
+
+    max_requests = args.max_requests
+    if max_requests and args.max_requests_jitter:
+        max_requests += random.randint(0, args.max_requests_jitter)
+
+    server = None
+
+    def drain(*_):
+        if server is not None:
+            server.begin_drain()
+
+    wsgi_app = RequestCounter(app, max_requests, drain)
+    server = PooledWSGIServer(args.host, args.port, wsgi_app, args.threads, fd=sock.fileno(),
+                              keepalive_timeout=args.keepalive)
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    logger.info(f"Воркер {slot} (pid {os.getpid()}) запущен")
+    server.serve_forever()
+    drained = server.wait_drained(args.graceful_timeout)
+    logger.info(f"Воркер {slot} (pid {os.getpid()}) остановлен после {wsgi_app.count} запросов"
+                + ("" if drained else ", не дождавшись завершения запросов"))
+    if pipeline is not None:
+        pipeline.stop()
+
+
+class Master:
+    """Главный процесс: порождает воркеры, заменяет их и следит за промптами"""
+
+    def __init__(self, app, sock, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> (слот, время запуска)
+        self.retiring = {}  # pid -> срок принудительной остановки
+        self.stopping = False
+        self.reload_requested = False
+        self.prompt_version = get_prompt_loader().version
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                run_worker(self.app, self.sock, self.args, slot)
+            except Exception:
+                logger.exception(f"Ошибка в воркере {slot}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = (slot, time.monotonic())
+
+    def retire(self, pid):
+        """Просит воркер завершиться после начатых запросов"""
+        if pid in self.workers:
+            self.workers.pop(pid)
+            self.retiring[pid] = time.monotonic() + self.args.graceful_timeout
+            self._kill(pid, signal.SIGTERM)
+
+    def rolling_restart(self, reason):
+        """Запускает новое поколение воркеров и плавно останавливает прежнее"""
+        logger.info(f"Замена воркеров: {reason}")
+        old = list(self.workers.items())
+        for pid, (slot, _) in old:
+            self.spawn(slot)
+            self.retire(pid)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        for slot in range(self.args.workers):
+            self.spawn(slot)
+        logger.info(f"Главный процесс (pid {os.getpid()}): {self.args.workers} воркеров на "
+                    f"{self.args.host}:{self.args.port}")
+
+        while not self.stopping:
+            time.sleep(0.5)
+            self._reap()
+            if self.reload_requested:
+                self.reload_requested = False
+                get_prompt_loader().load_all_prompts()
+                self.prompt_version = get_prompt_loader().version
+                self.rolling_restart("SIGHUP")
+            elif get_prompt_loader().version != self.prompt_version:
+                self.prompt_version = get_prompt_loader().version
+                self.rolling_restart(f"промпты обновлены до версии {self.prompt_version}")
+
+        self.shutdown()
+
+    def shutdown(self):
+        logger.info("Остановка воркеров")
+        for pid in list(self.workers):
+            self.retire(pid)
+        while self.retiring:
+            time.sleep(0.1)
+            self._reap()
+        self.sock.close()
+
+    def _reap(self):
+        now = time.monotonic()
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            mark_process_dead(pid)
+            self.retiring.pop(pid, None)
+            worker = self.workers.pop(pid, None)
+            if worker is None or self.stopping:
+                continue
+            slot, started = worker
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0:
+                logger.error(f"Воркер {slot} (pid {pid}) завершился с кодом {code}")
+                if now - started < 1.0:
+                    time.sleep(1.0)  # не перезапускать падающий воркер в цикле
+            self.spawn(slot)
+
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                logger.warning(f"Воркер pid {pid} не завершился вовремя, принудительная остановка")
+                self._kill(pid, signal.SIGKILL)
+                self.retiring[pid] = now + 5
+
+    @staticmethod
+    def _kill(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_reload(self, *_):
+        self.reload_requested = True
+
+    def _on_stop(self, *_):
+        self.stopping = True
+
+
+def run_single(app, sock, args):
+    """Один процесс с пулом потоков (без fork)"""
+    server = PooledWSGIServer(args.host, args.port, app, args.threads, fd=sock.fileno(),
+                              keepalive_timeout=args.keepalive)
+
+    def stop(*_):
+        server.begin_drain()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Сервер (pid {os.getpid()}) на {args.host}:{args.port}, потоков: {args.threads}")
+    server.serve_forever()
+    server.wait_drained(args.graceful_timeout)
+    sock.close()
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Производственный запуск сервера нейросетей")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5151)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', cores)),
+                        help="Число процессов-воркеров, 0 - один процесс")
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 32)),
+                        help="Потоков на воркер")
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('WEB_MAX_REQUESTS', 0)),
+                        help="Перезапускать воркер после N запросов, 0 - не перезапускать")
+    parser.add_argument('--max-requests-jitter', type=int, default=int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0)),
+                        help="Случайная добавка к --max-requests, чтобы воркеры не перезапускались разом")
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)),
+                        help="Сколько секунд ждать завершения начатых запросов при остановке")
+    parser.add_argument('--keepalive', type=float, default=5.0, help="Таймаут простоя keep-alive соединения")
+    parser.add_argument('--backlog', type=int, default=2048)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    app = create_app()
+    sock = bind_socket(args.host, args.port, args.backlog)
+
+    if args.workers <= 0 or not hasattr(os, 'fork'):
+        run_single(app, sock, args)
+        return
+
+    # Лимиты провайдеров и ключей делятся между воркерами
+    rate_limiters.set_share(1.0 / args.workers)
+    key_pools.set_share(1.0 / args.workers)
+    # Воркеры получают реестр от главного процесса, поэтому ленивая загрузка здесь не нужна:
+    # главный процесс следит за всеми промптами и заменяет воркеры при изменениях.
+    # Пакет промптов (PROMPTS_BUNDLE) воркеры разделяют через mmap, разбирают шаблоны
+    # по мере обращения и сами переходят на новый пакет при замене файла
+    if not get_prompt_loader().bundle_path:
+        get_prompt_loader().ensure_loaded()
+    # Запись трафика создаётся до fork: каждый воркер пишет свой файл
+    get_traffic_capture()
+    app.config['MASTER_PID'] = os.getpid()
+    Master(app, sock, args).run()
+
+
+if __name__ == '__main__':
+    main()